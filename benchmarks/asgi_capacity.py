@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+WSGI / ASGI 并发连接能力对比
+在进程内分别驱动 Django 的 WSGIHandler（固定大小线程池，相当于 gunicorn gthread 的工作线程）
+和 ASGIHandler（事件循环，默认线程池大小相同），模拟 N 个慢速客户端同时下载文件，
+下载进行期间持续发送会话心跳（check_session），比较全部下载完成的耗时和心跳响应延迟
+用法: python benchmarks/asgi_capacity.py [--threads 8] [--downloads 64] [--size-mb 4] [--chunk-delay 0.005]
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from wsgiref.util import setup_testing_defaults
+
+import django
+
+# 设置Django环境
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'file_transfer_system.settings')
+
+HEARTBEAT_BODY = json.dumps({'action': 'heartbeat'}).encode()
+
+
+def prepare(workdir, size):
+    """迁移临时数据库，创建用户、登录会话和一个待下载的文件"""
+    from django.contrib.auth.models import User
+    from django.core.files.base import ContentFile
+    from django.core.management import call_command
+    from django.test import Client
+    from django.urls import reverse
+    from file_transfer.models import FileTransfer
+
+    call_command('migrate', verbosity=0)
+    user = User.objects.create_user(username='bench', password='bench12345')
+    file_transfer = FileTransfer(
+        file_name='data.bin',
+        original_name='data.bin',
+        file_size=size,
+        file_type='application/octet-stream',
+        uploaded_by=user,
+    )
+    file_transfer.file_path.save('data.bin', ContentFile(os.urandom(size)), save=False)
+    file_transfer.save()
+
+    client = Client()
+    client.force_login(user)
+    cookie = f'sessionid={client.cookies["sessionid"].value}'
+    return reverse('file_transfer:file_download', args=[file_transfer.pk]), reverse('file_transfer:check_session'), cookie
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_wsgi(args, download_url, heartbeat_url, cookie):
+    from django.core.handlers.wsgi import WSGIHandler
+
+    handler = WSGIHandler()
+
+    def call(method, path, body=b'', delay=0.0):
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'HTTP_HOST': 'localhost',
+            'HTTP_COOKIE': cookie,
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': io.BytesIO(body),
+        }
+        setup_testing_defaults(environ)
+        result = handler(environ, lambda status, headers, exc_info=None: None)
+        try:
+            for _ in result:
+                # 慢速客户端：发送每一块都要等待网络
+                if delay:
+                    time.sleep(delay)
+        finally:
+            result.close()
+
+    latencies = []
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        started = time.perf_counter()
+        downloads = [pool.submit(call, 'GET', download_url, delay=args.chunk_delay) for _ in range(args.downloads)]
+        heartbeats = []
+        for _ in range(args.heartbeats):
+            time.sleep(args.heartbeat_interval)
+            submitted = time.perf_counter()
+            future = pool.submit(call, 'POST', heartbeat_url, HEARTBEAT_BODY)
+            future.add_done_callback(lambda f, t=submitted: latencies.append(time.perf_counter() - t))
+            heartbeats.append(future)
+        for future in downloads + heartbeats:
+            future.result()
+        elapsed = time.perf_counter() - started
+    return elapsed, latencies
+
+
+def run_asgi(args, download_url, heartbeat_url, cookie):
+    from django.core.handlers.asgi import ASGIHandler
+
+    handler = ASGIHandler()
+
+    async def call(method, path, body=b'', delay=0.0):
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'root_path': '',
+            'query_string': b'',
+            'headers': [
+                (b'host', b'localhost'),
+                (b'cookie', cookie.encode()),
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+            ],
+            'client': ('127.0.0.1', 50000),
+            'server': ('localhost', 80),
+        }
+        finished = asyncio.Event()
+        requested = False
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            await finished.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.body':
+                if message.get('more_body') and delay:
+                    await asyncio.sleep(delay)
+                if not message.get('more_body'):
+                    finished.set()
+
+        await handler(scope, receive, send)
+
+    async def main():
+        # 与 WSGI 线程池相同数量的线程，用于文件读取等 sync_to_async 调用
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=args.threads))
+        latencies = []
+
+        async def heartbeat():
+            submitted = time.perf_counter()
+            await call('POST', heartbeat_url, HEARTBEAT_BODY)
+            latencies.append(time.perf_counter() - submitted)
+
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(call('GET', download_url, delay=args.chunk_delay)) for _ in range(args.downloads)]
+        for _ in range(args.heartbeats):
+            await asyncio.sleep(args.heartbeat_interval)
+            tasks.append(asyncio.create_task(heartbeat()))
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - started, latencies
+
+    return asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8, help='WSGI 工作线程数 / ASGI 线程池大小')
+    parser.add_argument('--downloads', type=int, default=64, help='并发下载的慢速客户端数')
+    parser.add_argument('--size-mb', type=int, default=4)
+    parser.add_argument('--chunk-delay', type=float, default=0.005, help='客户端接收每个分块的耗时(秒)')
+    parser.add_argument('--heartbeats', type=int, default=20)
+    parser.add_argument('--heartbeat-interval', type=float, default=0.05)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        from django.conf import settings
+        settings.DATABASES['default']['NAME'] = os.path.join(workdir, 'bench.sqlite3')
+        settings.MEDIA_ROOT = os.path.join(workdir, 'media')
+        settings.ALLOWED_HOSTS = ['localhost']
+        django.setup()
+        download_url, heartbeat_url, cookie = prepare(workdir, args.size_mb * 1024 * 1024)
+
+        print(f'{args.downloads} 个慢速客户端并发下载 {args.size_mb} MB（每块等待 {args.chunk_delay * 1000:.0f} ms），'
+              f'{args.threads} 个线程，期间发送 {args.heartbeats} 次心跳')
+        print(f'{"接口":<8}{"总耗时(s)":>12}{"心跳 p50(ms)":>16}{"心跳 p95(ms)":>16}{"心跳最大(ms)":>16}')
+        for name, runner in (('WSGI', run_wsgi), ('ASGI', run_asgi)):
+            elapsed, latencies = runner(args, download_url, heartbeat_url, cookie)
+            latencies = [latency * 1000 for latency in latencies]
+            print(f'{name:<8}{elapsed:>12.2f}{statistics.median(latencies):>16.1f}'
+                  f'{percentile(latencies, 0.95):>16.1f}{max(latencies):>16.1f}')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+验证码接口基准测试
+对比每次请求实时渲染与使用预渲染池时 /captcha/ 的每秒请求数
+用法: python benchmarks/captcha_bench.py [--requests 500] [--threads 8]
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import django
+
+# 设置Django环境
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'file_transfer_system.settings')
+django.setup()
+
+from django.conf import settings
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment
+from django.urls import reverse
+
+from file_transfer import captcha
+
+
+def run(requests, threads):
+    """并发请求验证码接口，返回每秒请求数"""
+    url = reverse('file_transfer:captcha')
+
+    def worker(count):
+        client = Client()
+        for _ in range(count):
+            response = client.get(url)
+            assert response.status_code == 200
+
+    per_thread = [requests // threads] * threads
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(worker, per_thread))
+    return sum(per_thread) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    # 使用签名 Cookie 会话，避免数据库写入影响测量结果
+    with override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies', ALLOWED_HOSTS=['*']):
+        with override_settings(CAPTCHA_POOL_SIZE=0):
+            before = run(args.requests, args.threads)
+
+        with override_settings(CAPTCHA_POOL_SIZE=args.requests, CAPTCHA_POOL_LOW_WATER=0):
+            # 预热：池在服务启动后的空闲时间内填满
+            captcha.get_pool().refill()
+            after = run(args.requests, args.threads)
+
+    print(f"实时渲染: {before:8.1f} req/s")
+    print(f"预渲染池: {after:8.1f} req/s")
+    print(f"提升: {after / before:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
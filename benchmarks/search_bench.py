@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+文件历史检索基准测试
+在临时 SQLite 数据库中生成 N 条 FileTransfer 记录，对比 icontains 全表扫描与 FTS5 全文检索的查询耗时
+用法: python benchmarks/search_bench.py [--rows 1000000] [--users 100]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import django
+
+# 设置Django环境
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'file_transfer_system.settings')
+
+# 合成词表：少量常见词加大量低频词，模拟真实文件名和描述的词频分布
+COMMON_WORDS = ['report', 'invoice', 'budget', 'photo', 'holiday', 'contract', 'draft', 'final']
+RARE_WORDS = [f'{prefix}{i}' for prefix in ('proj', 'client', 'scan', 'dataset') for i in range(5000)]
+QUERIES = ['report', 'holi', 'proj42', 'client1234', 'dataset77 report', 'zzz']
+
+
+def random_words(rng, count):
+    return [rng.choice(COMMON_WORDS) if rng.random() < 0.3 else rng.choice(RARE_WORDS) for _ in range(count)]
+
+
+def seed(rows, users):
+    from django.contrib.auth.models import User
+    from django.db import transaction
+    from file_transfer.models import FileTransfer
+
+    owners = [User.objects.create(username=f'bench{i}') for i in range(users)]
+    rng = random.Random(42)
+    batch = []
+    with transaction.atomic():
+        for i in range(rows):
+            name = '_'.join(random_words(rng, 2)) + f'_{i}.pdf'
+            batch.append(FileTransfer(
+                file_name=name,
+                original_name=name,
+                file_size=rng.randint(1, 100 * 1024 * 1024),
+                file_path=f'uploads/{name}',
+                file_type='application/pdf',
+                uploaded_by=owners[i % users],
+                description=' '.join(random_words(rng, 5)),
+                tags=','.join(random_words(rng, 2)),
+            ))
+            if len(batch) == 5000:
+                FileTransfer.objects.bulk_create(batch)
+                batch = []
+        FileTransfer.objects.bulk_create(batch)
+    return owners
+
+
+def measure(queryset_factory, repeat):
+    """与历史页面相同：统计总数并取第一页，返回耗时中位数（毫秒）"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        queryset = queryset_factory()
+        queryset.count()
+        list(queryset[:20])
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    from django.conf import settings
+    settings.DATABASES['default']['NAME'] = os.path.join(workdir, 'bench.sqlite3')
+    django.setup()
+
+    from django.core.management import call_command
+    from file_transfer.models import FileTransfer
+
+    call_command('migrate', verbosity=0)
+    started = time.perf_counter()
+    owners = seed(args.rows, args.users)
+    print(f"生成 {args.rows} 条记录耗时 {time.perf_counter() - started:.1f}s")
+
+    scopes = [
+        ('单个用户', lambda: FileTransfer.objects.filter(uploaded_by=owners[0]), owners[0]),
+        ('全部记录', lambda: FileTransfer.objects.all(), None),
+    ]
+    for scope, base, owner in scopes:
+        print(f"\n[{scope}] {'查询':<20}{'icontains (ms)':>16}{'FTS5 (ms)':>12}")
+        run_queries(base, owner, args.repeat)
+
+
+def run_queries(base, owner, repeat):
+    from django.db.models import Q
+    from file_transfer.search import search_file_transfers
+
+    for query in QUERIES:
+        legacy = measure(lambda: base().filter(
+            Q(original_name__icontains=query) |
+            Q(description__icontains=query) |
+            Q(tags__icontains=query)
+        ), repeat)
+        fts = measure(lambda: search_file_transfers(base(), query, owner=owner), repeat)
+        print(f"{'':<7}{query:<20}{legacy:>16.2f}{fts:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+SQLite 并发写入压力测试
+N 个线程并发执行“先读后写”的事务（与会话保存、上传计数更新的模式相同），
+对比 Django 默认 sqlite3 后端与 file_transfer.sqlite_backend 生产模式下的锁错误数和吞吐
+用法: python benchmarks/sqlite_stress.py [--writers 16] [--iterations 100]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import django
+
+# 设置Django环境
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'file_transfer_system.settings')
+
+ENGINES = ['django.db.backends.sqlite3', 'file_transfer.sqlite_backend']
+
+
+def run(engine, path, writers, iterations):
+    from django.db import OperationalError, connections, transaction
+
+    alias = f'stress_{engine.rsplit(".", 1)[-1]}'
+    connections.settings[alias] = {
+        **connections['default'].settings_dict,
+        'ENGINE': engine,
+        'NAME': path,
+        'OPTIONS': {},
+    }
+    with connections[alias].cursor() as cursor:
+        cursor.execute('CREATE TABLE counter (id INTEGER PRIMARY KEY, value INTEGER NOT NULL)')
+        cursor.execute('INSERT INTO counter (id, value) VALUES (1, 0)')
+    connections[alias].close()
+
+    errors = []
+    barrier = threading.Barrier(writers)
+
+    def writer():
+        barrier.wait()
+        try:
+            for _ in range(iterations):
+                try:
+                    with transaction.atomic(using=alias):
+                        with connections[alias].cursor() as cursor:
+                            cursor.execute('SELECT value FROM counter WHERE id = 1')
+                            value = cursor.fetchone()[0]
+                            cursor.execute('UPDATE counter SET value = %s WHERE id = 1', [value + 1])
+                except OperationalError as exc:
+                    errors.append(exc)
+        finally:
+            connections[alias].close()
+
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    with connections[alias].cursor() as cursor:
+        cursor.execute('SELECT value FROM counter WHERE id = 1')
+        committed = cursor.fetchone()[0]
+    connections[alias].close()
+    return len(errors), committed, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=16)
+    parser.add_argument('--iterations', type=int, default=100)
+    args = parser.parse_args()
+
+    django.setup()
+    total = args.writers * args.iterations
+    print(f'{args.writers} 个并发写入线程，每个 {args.iterations} 个事务，共 {total} 个事务')
+    print(f'{"后端":<32}{"锁错误":>8}{"已提交":>8}{"耗时(s)":>10}{"事务/秒":>10}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for engine in ENGINES:
+            errors, committed, elapsed = run(engine, os.path.join(tmp, engine + '.sqlite3'), args.writers, args.iterations)
+            print(f'{engine:<32}{errors:>8}{committed:>8}{elapsed:>10.2f}{committed / elapsed:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+完整传输流程负载测试
+生成 N 个用户和 M 条文件记录（文件大小按 --sizes 给出的分布随机生成），启动本地服务器，
+由并发客户端反复执行 登录（含验证码）、仪表板、历史搜索、翻页、上传、下载、登出，
+按操作统计吞吐和 p50/p95/p99 延迟，以 JSON 输出，可用 --compare 与另一次提交的结果对比
+
+默认使用临时数据库和 MEDIA_ROOT，并在本进程中启动多线程 WSGI 服务器（与 runserver 相同）。
+--url 指定已启动的本地服务器（如 gunicorn / uvicorn）时，测试数据写入 settings 中配置的数据库，
+该服务器必须使用同一数据库（验证码从数据库中的会话读取）。
+用法: python benchmarks/workflow_load.py [--users 20] [--files 2000] [--clients 8] [--iterations 10]
+      [--sizes 4k:60,64k:30,1m:9,8m:1] [--url http://127.0.0.1:8000] [--output result.json] [--compare baseline.json]
+"""
+
+import argparse
+import datetime
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+
+import django
+
+# 设置Django环境
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(BASE_DIR))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'file_transfer_system.settings')
+
+PASSWORD = 'bench-pass-12345'
+
+WORDS = [
+    'report', 'invoice', 'budget', 'design', 'contract', 'backup', 'photo', 'meeting',
+    'release', 'draft', 'summary', 'archive', 'dataset', 'notes', 'schedule', 'export',
+]
+
+# 扩展名、内容类型、是否为文本（文本内容可压缩，其余为随机字节）
+KINDS = [
+    ('txt', 'text/plain', True),
+    ('csv', 'text/csv', True),
+    ('json', 'application/json', True),
+    ('pdf', 'application/pdf', False),
+    ('jpg', 'image/jpeg', False),
+    ('zip', 'application/zip', False),
+]
+
+# 每轮按顺序执行的操作及期望的状态码
+OPERATIONS = {
+    'login_page': 200,
+    'captcha': 200,
+    'login': 302,
+    'dashboard': 200,
+    'search': 200,
+    'paginate': 200,
+    'upload': 302,
+    'download': 200,
+    'logout': 302,
+}
+
+UNITS = {'': 1, 'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+
+def parse_size(text):
+    """解析 512、4k、1.5m 这样的大小"""
+    text = text.strip().lower()
+    unit = text[-1] if text[-1:].isalpha() else ''
+    return int(float(text[:len(text) - len(unit)]) * UNITS[unit])
+
+
+def parse_sizes(text):
+    """解析大小分布 "4k:60,64k:30"，返回 ([大小], [权重])"""
+    sizes, weights = [], []
+    for part in text.split(','):
+        size, _, weight = part.partition(':')
+        sizes.append(parse_size(size))
+        weights.append(float(weight or 1))
+    return sizes, weights
+
+
+def make_content(rng, size, text):
+    if not text:
+        return rng.randbytes(size)
+    line = ','.join(rng.choices(WORDS, k=8)).encode() + b'\n'
+    return (line * (size // len(line) + 1))[:size]
+
+
+def seed(args, rng, sizes, weights):
+    """批量生成用户和文件记录，文件内容直接写入 MEDIA_ROOT；返回 {用户名: [文件 ID]}"""
+    from django.conf import settings
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.auth.models import User
+    from django.db import transaction
+    from django.utils import timezone
+    from file_transfer import stats
+    from file_transfer.models import FileTransfer
+
+    prefix = f'bench{uuid.uuid4().hex[:6]}'
+    # 所有用户使用同一个密码哈希，避免生成时重复计算
+    password = make_password(PASSWORD)
+    User.objects.bulk_create([
+        User(username=f'{prefix}-{index}', password=password) for index in range(args.users)
+    ])
+    users = list(User.objects.filter(username__startswith=f'{prefix}-').order_by('id'))
+
+    directory = os.path.join(settings.MEDIA_ROOT, 'uploads', prefix)
+    os.makedirs(directory, exist_ok=True)
+    now = timezone.now()
+    total = 0
+    batch = []
+    with transaction.atomic():
+        for index in range(args.files):
+            extension, file_type, text = rng.choice(KINDS)
+            size = rng.choices(sizes, weights)[0]
+            name = f'{"_".join(rng.sample(WORDS, 2))}_{index}.{extension}'
+            relative = f'uploads/{prefix}/{index}-{name}'
+            with open(os.path.join(settings.MEDIA_ROOT, relative), 'wb') as f:
+                f.write(make_content(rng, size, text))
+            total += size
+            batch.append(FileTransfer(
+                file_name=name,
+                original_name=name,
+                file_size=size,
+                file_path=relative,
+                file_type=file_type,
+                status='completed',
+                uploaded_by=users[index % len(users)],
+                uploaded_at=now - datetime.timedelta(minutes=index),
+                completed_at=now,
+                description=' '.join(rng.choices(WORDS, k=5)),
+                tags=','.join(rng.sample(WORDS, 2)),
+            ))
+            if len(batch) == 1000:
+                FileTransfer.objects.bulk_create(batch)
+                batch = []
+        FileTransfer.objects.bulk_create(batch)
+    # bulk_create 不触发信号，统一重建仪表板统计
+    stats.rebuild_stats([user.pk for user in users])
+
+    files = {user.username: [] for user in users}
+    for pk, username in FileTransfer.objects.filter(uploaded_by__in=users).values_list('pk', 'uploaded_by__username'):
+        files[username].append(pk)
+    return files, total
+
+
+class Client:
+    """最简单的 HTTP 客户端：每个请求一个连接，自行维护 Cookie，不跟随重定向"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.cookies = {}
+
+    def request(self, method, path, body=None, headers=None):
+        headers = {'Host': f'{self.host}:{self.port}', **(headers or {})}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{key}={value}' for key, value in self.cookies.items())
+        if method == 'POST' and 'csrftoken' in self.cookies:
+            headers['X-CSRFToken'] = self.cookies['csrftoken']
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=120)
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            data = response.read()
+            for header in response.headers.get_all('Set-Cookie') or []:
+                for key, morsel in SimpleCookie(header).items():
+                    if morsel['max-age'] == '0' or not morsel.value:
+                        self.cookies.pop(key, None)
+                    else:
+                        self.cookies[key] = morsel.value
+        finally:
+            connection.close()
+        return response.status, data
+
+
+def multipart(fields, filename, content):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'.encode()
+    )
+    parts.append(content)
+    parts.append(f'\r\n--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Worker:
+    """一个虚拟用户，每轮按 OPERATIONS 的顺序执行一遍完整流程"""
+
+    def __init__(self, args, urls, host, port, username, file_ids, rng, sizes, weights):
+        self.args = args
+        self.urls = urls
+        self.client = Client(host, port)
+        self.username = username
+        self.file_ids = file_ids
+        self.rng = rng
+        self.sizes = sizes
+        self.weights = weights
+        self.latencies = {name: [] for name in OPERATIONS}
+        self.errors = {name: 0 for name in OPERATIONS}
+        self.bytes = {name: 0 for name in OPERATIONS}
+
+    def call(self, name, method, path, body=None, headers=None, record=True):
+        started = time.perf_counter()
+        try:
+            status, data = self.client.request(method, path, body, headers)
+        except (OSError, http.client.HTTPException):
+            status, data = None, b''
+        if record:
+            self.latencies[name].append(time.perf_counter() - started)
+            self.bytes[name] += len(data) + len(body or b'')
+            if status != OPERATIONS[name]:
+                self.errors[name] += 1
+        return status, data
+
+    def login(self, record):
+        from django.contrib.sessions.backends.db import SessionStore
+
+        self.call('login_page', 'GET', self.urls['login'], record=record)
+        self.call('captcha', 'GET', self.urls['captcha'], record=record)
+        # 测试客户端无法识别图片，直接从服务器会话中读取验证码
+        session_key = self.client.cookies.get('sessionid')
+        code = SessionStore(session_key).get('login_captcha', '') if session_key else ''
+        body = urlencode({'username': self.username, 'password': PASSWORD, 'captcha': code})
+        self.call('login', 'POST', self.urls['login'], body.encode(),
+                  {'Content-Type': 'application/x-www-form-urlencoded'}, record=record)
+
+    def iteration(self, record):
+        from django.urls import reverse
+
+        self.login(record)
+        self.call('dashboard', 'GET', self.urls['dashboard'], record=record)
+        query = urlencode({'search': self.rng.choice(WORDS)})
+        self.call('search', 'GET', f'{self.urls["history"]}?{query}', record=record)
+
+        cursor = None
+        for _ in range(self.args.pages):
+            query = urlencode({'cursor': cursor} if cursor else {})
+            status, data = self.call('paginate', 'GET', f'{self.urls["file_list"]}?{query}', record=record)
+            cursor = json.loads(data).get('next') if status == 200 else None
+            if not cursor:
+                break
+
+        size = self.rng.choices(self.sizes, self.weights)[0]
+        body, content_type = multipart(
+            {'description': 'load test', 'tags': self.rng.choice(WORDS)},
+            f'upload-{uuid.uuid4().hex[:8]}.txt',
+            make_content(self.rng, size, True),
+        )
+        self.call('upload', 'POST', self.urls['upload'], body, {'Content-Type': content_type}, record=record)
+
+        if self.file_ids:
+            file_id = self.rng.choice(self.file_ids)
+            self.call('download', 'GET', reverse('file_transfer:file_download', args=[file_id]), record=record)
+        self.call('logout', 'GET', self.urls['logout'], record=record)
+
+    def run(self):
+        # 预热轮次（冷缓存、首次连接数据库）不计入结果
+        for _ in range(self.args.warmup):
+            self.iteration(record=False)
+        for _ in range(self.args.iterations):
+            self.iteration(record=True)
+        return self
+
+
+def percentile(values, fraction):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[round(fraction * 100) - 1]
+
+
+def summarize(latencies, errors, transferred, elapsed):
+    if not latencies:
+        return {'count': 0, 'errors': errors}
+    milliseconds = [latency * 1000 for latency in latencies]
+    return {
+        'count': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'transferred_mb': round(transferred / 1024 ** 2, 2),
+        'mean_ms': round(statistics.fmean(milliseconds), 2),
+        'p50_ms': round(percentile(milliseconds, 0.50), 2),
+        'p95_ms': round(percentile(milliseconds, 0.95), 2),
+        'p99_ms': round(percentile(milliseconds, 0.99), 2),
+        'max_ms': round(max(milliseconds), 2),
+    }
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR, capture_output=True, text=True, check=True)
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BASE_DIR,
+                               capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit.stdout.strip(), bool(dirty.stdout.strip())
+
+
+def start_server():
+    """在后台线程中启动多线程 WSGI 服务器，返回 (服务器, 端口)"""
+    from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler)
+    server.set_app(get_internal_wsgi_application())
+    threading.Thread(target=server.serve_forever, name='bench-server', daemon=True).start()
+    return server, server.server_address[1]
+
+
+def compare(result, baseline_path):
+    """打印与基准结果相比各操作 p50/p95/p99 的变化，返回最大的 p95 变化比例"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f'与 {baseline["meta"].get("commit") or baseline_path} 对比：', file=sys.stderr)
+    print(f'{"操作":<12}' + ''.join(f'{key:>24}' for key in ('p50_ms', 'p95_ms', 'p99_ms')), file=sys.stderr)
+    worst = 0.0
+    for name, current in result['operations'].items():
+        previous = baseline['operations'].get(name)
+        if not previous or not previous.get('count') or not current.get('count'):
+            continue
+        cells = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            change = (current[key] - previous[key]) / previous[key] if previous[key] else 0.0
+            cells.append(f'{previous[key]:>9.1f} → {current[key]:>7.1f} {change:>+5.0%}')
+            if key == 'p95_ms':
+                worst = max(worst, change)
+        print(f'{name:<12}' + ''.join(f'{cell:>24}' for cell in cells), file=sys.stderr)
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--files', type=int, default=2000, help='预先生成的文件记录数')
+    parser.add_argument('--sizes', default='4k:60,64k:30,1m:9,8m:1', help='文件大小分布，"大小:权重" 以逗号分隔')
+    parser.add_argument('--clients', type=int, default=8, help='并发客户端数（不超过 --users）')
+    parser.add_argument('--iterations', type=int, default=10, help='每个客户端执行完整流程的轮数')
+    parser.add_argument('--warmup', type=int, default=1, help='不计入结果的预热轮数')
+    parser.add_argument('--pages', type=int, default=3, help='每轮通过游标翻页的页数')
+    parser.add_argument('--seed', type=int, default=1, help='随机数种子，相同参数生成相同的数据和操作序列')
+    parser.add_argument('--url', help='已启动的本地服务器地址，不指定时在本进程中启动')
+    parser.add_argument('--output', help='结果 JSON 的保存路径，默认输出到标准输出')
+    parser.add_argument('--compare', help='用于对比的基准结果 JSON')
+    parser.add_argument('--fail-above', type=float,
+                        help='与基准相比任一操作 p95 变慢超过该比例（如 0.2）时以状态码 1 退出')
+    args = parser.parse_args()
+    args.clients = min(args.clients, args.users)
+
+    workdir = None
+    if not args.url:
+        workdir = tempfile.mkdtemp()
+        from django.conf import settings
+        settings.DATABASES['default']['NAME'] = os.path.join(workdir, 'bench.sqlite3')
+        settings.MEDIA_ROOT = os.path.join(workdir, 'media')
+        settings.ALLOWED_HOSTS = ['127.0.0.1', 'localhost']
+        # 关闭调试模式，避免记录每条 SQL 影响结果
+        settings.DEBUG = False
+    django.setup()
+
+    server = None
+    try:
+        from django.core.management import call_command
+        from django.urls import reverse
+
+        if workdir:
+            call_command('migrate', verbosity=0)
+            server, port = start_server()
+            host = '127.0.0.1'
+        else:
+            location = urlsplit(args.url)
+            host, port = location.hostname, location.port or 80
+
+        rng = random.Random(args.seed)
+        sizes, weights = parse_sizes(args.sizes)
+        started = time.perf_counter()
+        files, seeded_bytes = seed(args, rng, sizes, weights)
+        seed_seconds = time.perf_counter() - started
+        print(f'已生成 {args.users} 个用户、{args.files} 个文件（{seeded_bytes / 1024 ** 2:.1f} MB），'
+              f'耗时 {seed_seconds:.1f}s', file=sys.stderr)
+
+        urls = {
+            'login': reverse('file_transfer:custom_login'),
+            'logout': reverse('file_transfer:custom_logout'),
+            'captcha': reverse('file_transfer:captcha'),
+            'dashboard': reverse('file_transfer:dashboard'),
+            'history': reverse('file_transfer:file_history'),
+            'file_list': reverse('file_transfer:file_list_api'),
+            'upload': reverse('file_transfer:file_upload'),
+        }
+        workers = [
+            Worker(args, urls, host, port, username, file_ids, random.Random(args.seed * 1000 + index), sizes, weights)
+            for index, (username, file_ids) in enumerate(list(files.items())[:args.clients])
+        ]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.clients) as pool:
+            list(pool.map(Worker.run, workers))
+        elapsed = time.perf_counter() - started
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    operations = {
+        name: summarize(
+            [latency for worker in workers for latency in worker.latencies[name]],
+            sum(worker.errors[name] for worker in workers),
+            sum(worker.bytes[name] for worker in workers),
+            elapsed,
+        )
+        for name in OPERATIONS
+    }
+    commit, dirty = git_revision()
+    result = {
+        'meta': {
+            'commit': commit,
+            'dirty': dirty,
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'server': args.url or 'in-process ThreadedWSGIServer',
+            'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'fail_above')},
+        },
+        'seed': {'users': args.users, 'files': args.files, 'bytes': seeded_bytes, 'seconds': round(seed_seconds, 2)},
+        'elapsed_s': round(elapsed, 2),
+        'total': summarize(
+            [latency for worker in workers for values in worker.latencies.values() for latency in values],
+            sum(sum(worker.errors.values()) for worker in workers),
+            sum(sum(worker.bytes.values()) for worker in workers),
+            elapsed,
+        ),
+        'operations': operations,
+    }
+
+    print(f'{"操作":<12}{"次数":>8}{"错误":>6}{"吞吐(req/s)":>14}{"p50(ms)":>10}{"p95(ms)":>10}{"p99(ms)":>10}', file=sys.stderr)
+    for name, item in {**operations, 'total': result['total']}.items():
+        if item['count']:
+            print(f'{name:<12}{item["count"]:>8}{item["errors"]:>6}{item["throughput_rps"]:>14.1f}'
+                  f'{item["p50_ms"]:>10.1f}{item["p95_ms"]:>10.1f}{item["p99_ms"]:>10.1f}', file=sys.stderr)
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        worst = compare(result, args.compare)
+        if args.fail_above is not None and worst > args.fail_above:
+            print(f'p95 最多变慢 {worst:.0%}，超过 {args.fail_above:.0%}', file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 from django.contrib import admin
+from . import stats
 from .models import FileTransfer
 
 @admin.register(FileTransfer)
@@ -72,16 +73,18 @@ class FileTransferAdmin(admin.ModelAdmin):
     
     def mark_as_completed(self, request, queryset):
         from django.utils import timezone
-        updated = queryset.update(status='completed', completed_at=timezone.now())
+        updated = stats.update_status(queryset, 'completed', completed_at=timezone.now())
         self.message_user(request, f'{updated} 个文件已标记为完成')
     mark_as_completed.short_description = '标记为已完成'
     
     def mark_as_failed(self, request, queryset):
-        updated = queryset.update(status='failed')
+        updated = stats.update_status(queryset, 'failed')
         self.message_user(request, f'{updated} 个文件已标记为失败')
     mark_as_failed.short_description = '标记为失败'
     
     def mark_as_processing(self, request, queryset):
-        updated = queryset.update(status='processing')
+        from django.utils import timezone
+        # 手动标记同样按认领租期计时，超时后由 worker 退回待处理
+        updated = stats.update_status(queryset, 'processing', claimed_at=timezone.now())
         self.message_user(request, f'{updated} 个文件已标记为处理中')
     mark_as_processing.short_description = '标记为处理中'
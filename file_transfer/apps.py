@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class FileTransferConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'file_transfer'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,114 @@
+"""多个文件打包为 ZIP 的流式下载
+
+ZIP 在发送过程中逐块生成，不写临时文件，也不在内存中保留整个归档：每读入一块文件内容
+就压缩并立即输出，内存占用只与分块大小和条目数（中央目录）有关，与归档总大小无关。
+
+输出流不可回写，各条目使用数据描述符记录 CRC 和长度；单个文件或归档总大小超过 4GB 时
+由 zipfile 自动写入 ZIP64 扩展。图片、音视频和压缩包等本身已压缩的内容直接存储，
+不再重复压缩。
+"""
+import logging
+import os
+import posixpath
+import zipfile
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+
+from .compression import is_compressed
+from .downloads import get_block_size
+
+logger = logging.getLogger(__name__)
+
+# 单个归档默认最多包含的文件数
+DEFAULT_MAX_FILES = 1000
+
+
+def get_max_files():
+    return getattr(settings, 'FILE_ARCHIVE_MAX_FILES', DEFAULT_MAX_FILES)
+
+
+def _date_time(file_transfer):
+    # ZIP 的时间戳不能早于 1980 年
+    uploaded = timezone.localtime(file_transfer.uploaded_at)
+    return max(uploaded.timetuple()[:6], (1980, 1, 1, 0, 0, 0))
+
+
+class _ArchiveNames:
+    """生成归档内不含路径、互不重复的条目名"""
+
+    def __init__(self):
+        self.used = set()
+
+    def __call__(self, name):
+        name = posixpath.basename(name.replace('\\', '/')).strip() or 'file'
+        base, ext = os.path.splitext(name)
+        candidate, index = name, 1
+        while candidate.lower() in self.used:
+            index += 1
+            candidate = f'{base} ({index}){ext}'
+        self.used.add(candidate.lower())
+        return candidate
+
+
+class _StreamBuffer:
+    """zipfile 的输出目标：只支持追加写入，写入的数据由生成器取走后清空"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def iter_zip(file_transfers, block_size=None):
+    """逐块生成包含 file_transfers 中各文件的 ZIP 数据，磁盘上缺失的文件被跳过"""
+    block_size = block_size or get_block_size()
+    buffer = _StreamBuffer()
+    names = _ArchiveNames()
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True) as archive:
+        for file_transfer in file_transfers:
+            path = file_transfer.file_path.path
+            try:
+                source = open(path, 'rb')
+            except OSError:
+                logger.warning('打包时跳过缺失的文件 %s (%s)', file_transfer.pk, path)
+                continue
+            with source:
+                info = zipfile.ZipInfo(names(file_transfer.original_name), _date_time(file_transfer))
+                info.compress_type = zipfile.ZIP_STORED if is_compressed(file_transfer) else zipfile.ZIP_DEFLATED
+                info.external_attr = 0o644 << 16
+                # 预先给出大小，超过 4GB 的条目从本地文件头起就使用 ZIP64
+                info.file_size = os.fstat(source.fileno()).st_size
+                with archive.open(info, 'w') as entry:
+                    while chunk := source.read(block_size):
+                        entry.write(chunk)
+                        if data := buffer.drain():
+                            yield data
+            if data := buffer.drain():
+                yield data
+    # 中央目录和结束记录
+    if data := buffer.drain():
+        yield data
+
+
+def build_archive_response(file_transfers, filename=None):
+    """以附件形式流式返回 ZIP，file_transfers 可以是惰性的迭代器"""
+    if filename is None:
+        filename = timezone.localtime().strftime('files-%Y%m%d-%H%M%S.zip')
+    response = StreamingHttpResponse(iter_zip(file_transfers), content_type='application/zip')
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    # 内容逐次生成，不允许前端代理缓冲整个归档
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,142 @@
+"""内容寻址的去重存储
+
+文件以 SHA-256 为键只存储一份，位于 MEDIA_ROOT/blobs/ab/cd/<sha256>，
+由 Blob.ref_count 记录引用它的文件记录数量，最后一个引用释放时才删除物理文件。
+
+释放最后一个引用的事务中只把引用计数减到 0，Blob 行和文件都保留；事务提交后再锁定该行，
+确认仍无引用时删除行和文件。事务回滚时记录与文件都完好无损，提交前再次上传相同内容时直接复用该 Blob。
+"""
+import os
+import tempfile
+
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .hashing import ContentHasher
+from .models import Blob
+
+BLOB_DIR = 'blobs'
+
+# 计算哈希时每次读取的字节数
+HASH_BLOCK_SIZE = 64 * 1024
+
+
+def blob_name(digest):
+    """Blob 在存储中的相对路径，两级目录分散文件"""
+    return f'{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}'
+
+
+def hash_file(fileobj):
+    """按块计算文件对象的摘要，返回 ContentHasher"""
+    hasher = ContentHasher()
+    if hasattr(fileobj, 'chunks'):
+        chunks = fileobj.chunks()
+    else:
+        chunks = iter(lambda: fileobj.read(HASH_BLOCK_SIZE), b'')
+    for chunk in chunks:
+        hasher.update(chunk)
+    return hasher
+
+
+def hash_path(path):
+    """计算本地文件的摘要，返回 ContentHasher"""
+    with open(path, 'rb') as f:
+        return hash_file(f)
+
+
+def _acquire(digest, size, write_content, discard_content):
+    """已存在相同内容时增加引用计数，否则写入新 Blob
+
+    Blob 行不存在时总是重新写入内容（原子替换），不复用磁盘上已有的同名文件：
+    该文件可能是中断写入留下的不完整内容。返回 (blob, created)。
+    """
+    with transaction.atomic():
+        # 与 release_blob 互斥：该更新会等待正在释放同一 Blob 的事务结束
+        if Blob.objects.filter(sha256=digest).update(ref_count=F('ref_count') + 1):
+            discard_content()
+            return Blob.objects.get(sha256=digest), False
+
+        name = blob_name(digest)
+        write_content(name)
+        try:
+            with transaction.atomic():
+                blob = Blob.objects.create(sha256=digest, file=name, size=size, ref_count=1)
+        except IntegrityError:
+            # 并发写入了相同内容（文件内容相同，替换无害），改为增加引用计数
+            Blob.objects.filter(sha256=digest).update(ref_count=F('ref_count') + 1)
+            return Blob.objects.get(sha256=digest), False
+        return blob, True
+
+
+def _replace_with(destination, write):
+    """在目标目录中写入临时文件后原子替换到 destination"""
+    directory = os.path.dirname(destination)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def store_uploaded_file(uploaded_file, digest=None):
+    """存储上传的文件对象，返回 (blob, created)"""
+    if digest is None:
+        digest = hash_file(uploaded_file).sha256
+        uploaded_file.seek(0)
+    size = uploaded_file.size
+
+    def write_content(name):
+        def write(f):
+            for chunk in uploaded_file.chunks():
+                f.write(chunk)
+        _replace_with(default_storage.path(name), write)
+
+    return _acquire(digest, size, write_content, lambda: None)
+
+
+def store_local_file(path, digest=None):
+    """将本地文件移动到 Blob 存储（与 MEDIA_ROOT 同一文件系统时不产生拷贝），返回 (blob, created)"""
+    if digest is None:
+        digest = hash_path(path).sha256
+    size = os.path.getsize(path)
+
+    def write_content(name):
+        destination = default_storage.path(name)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(path, destination)
+
+    def discard_content():
+        os.remove(path)
+
+    return _acquire(digest, size, write_content, discard_content)
+
+
+def release_blob(blob_id):
+    """释放一个引用，引用计数归零时在事务提交后删除 Blob 及物理文件，返回引用计数是否已归零"""
+    with transaction.atomic():
+        Blob.objects.filter(pk=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        released = Blob.objects.filter(pk=blob_id, ref_count=0).exists()
+    if released:
+        # 回调出错时只留下未引用的 Blob 和文件，不影响已提交的删除
+        transaction.on_commit(lambda: delete_unreferenced_blob(blob_id), robust=True)
+    return released
+
+
+def delete_unreferenced_blob(blob_id):
+    """锁定 Blob 行，仍没有引用时删除行和物理文件，返回是否已删除"""
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(pk=blob_id, ref_count=0).first()
+        if blob is None:
+            # 已被删除，或提交后又上传了相同内容
+            return False
+        name = blob.file.name
+        blob.delete()
+        # 在持有行锁时删除文件：并发上传相同内容的 _acquire 要等本事务提交后
+        # 才能发现 Blob 行已不存在，届时文件已经删除，会重新写入，不会被延迟的删除误删
+        default_storage.delete(name)
+    return True
@@ -0,0 +1,128 @@
+"""按用户划分的页面数据缓存
+
+仪表板统计、历史列表页和详情片段按用户缓存，键中带有该用户的版本号：
+上传、删除、修改文件记录以及后台 worker 和管理后台的状态变更都会递增版本号，
+旧版本的缓存项不再被读取，随超时自然淘汰，无需逐个删除。
+
+失效由 web 进程和独立运行的 process_uploads worker 共同触发，缓存后端必须在进程间共享，
+默认使用 CACHES['default'] 中的文件缓存（也可改用 Redis、数据库缓存）。
+进程内存缓存（LocMemCache）中一个进程的失效无法通知其他进程，使用它时不缓存页面数据，
+只有确认为单进程部署并设置 FILE_CACHE_ALLOW_PROCESS_LOCAL = True 时才启用。
+"""
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+# 默认缓存时间（秒）
+DEFAULT_TIMEOUT = 300
+
+KEY_PREFIX = 'ft'
+
+_counters = Counter()
+_counters_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[getattr(settings, 'FILE_CACHE_ALIAS', 'default')]
+
+
+def is_enabled():
+    """缓存后端是否能在进程间共享失效；进程内存缓存仅在明确允许时使用"""
+    if getattr(settings, 'FILE_CACHE_ALLOW_PROCESS_LOCAL', False):
+        return True
+    return not isinstance(get_cache(), LocMemCache)
+
+
+def get_timeout():
+    return getattr(settings, 'FILE_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def _version_key(user_id):
+    return f'{KEY_PREFIX}:ver:{user_id}'
+
+
+def _new_version():
+    # 版本号键被淘汰后以毫秒时间戳重新开始，保证不会回到已使用过的版本
+    return int(time.time() * 1000)
+
+
+def user_version(user_id):
+    cache = get_cache()
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def _bump(user_id):
+    cache = get_cache()
+    key = _version_key(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_version(), None)
+
+
+def invalidate_user(user_id):
+    """使用户的所有缓存项失效
+
+    立即失效一次，提交后再失效一次，避免并发请求在事务提交前用旧数据重新填充缓存。
+    """
+    _bump(user_id)
+    transaction.on_commit(lambda: _bump(user_id))
+
+
+def user_key(user_id, name, parts=()):
+    """缓存键：用户、版本号、缓存项名称及区分参数的摘要"""
+    digest = hashlib.md5(repr(tuple(parts)).encode(), usedforsecurity=False).hexdigest()
+    return f'{KEY_PREFIX}:{user_id}:{user_version(user_id)}:{name}:{digest}'
+
+
+def _count(name, outcome):
+    with _counters_lock:
+        _counters[(name, outcome)] += 1
+
+
+def get_or_set(user_id, name, parts, compute, timeout=None):
+    """从缓存读取 name 对应的值，未命中时调用 compute() 计算并写入，同时记录命中/未命中次数"""
+    if not is_enabled():
+        _count(name, 'misses')
+        return compute()
+    cache = get_cache()
+    key = user_key(user_id, name, parts)
+    sentinel = object()
+    value = cache.get(key, sentinel)
+    if value is not sentinel:
+        _count(name, 'hits')
+        return value
+    _count(name, 'misses')
+    value = compute()
+    cache.set(key, value, get_timeout() if timeout is None else timeout)
+    return value
+
+
+def get_stats():
+    """当前进程内各缓存项的命中/未命中次数"""
+    with _counters_lock:
+        counters = dict(_counters)
+    stats = {}
+    for (name, outcome), count in counters.items():
+        stats.setdefault(name, {'hits': 0, 'misses': 0})[outcome] = count
+    for item in stats.values():
+        total = item['hits'] + item['misses']
+        item['hit_ratio'] = round(item['hits'] / total, 4) if total else 0.0
+    return stats
+
+
+def reset_stats():
+    with _counters_lock:
+        _counters.clear()
@@ -0,0 +1,285 @@
+"""下载时按需压缩可压缩的文件
+
+文本、CSV、JSON、日志等文件下载时根据 Accept-Encoding 协商 zstd、br 或 gzip，边读边压缩输出。
+brotli 和 zstd 依赖可选的 brotli / zstandard 包，未安装时只提供 gzip。
+图片、音视频、压缩包等已压缩的内容不再压缩。
+
+被多次下载的热点文件，其压缩结果缓存在 MEDIA_ROOT/compressed/ab/<sha256>.<ext>，
+之后直接发送缓存文件，同一内容每种编码只压缩一次。缓存在压缩完整结束后才原子替换到位，
+客户端中途断开不会留下不完整的缓存。
+"""
+import os
+import tempfile
+import zlib
+
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
+
+from . import caching
+from .thumbnails import cache_key
+
+try:
+    import brotli
+except ImportError:  # 可选依赖，缺失时不提供 br 编码
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖，缺失时不提供 zstd 编码
+    zstandard = None
+
+COMPRESSED_DIR = 'compressed'
+
+# 服务端的编码优先顺序，客户端给出相同 q 值时按此顺序选择
+DEFAULT_ENCODINGS = ['zstd', 'br', 'gzip']
+
+# 小于该大小的文件压缩收益不足以抵消开销
+DEFAULT_MIN_SIZE = 1024
+
+# 同一内容和编码被下载的次数达到该值时写入磁盘缓存，0 表示不缓存
+DEFAULT_CACHE_MIN_HITS = 2
+
+# 各编码的默认压缩级别（流式压缩，偏向速度）
+DEFAULT_LEVELS = {'gzip': 6, 'br': 5, 'zstd': 3}
+
+EXTENSIONS = {'gzip': 'gz', 'br': 'br', 'zstd': 'zst'}
+
+# 按内容类型前缀判断已压缩的内容
+COMPRESSED_TYPE_PREFIXES = ('image/', 'video/', 'audio/')
+
+COMPRESSED_TYPES = {
+    'application/zip',
+    'application/gzip',
+    'application/x-gzip',
+    'application/x-bzip2',
+    'application/x-xz',
+    'application/x-7z-compressed',
+    'application/x-rar-compressed',
+    'application/vnd.rar',
+    'application/zstd',
+    'application/pdf',
+}
+
+COMPRESSED_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.avif',
+    '.mp3', '.m4a', '.aac', '.ogg', '.flac', '.mp4', '.mkv', '.mov', '.webm', '.avi',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.zst',
+    '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.epub', '.jar', '.apk', '.pdf',
+}
+
+# 可压缩的内容类型（text/* 之外）
+COMPRESSIBLE_TYPES = {
+    'application/json',
+    'application/x-ndjson',
+    'application/xml',
+    'application/javascript',
+    'application/csv',
+    'application/sql',
+    'application/x-yaml',
+    'application/yaml',
+    'image/svg+xml',
+}
+
+# 内容类型未知（application/octet-stream）时按扩展名判断
+COMPRESSIBLE_EXTENSIONS = {
+    '.txt', '.log', '.csv', '.tsv', '.json', '.ndjson', '.xml', '.md', '.html', '.htm',
+    '.js', '.css', '.yaml', '.yml', '.sql', '.ini', '.conf', '.svg',
+}
+
+
+def is_compressed(file_transfer):
+    """内容本身是否已压缩（再次压缩几乎不能减小体积，只浪费 CPU）"""
+    file_type = (file_transfer.file_type or '').lower()
+    if file_type.startswith(COMPRESSED_TYPE_PREFIXES) and file_type != 'image/svg+xml':
+        return True
+    if file_type in COMPRESSED_TYPES:
+        return True
+    return os.path.splitext(file_transfer.original_name)[1].lower() in COMPRESSED_EXTENSIONS
+
+
+def is_compressible(file_transfer):
+    """下载时是否值得压缩"""
+    if file_transfer.file_size < getattr(settings, 'FILE_COMPRESSION_MIN_SIZE', DEFAULT_MIN_SIZE):
+        return False
+    if is_compressed(file_transfer):
+        return False
+    file_type = (file_transfer.file_type or '').split(';')[0].strip().lower()
+    if file_type.startswith('text/') or file_type in COMPRESSIBLE_TYPES:
+        return True
+    if file_type.endswith(('+json', '+xml')):
+        return True
+    return os.path.splitext(file_transfer.original_name)[1].lower() in COMPRESSIBLE_EXTENSIONS
+
+
+class _BrotliCompressor:
+    def __init__(self, level):
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.finish()
+
+
+def _gzip(level):
+    # wbits=31 输出带 gzip 头和尾的数据
+    return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+
+def _brotli(level):
+    return _BrotliCompressor(level)
+
+
+def _zstd(level):
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+
+COMPRESSORS = {
+    'gzip': _gzip,
+    'br': _brotli,
+    'zstd': _zstd,
+}
+
+
+def available_encodings():
+    """按服务端优先顺序返回已启用且依赖已安装的编码"""
+    installed = {'gzip': True, 'br': brotli is not None, 'zstd': zstandard is not None}
+    return [
+        name for name in getattr(settings, 'FILE_COMPRESSION_ENCODINGS', DEFAULT_ENCODINGS)
+        if installed.get(name)
+    ]
+
+
+def parse_accept_encoding(header):
+    """解析 Accept-Encoding，返回 {编码: q 值}"""
+    accepted = {}
+    for part in header.split(','):
+        name, *params = part.strip().split(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+def negotiate(header, encodings=None):
+    """从 Accept-Encoding 中选出 q 值最高的可用编码，都不可接受时返回 None"""
+    if not header:
+        return None
+    accepted = parse_accept_encoding(header)
+    encodings = available_encodings() if encodings is None else encodings
+    best, best_q = None, 0.0
+    for name in encodings:
+        q = accepted.get(name)
+        if q is None and name == 'gzip':
+            q = accepted.get('x-gzip')
+        if q is None:
+            q = accepted.get('*', 0.0)
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def choose_encoding(request, file_transfer):
+    """文件可压缩时按请求协商编码，否则返回 None"""
+    if not is_compressible(file_transfer):
+        return None
+    return negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+
+
+def variant_path(file_transfer, encoding):
+    key = cache_key(file_transfer)
+    return os.path.join(settings.MEDIA_ROOT, COMPRESSED_DIR, key[:2], f'{key}.{EXTENSIONS[encoding]}')
+
+
+def delete_variants(key):
+    """删除指定缓存键（内容摘要）的所有压缩缓存"""
+    directory = os.path.join(settings.MEDIA_ROOT, COMPRESSED_DIR, key[:2])
+    if not os.path.isdir(directory):
+        return
+    for ext in EXTENSIONS.values():
+        try:
+            os.remove(os.path.join(directory, f'{key}.{ext}'))
+        except FileNotFoundError:
+            pass
+
+
+def _is_hot(file_transfer, encoding):
+    """记录一次压缩下载，达到 FILE_COMPRESSION_CACHE_MIN_HITS 时返回 True"""
+    min_hits = getattr(settings, 'FILE_COMPRESSION_CACHE_MIN_HITS', DEFAULT_CACHE_MIN_HITS)
+    if not min_hits:
+        return False
+    if min_hits <= 1:
+        return True
+    cache = caching.get_cache()
+    key = f'{caching.KEY_PREFIX}:zhits:{cache_key(file_transfer)}:{encoding}'
+    cache.add(key, 0, caching.get_timeout())
+    try:
+        return cache.incr(key) >= min_hits
+    except ValueError:
+        return False
+
+
+def iter_compressed(path, encoding, block_size, cache_path=None):
+    """逐块读取并压缩文件；给出 cache_path 时同时写入缓存，完整结束后才替换到位"""
+    level = getattr(settings, 'FILE_COMPRESSION_LEVELS', {}).get(encoding, DEFAULT_LEVELS[encoding])
+    compressor = COMPRESSORS[encoding](level)
+    cache_file = tmp_path = None
+    if cache_path:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix='.tmp')
+        cache_file = os.fdopen(fd, 'wb')
+    try:
+        with open(path, 'rb') as source:
+            while chunk := source.read(block_size):
+                if data := compressor.compress(chunk):
+                    if cache_file:
+                        cache_file.write(data)
+                    yield data
+        data = compressor.flush()
+        if cache_file:
+            cache_file.write(data)
+            cache_file.close()
+            os.replace(tmp_path, cache_path)
+            cache_file = None
+        yield data
+    finally:
+        # 客户端中途断开（生成器被关闭）或出错时丢弃不完整的缓存
+        if cache_file:
+            cache_file.close()
+            os.remove(tmp_path)
+
+
+def build_compressed_response(file_transfer, encoding, block_size):
+    """压缩后的完整文件响应，优先发送磁盘缓存"""
+    content_type = file_transfer.file_type or 'application/octet-stream'
+    cache_path = variant_path(file_transfer, encoding)
+    try:
+        # 直接打开而不是先检查是否存在，缓存可能随同内容的最后一个记录被并发删除
+        cached = open(cache_path, 'rb')
+    except FileNotFoundError:
+        if not _is_hot(file_transfer, encoding):
+            cache_path = None
+        response = StreamingHttpResponse(
+            iter_compressed(file_transfer.file_path.path, encoding, block_size, cache_path),
+            content_type=content_type,
+        )
+    else:
+        response = FileResponse(
+            cached,
+            as_attachment=True,
+            filename=file_transfer.original_name,
+            content_type=content_type,
+        )
+        response.block_size = block_size
+    response['Content-Encoding'] = encoding
+    return response
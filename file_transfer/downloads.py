@@ -0,0 +1,281 @@
+"""文件下载响应构建"""
+import re
+import secrets
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import (
+    content_disposition_header,
+    http_date,
+    parse_etags,
+    parse_http_date_safe,
+)
+
+from . import compression
+
+# 默认每次读取 64KB，单个下载的内存占用与文件大小无关
+DEFAULT_BLOCK_SIZE = 64 * 1024
+
+# 默认由 Django 进程自行流式发送文件
+DEFAULT_BACKEND = 'stream'
+
+# X-Accel-Redirect 模式下 nginx 中 internal location 的前缀
+DEFAULT_ACCEL_PREFIX = '/protected-media/'
+
+# 单个请求允许的最大区间数，超出时忽略 Range 返回完整文件
+MAX_RANGES = 16
+
+_RANGE_SPEC_RE = re.compile(r'^(\d*)-(\d*)$')
+
+
+def get_block_size():
+    """读取配置的下载分块大小"""
+    return getattr(settings, 'FILE_DOWNLOAD_BLOCK_SIZE', DEFAULT_BLOCK_SIZE)
+
+
+def get_etag(file_transfer):
+    """根据文件记录生成强校验 ETag，优先使用内容摘要"""
+    if file_transfer.sha256:
+        return f'"{file_transfer.sha256}"'
+    uploaded = int(file_transfer.uploaded_at.timestamp())
+    return f'"{file_transfer.id:x}-{file_transfer.file_size:x}-{uploaded:x}"'
+
+
+def get_last_modified(file_transfer):
+    """文件内容在上传后不再变化，以上传时间作为最后修改时间"""
+    return int(file_transfer.uploaded_at.timestamp())
+
+
+def parse_range_header(header, size):
+    """解析 Range 请求头
+
+    返回 (start, end) 闭区间列表；语法错误或不支持时返回 None，
+    所有区间都无法满足时返回空列表。
+    """
+    units, _, spec = header.partition('=')
+    if units.strip().lower() != 'bytes' or not spec:
+        return None
+
+    specs = [part.strip() for part in spec.split(',') if part.strip()]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for part in specs:
+        match = _RANGE_SPEC_RE.match(part)
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if first == '':
+            # 后缀区间：最后 N 个字节
+            length = int(last)
+            if length == 0 or size == 0:
+                # 空文件没有可满足的区间
+                continue
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            if start >= size:
+                continue
+            end = min(int(last), size - 1) if last else size - 1
+        ranges.append((start, end))
+    return ranges
+
+
+def _if_range_passes(request, etag, last_modified):
+    """If-Range 校验通过时才按区间返回，否则返回完整文件"""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        # If-Range 要求强比较，弱 ETag 不匹配
+        return etag in parse_etags(if_range) and not if_range.startswith('W/')
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def _iter_file_range(path, start, length, block_size):
+    """从指定偏移处按块读取 length 个字节"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(block_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _iter_multipart(path, parts, block_size, closing):
+    """依次输出 multipart/byteranges 的各个分段"""
+    for header, (start, end) in parts:
+        yield header
+        yield from _iter_file_range(path, start, end - start + 1, block_size)
+    yield closing
+
+
+def _full_response(file_transfer):
+    response = FileResponse(
+        open(file_transfer.file_path.path, 'rb'),
+        as_attachment=True,
+        filename=file_transfer.original_name,
+        content_type=file_transfer.file_type or 'application/octet-stream',
+    )
+    response.block_size = get_block_size()
+    return response
+
+
+def _single_range_response(file_transfer, start, end):
+    size = file_transfer.file_size
+    length = end - start + 1
+    response = StreamingHttpResponse(
+        _iter_file_range(file_transfer.file_path.path, start, length, get_block_size()),
+        status=206,
+        content_type=file_transfer.file_type or 'application/octet-stream',
+    )
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = str(length)
+    return response
+
+
+def _multi_range_response(file_transfer, ranges):
+    size = file_transfer.file_size
+    content_type = file_transfer.file_type or 'application/octet-stream'
+    boundary = secrets.token_hex(16)
+
+    parts = []
+    total = 0
+    for start, end in ranges:
+        header = (
+            f'\r\n--{boundary}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+        ).encode('latin-1')
+        parts.append((header, (start, end)))
+        total += len(header) + end - start + 1
+    closing = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+    total += len(closing)
+
+    response = StreamingHttpResponse(
+        _iter_multipart(file_transfer.file_path.path, parts, get_block_size(), closing),
+        status=206,
+        content_type=f'multipart/byteranges; boundary={boundary}',
+    )
+    response['Content-Length'] = str(total)
+    return response
+
+
+def _stream_backend(request, file_transfer, etag, last_modified):
+    """由 Django 进程分块发送文件内容，自行处理 Range"""
+    ranges = None
+    range_header = request.META.get('HTTP_RANGE')
+    if range_header and request.method in ('GET', 'HEAD') and _if_range_passes(request, etag, last_modified):
+        ranges = parse_range_header(range_header, file_transfer.file_size)
+
+    if ranges is None:
+        return _full_response(file_transfer)
+    if not ranges:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{file_transfer.file_size}'
+        return response
+    if len(ranges) == 1:
+        return _single_range_response(file_transfer, *ranges[0])
+    return _multi_range_response(file_transfer, ranges)
+
+
+def _offload_response(file_transfer):
+    """交给前端服务器发送的空响应，Range 由前端服务器处理"""
+    return HttpResponse(content_type=file_transfer.file_type or 'application/octet-stream')
+
+
+def _accel_redirect_backend(request, file_transfer, etag, last_modified):
+    """nginx X-Accel-Redirect：重定向到 internal location"""
+    prefix = getattr(settings, 'FILE_DOWNLOAD_ACCEL_PREFIX', DEFAULT_ACCEL_PREFIX)
+    response = _offload_response(file_transfer)
+    response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(file_transfer.file_path.name)
+    return response
+
+
+def _sendfile_backend(request, file_transfer, etag, last_modified):
+    """Apache mod_xsendfile / lighttpd：返回文件的绝对路径"""
+    response = _offload_response(file_transfer)
+    response['X-Sendfile'] = file_transfer.file_path.path
+    return response
+
+
+DOWNLOAD_BACKENDS = {
+    'stream': _stream_backend,
+    'x-accel-redirect': _accel_redirect_backend,
+    'x-sendfile': _sendfile_backend,
+}
+
+
+def get_download_backend():
+    """根据 FILE_DOWNLOAD_BACKEND 配置选择文件发送方式"""
+    name = getattr(settings, 'FILE_DOWNLOAD_BACKEND', DEFAULT_BACKEND)
+    try:
+        return DOWNLOAD_BACKENDS[name]
+    except KeyError:
+        raise ImproperlyConfigured(
+            f'FILE_DOWNLOAD_BACKEND 必须是 {", ".join(DOWNLOAD_BACKENDS)} 之一，当前为 {name!r}'
+        )
+
+
+def _negotiate_encoding(request, file_transfer, backend):
+    """由 Django 发送完整文件时协商压缩编码；Range 请求和前端服务器卸载时不压缩"""
+    if backend is not _stream_backend or request.META.get('HTTP_RANGE'):
+        return None
+    return compression.choose_encoding(request, file_transfer)
+
+
+def build_download_response(request, file_transfer):
+    """构建下载响应，支持条件请求、HTTP Range、按需压缩与前端服务器卸载"""
+    backend = get_download_backend()
+    encoding = _negotiate_encoding(request, file_transfer, backend)
+    etag = get_etag(file_transfer)
+    if encoding:
+        # 压缩后的表示与原文件字节不同，使用不同的强 ETag
+        etag = f'{etag[:-1]}-{encoding}"'
+    last_modified = get_last_modified(file_transfer)
+
+    # If-None-Match / If-Modified-Since 等条件请求
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        if encoding:
+            response = compression.build_compressed_response(file_transfer, encoding, get_block_size())
+        else:
+            response = backend(request, file_transfer, etag, last_modified)
+        if response.status_code != 416 and 'Content-Disposition' not in response:
+            response['Content-Disposition'] = content_disposition_header(True, file_transfer.original_name)
+
+    if backend is _stream_backend and compression.is_compressible(file_transfer):
+        patch_vary_headers(response, ['Accept-Encoding'])
+    # 压缩后的表示长度未知，不支持按区间续传（Range 请求返回未压缩的原文件区间）
+    response['Accept-Ranges'] = 'none' if encoding else 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+async def _aiter_blocks(iterator):
+    """在线程池中逐块推进同步迭代器（读文件、压缩），两次读取之间不占用线程"""
+    next_block = sync_to_async(next, thread_sensitive=False)
+    while (block := await next_block(iterator, None)) is not None:
+        yield block
+
+
+def stream_asynchronously(response):
+    """将同步的流式响应改为异步迭代，供 ASGI 下的异步视图使用
+
+    WSGI 服务器只能同步迭代响应，异步迭代器会被整体读入内存，因此只应在 ASGI 请求中调用。
+    文件句柄和生成器仍由响应的 close() 关闭。
+    """
+    if response.streaming and not response.is_async:
+        response.streaming_content = _aiter_blocks(iter(response.streaming_content))
+    return response
@@ -1,8 +1,28 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
+from django.db import transaction
+from .blobstore import hash_file, store_local_file, store_uploaded_file
 from .models import FileTransfer
 
+# 上传文件大小限制（100MB）
+MAX_UPLOAD_SIZE = 100 * 1024 * 1024
+
+# 禁止上传的可执行文件扩展名
+BLOCKED_EXTENSIONS = ['.exe', '.bat', '.cmd', '.com', '.pif', '.scr', '.vbs', '.js']
+
+def validate_upload(name, size):
+    """校验上传文件的名称和大小，普通上传与分块上传共用"""
+    # 检查文件大小（限制为100MB）
+    if size > MAX_UPLOAD_SIZE:
+        raise forms.ValidationError('文件大小不能超过100MB')
+    
+    # 检查文件类型（可选的安全检查）
+    file_extension = name.lower()
+    for ext in BLOCKED_EXTENSIONS:
+        if file_extension.endswith(ext):
+            raise forms.ValidationError('不允许上传可执行文件')
+
 class UserRegistrationForm(UserCreationForm):
     """用户注册表单"""
     email = forms.EmailField(required=True, help_text='必填。请输入有效的邮箱地址。')
@@ -60,16 +80,7 @@ class FileUploadForm(forms.ModelForm):
     def clean_file(self):
         file = self.cleaned_data.get('file')
         if file:
-            # 检查文件大小（限制为100MB）
-            if file.size > 100 * 1024 * 1024:
-                raise forms.ValidationError('文件大小不能超过100MB')
-            
-            # 检查文件类型（可选的安全检查）
-            allowed_extensions = ['.exe', '.bat', '.cmd', '.com', '.pif', '.scr', '.vbs', '.js']
-            file_extension = file.name.lower()
-            for ext in allowed_extensions:
-                if file_extension.endswith(ext):
-                    raise forms.ValidationError('不允许上传可执行文件')
+            validate_upload(file.name, file.size)
         
         return file
     
@@ -79,9 +90,28 @@ class FileUploadForm(forms.ModelForm):
         instance.original_name = self.cleaned_data['file'].name
         instance.file_name = self.cleaned_data['file'].name
         instance.file_size = self.cleaned_data['file'].size
-        instance.file_path = self.cleaned_data['file']
         instance.file_type = self.cleaned_data['file'].content_type
         
+        # 摘要由上传处理器在接收数据时计算，未配置处理器时才重新读取文件
+        uploaded_file = self.cleaned_data['file']
+        if getattr(uploaded_file, 'sha256', None):
+            instance.sha256 = uploaded_file.sha256
+            instance.crc32 = uploaded_file.crc32
+        else:
+            hasher = hash_file(uploaded_file)
+            uploaded_file.seek(0)
+            instance.sha256 = hasher.sha256
+            instance.crc32 = hasher.crc32
+        
         if commit:
-            instance.save()
+            with transaction.atomic():
+                # 相同内容只存储一份，文件记录指向共享的 Blob；
+                # 已写入暂存目录的文件直接移动过去，不再拷贝
+                staged_path = getattr(uploaded_file, 'staged_path', None)
+                if staged_path:
+                    instance.blob, _ = store_local_file(staged_path, digest=instance.sha256)
+                else:
+                    instance.blob, _ = store_uploaded_file(uploaded_file, digest=instance.sha256)
+                instance.file_path.name = instance.blob.file.name
+                instance.save()
         return instance
\ No newline at end of file
@@ -0,0 +1,36 @@
+"""文件内容摘要的增量计算"""
+import hashlib
+import zlib
+
+from django.conf import settings
+
+
+def crc32_enabled():
+    """是否额外计算 CRC32 快速校验值"""
+    return getattr(settings, 'FILE_UPLOAD_COMPUTE_CRC32', True)
+
+
+class ContentHasher:
+    """逐块更新的 SHA-256 与可选 CRC32 摘要"""
+
+    def __init__(self):
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        self._crc32 = 0 if crc32_enabled() else None
+
+    def update(self, data):
+        self.size += len(data)
+        self._sha256.update(data)
+        if self._crc32 is not None:
+            self._crc32 = zlib.crc32(data, self._crc32)
+
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+    @property
+    def crc32(self):
+        """8 位十六进制 CRC32，未启用时为空字符串"""
+        if self._crc32 is None:
+            return ''
+        return f'{self._crc32:08x}'
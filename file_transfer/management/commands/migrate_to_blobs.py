@@ -0,0 +1,53 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from file_transfer.blobstore import hash_path, store_local_file
+from file_transfer.caching import invalidate_user
+from file_transfer.models import Blob, FileTransfer
+
+
+class Command(BaseCommand):
+    help = '将旧版本上传的文件迁移到内容寻址的去重存储，并报告回收的空间'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='只统计可回收空间，不修改文件和数据库')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        migrated = deduplicated = missing = 0
+        reclaimed = 0
+        seen = set(Blob.objects.values_list('sha256', flat=True))
+
+        for file_transfer in FileTransfer.objects.filter(blob__isnull=True).iterator():
+            path = file_transfer.file_path.path
+            if not os.path.exists(path):
+                missing += 1
+                self.stderr.write(f'文件不存在，已跳过: {file_transfer.file_path.name}')
+                continue
+
+            hasher = hash_path(path)
+            if hasher.sha256 in seen:
+                deduplicated += 1
+                reclaimed += hasher.size
+            seen.add(hasher.sha256)
+            migrated += 1
+            if dry_run:
+                continue
+
+            with transaction.atomic():
+                blob, _ = store_local_file(path, digest=hasher.sha256)
+                FileTransfer.objects.filter(pk=file_transfer.pk).update(
+                    blob=blob,
+                    file_path=blob.file.name,
+                    sha256=hasher.sha256,
+                    crc32=hasher.crc32,
+                )
+                invalidate_user(file_transfer.uploaded_by_id)
+
+        prefix = '[dry-run] ' if dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}迁移 {migrated} 个文件，其中 {deduplicated} 个为重复内容，'
+            f'回收空间 {reclaimed} 字节，缺失 {missing} 个文件'
+        ))
@@ -0,0 +1,50 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from file_transfer.processing import run_worker
+from file_transfer.upload_handlers import purge_stale_incoming
+
+
+class Command(BaseCommand):
+    help = '启动后台 worker 处理待处理的上传文件（摘要校验、MIME 识别、缩略图生成）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help='并发 worker 数量')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='没有待处理记录时的轮询间隔（秒）')
+        parser.add_argument('--once', action='store_true', help='处理完当前待处理记录后退出')
+
+    def handle(self, *args, **options):
+        # 启动时清理此前进程崩溃遗留的上传暂存文件
+        stale = purge_stale_incoming()
+        if stale:
+            self.stdout.write(f'已清理 {stale} 个遗留的上传暂存文件')
+
+        stop_event = threading.Event()
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(sig, lambda *_: stop_event.set())
+
+        worker_args = (stop_event, options['poll_interval'], options['once'])
+        if options['workers'] <= 1:
+            processed = run_worker(*worker_args)
+        else:
+            results = []
+
+            def target():
+                try:
+                    results.append(run_worker(*worker_args))
+                finally:
+                    # 每个线程持有独立的数据库连接，退出时关闭
+                    connection.close()
+
+            threads = [threading.Thread(target=target, daemon=True) for _ in range(options['workers'])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            processed = sum(results)
+
+        self.stdout.write(self.style.SUCCESS(f'共处理 {processed} 个文件'))
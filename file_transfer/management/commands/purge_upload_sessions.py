@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from file_transfer.upload_handlers import purge_stale_incoming
+from file_transfer.uploads import purge_expired_sessions
+
+
+class Command(BaseCommand):
+    help = '删除过期仍未完成的分块上传会话及其暂存文件、普通上传遗留的暂存文件（可由 cron 定期执行）'
+
+    def handle(self, *args, **options):
+        purged = purge_expired_sessions()
+        stale = purge_stale_incoming()
+        self.stdout.write(self.style.SUCCESS(f'已清理 {purged} 个过期的上传会话，{stale} 个遗留的暂存文件'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from file_transfer.stats import diff_stats, rebuild_stats
+
+
+class Command(BaseCommand):
+    help = '从文件记录重新计算各用户的统计计数，并报告与现有计数不一致的用户'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids', help='只处理指定用户 ID，可重复')
+        parser.add_argument('--dry-run', action='store_true', help='只检查一致性，不修改计数')
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids']
+        mismatched = diff_stats(user_ids)
+        for user_id in sorted(mismatched):
+            self.stderr.write(f'用户 {user_id} 的统计计数与文件记录不一致')
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'[dry-run] {len(mismatched)} 个用户的统计计数不一致'))
+            return
+
+        rebuilt = rebuild_stats(user_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'已重建 {rebuilt} 个用户的统计计数，其中 {len(mismatched)} 个用户的计数不一致'
+        ))
@@ -0,0 +1,162 @@
+import collections
+import json
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from file_transfer import routers
+from file_transfer.caching import invalidate_user
+from file_transfer.models import FileTransfer
+from file_transfer.storage import ShardedFileSystemStorage, is_sharded
+
+# MEDIA_ROOT 下记录待删除旧路径的文件，每行一个 JSON：[可删除的时间戳, 旧文件名]
+JOURNAL_NAME = '.shard_storage_pending'
+
+
+def link_or_copy(source, destination):
+    """为文件建立硬链接；跨文件系统等无法链接时复制到临时文件后原子替换"""
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    try:
+        os.link(source, destination)
+    except OSError:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(destination), suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copy2(source, tmp_path)
+            os.replace(tmp_path, destination)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+class Command(BaseCommand):
+    help = '将按日期目录存储的旧文件在线迁移到哈希分散的目录布局'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='只统计需要迁移的文件，不修改文件和数据库')
+        parser.add_argument('--grace', type=float, default=60.0,
+                            help='更新记录后保留旧路径的秒数，覆盖已读取旧路径的请求和副本复制延迟')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        grace = options['grace']
+        storage = ShardedFileSystemStorage()
+        self.journal_path = storage.path(JOURNAL_NAME)
+        moved = missing = 0
+        # 删除前确认旧路径不再被引用，读取主库
+        routers.pin_to_primary()
+        # (可删除的时间戳, 旧文件名)，按可删除时间排列；先于记录切换写入日志，
+        # 进程中断后下次运行时继续删除上次遗留的旧路径
+        pending = collections.deque() if dry_run else self._load_journal()
+
+        stop_event = threading.Event()
+        previous_handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                previous_handlers[sig] = signal.signal(sig, lambda *_: stop_event.set())
+
+        try:
+            # 同一路径可能被多条记录引用，按路径整体迁移
+            names = (
+                FileTransfer.objects.filter(blob__isnull=True)
+                .values_list('file_path', flat=True)
+                .distinct()
+                .order_by('file_path')
+            )
+            for old_name in names.iterator():
+                if stop_event.is_set():
+                    break
+                if not old_name or is_sharded(old_name):
+                    continue
+                old_path = storage.path(old_name)
+                if not os.path.exists(old_path):
+                    missing += 1
+                    self.stderr.write(f'文件不存在，已跳过: {old_name}')
+                    continue
+                moved += 1
+                if dry_run:
+                    continue
+
+                new_name = storage.get_available_name(storage.shard(old_name))
+                new_path = storage.path(new_name)
+                # 先让新路径可用，再切换记录；切换前后两个路径指向同一文件
+                link_or_copy(old_path, new_path)
+                user_ids = list(
+                    FileTransfer.objects.filter(file_path=old_name, blob__isnull=True)
+                    .order_by()
+                    .values_list('uploaded_by_id', flat=True)
+                    .distinct()
+                )
+                entry = (time.time() + grace, old_name)
+                self._append_journal(entry)
+                updated = FileTransfer.objects.filter(file_path=old_name, blob__isnull=True).update(file_path=new_name)
+                if not updated:
+                    # 迁移期间记录已被删除或修改
+                    os.remove(new_path)
+                    moved -= 1
+                    continue
+                for user_id in user_ids:
+                    invalidate_user(user_id)
+                pending.append(entry)
+                self._remove_expired(storage, pending)
+
+            # 等待最后一批旧路径的保留时间结束，收到 SIGINT/SIGTERM 时立即退出
+            while pending and not stop_event.is_set():
+                stop_event.wait(max(0.0, pending[0][0] - time.time()))
+                self._remove_expired(storage, pending)
+        finally:
+            if not dry_run:
+                self._remove_expired(storage, pending)
+                self._save_journal(pending)
+            for sig, handler in previous_handlers.items():
+                signal.signal(sig, handler)
+
+        prefix = '[dry-run] ' if dry_run else ''
+        self.stdout.write(self.style.SUCCESS(f'{prefix}迁移 {moved} 个文件，缺失 {missing} 个文件'))
+        if pending:
+            self.stdout.write(f'已中断，{len(pending)} 个旧路径将在下次运行时删除')
+
+    def _load_journal(self):
+        try:
+            with open(self.journal_path) as f:
+                entries = [tuple(json.loads(line)) for line in f if line.strip()]
+        except FileNotFoundError:
+            return collections.deque()
+        return collections.deque(sorted(entries))
+
+    def _append_journal(self, entry):
+        with open(self.journal_path, 'a') as f:
+            f.write(json.dumps(list(entry), ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _save_journal(self, pending):
+        """用剩余的待删除路径重写日志，全部删除后移除日志"""
+        if not pending:
+            try:
+                os.remove(self.journal_path)
+            except FileNotFoundError:
+                pass
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.journal_path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            for entry in pending:
+                f.write(json.dumps(list(entry), ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self.journal_path)
+
+    def _remove_expired(self, storage, pending):
+        now = time.time()
+        while pending and pending[0][0] <= now:
+            _, name = pending.popleft()
+            # 记录切换失败时旧路径仍被引用，保留文件
+            if FileTransfer.objects.filter(file_path=name).exists():
+                continue
+            try:
+                os.remove(storage.path(name))
+            except FileNotFoundError:
+                pass
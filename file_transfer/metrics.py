@@ -0,0 +1,342 @@
+"""请求级性能指标
+
+RequestMetricsMiddleware 按 URL 名称（如 file_transfer:dashboard）记录每个请求的耗时、
+数据库查询次数与耗时、收发字节数，验证码渲染耗时在 captcha.render_captcha 中记录。
+数值累积在进程内固定分桶的直方图中，更新只需一次二分查找和加锁计数，内存占用与请求数无关；
+分位数由分桶线性插值估算（与 Prometheus 的 histogram_quantile 相同）。
+
+数据库查询通过在每个连接的 execute_wrappers 中安装包装函数统计，当前请求的统计对象保存在
+contextvars 中，因此异步视图经 sync_to_async 在其他线程执行的查询也计入发起请求。
+
+指标只统计当前进程，多进程部署时由 Prometheus 分别抓取各进程后汇总。
+"""
+import bisect
+import contextvars
+import logging
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import caching
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'file_transfer_'
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+CAPTCHA_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+# 名称: (类型, 说明, 分桶)
+METRICS = {
+    'requests_total': ('counter', '请求数', None),
+    'request_duration_seconds': ('histogram', '请求处理耗时（秒，流式响应为返回响应对象的时间）', DURATION_BUCKETS),
+    'request_db_queries': ('histogram', '每个请求的数据库查询次数', QUERY_COUNT_BUCKETS),
+    'request_db_duration_seconds': ('histogram', '每个请求的数据库查询总耗时（秒）', DURATION_BUCKETS),
+    'request_received_bytes_total': ('counter', '接收的请求体字节数', None),
+    'response_sent_bytes_total': ('counter', '发送的响应体字节数', None),
+    'captcha_render_seconds': ('histogram', '验证码渲染耗时（秒）', CAPTCHA_BUCKETS),
+}
+
+# 慢请求日志中保留的最慢查询数
+SLOW_QUERY_SAMPLES = 3
+
+UNRESOLVED = '<unresolved>'
+
+
+class Histogram:
+    """固定分桶的直方图，buckets 为各桶的上界（升序），最后隐含 +Inf 桶"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """[(上界, 累计次数)]，最后一项上界为 inf"""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q):
+        """按分桶线性插值估算分位数，落在 +Inf 桶时返回最大的有限上界"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        lower, previous = 0.0, 0
+        for bound, total in self.cumulative():
+            if total >= rank:
+                if bound == float('inf'):
+                    return self.buckets[-1]
+                in_bucket = total - previous
+                return lower + (bound - lower) * ((rank - previous) / in_bucket if in_bucket else 0)
+            lower, previous = bound, total
+        return self.buckets[-1]
+
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    with _lock:
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram(METRICS[name][2])
+        histogram.observe(value)
+
+
+def get_histogram(name, **labels):
+    """返回直方图的快照，没有数据时返回 None"""
+    with _lock:
+        histogram = _histograms.get(_key(name, labels))
+        if histogram is None:
+            return None
+        snapshot = Histogram(histogram.buckets)
+        snapshot.counts = list(histogram.counts)
+        snapshot.sum, snapshot.count = histogram.sum, histogram.count
+        return snapshot
+
+
+def get_counter(name, **labels):
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def is_enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+def get_slow_request_seconds():
+    """超过该耗时的请求记录日志，None 表示不记录"""
+    return getattr(settings, 'METRICS_SLOW_REQUEST_SECONDS', None)
+
+
+def get_slow_request_sample_rate():
+    return getattr(settings, 'METRICS_SLOW_REQUEST_SAMPLE_RATE', 1.0)
+
+
+class RequestStats:
+    """单个请求的数据库查询统计，keep_slowest 为 True 时保留最慢的几条 SQL 供慢请求日志使用"""
+
+    def __init__(self, keep_slowest=False):
+        self.queries = 0
+        self.db_time = 0.0
+        self.keep_slowest = keep_slowest
+        self.slowest = []
+
+    def record_query(self, sql, duration):
+        self.queries += 1
+        self.db_time += duration
+        if self.keep_slowest:
+            self.slowest.append((duration, sql))
+            self.slowest.sort(key=lambda item: item[0], reverse=True)
+            del self.slowest[SLOW_QUERY_SAMPLES:]
+
+
+_current = contextvars.ContextVar('file_transfer_request_stats', default=None)
+
+
+def record_queries(execute, sql, params, many, context):
+    """安装在每个数据库连接上的 execute 包装函数，只在请求上下文中计时"""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.record_query(sql, time.perf_counter() - started)
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    """connection_created 信号处理器：为新建的数据库连接安装查询计时"""
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match and match.view_name else UNRESOLVED
+
+
+def _received_bytes(request):
+    try:
+        return int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return 0
+
+
+def _count_sent(iterator, view):
+    sent = 0
+    try:
+        for chunk in iterator:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        inc('response_sent_bytes_total', sent, view=view)
+
+
+async def _acount_sent(iterator, view):
+    sent = 0
+    try:
+        async for chunk in iterator:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        inc('response_sent_bytes_total', sent, view=view)
+
+
+class RequestMetricsMiddleware:
+    """记录每个请求的耗时、数据库查询和收发字节数
+
+    应放在 MIDDLEWARE 的最前面，使耗时包含其他中间件。流式响应的发送字节数在内容发送完毕后计入；
+    带有 Content-Length 的文件响应直接按该长度计入，不包装迭代器（保留 wsgi.file_wrapper 优化）。
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not is_enabled():
+            return self.get_response(request)
+
+        stats = RequestStats(keep_slowest=get_slow_request_seconds() is not None)
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, stats, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        if not is_enabled():
+            return await self.get_response(request)
+
+        stats = RequestStats(keep_slowest=get_slow_request_seconds() is not None)
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, stats, time.perf_counter() - started)
+
+    def _finish(self, request, response, stats, duration):
+        view = _view_name(request)
+        inc('requests_total', view=view, status=f'{response.status_code // 100}xx')
+        observe('request_duration_seconds', duration, view=view)
+        observe('request_db_queries', stats.queries, view=view)
+        observe('request_db_duration_seconds', stats.db_time, view=view)
+        inc('request_received_bytes_total', _received_bytes(request), view=view)
+
+        if not response.streaming:
+            inc('response_sent_bytes_total', len(response.content), view=view)
+        elif response.has_header('Content-Length'):
+            inc('response_sent_bytes_total', int(response['Content-Length']), view=view)
+        elif response.is_async:
+            response.streaming_content = _acount_sent(response.streaming_content, view)
+        else:
+            response.streaming_content = _count_sent(response.streaming_content, view)
+
+        threshold = get_slow_request_seconds()
+        if threshold is not None and duration >= threshold and random.random() < get_slow_request_sample_rate():
+            logger.warning(
+                '慢请求 %s %s (%s): %.3fs，%d 次查询共 %.3fs；最慢的查询：%s',
+                request.method, request.path, view, duration, stats.queries, stats.db_time,
+                '; '.join(f'{query_time * 1000:.1f}ms {sql[:200]}' for query_time, sql in stats.slowest) or '无',
+            )
+        return response
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value)
+
+
+def render_prometheus():
+    """以 Prometheus 文本格式（0.0.4）导出当前进程的全部指标，包括页面缓存命中统计"""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {
+            key: (histogram.cumulative(), histogram.sum, histogram.count)
+            for key, histogram in _histograms.items()
+        }
+
+    lines = []
+    for name, (kind, help_text, _) in METRICS.items():
+        full_name = PREFIX + name
+        lines.append(f'# HELP {full_name} {help_text}')
+        lines.append(f'# TYPE {full_name} {kind}')
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{full_name}{_labels(labels)} {_format_number(value)}')
+            continue
+        for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, cumulative in buckets:
+                lines.append(f'{full_name}_bucket{_labels(labels + (("le", _format_number(float(bound))),))} {cumulative}')
+            lines.append(f'{full_name}_sum{_labels(labels)} {_format_number(total)}')
+            lines.append(f'{full_name}_count{_labels(labels)} {count}')
+
+    cache_stats = caching.get_stats()
+    for outcome in ('hits', 'misses'):
+        full_name = f'{PREFIX}page_cache_{outcome}_total'
+        lines.append(f'# HELP {full_name} 页面缓存{"命中" if outcome == "hits" else "未命中"}次数')
+        lines.append(f'# TYPE {full_name} counter')
+        for cache_name, item in sorted(cache_stats.items()):
+            lines.append(f'{full_name}{_labels((("cache", cache_name),))} {item[outcome]}')
+    return '\n'.join(lines) + '\n'
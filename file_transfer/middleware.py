@@ -1,66 +1,253 @@
+import datetime
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.utils import timezone
-from django.contrib.auth import logout
+from django.contrib.auth import alogout, logout
 from django.shortcuts import redirect
 from django.urls import reverse
 from django.conf import settings
-import json
+from django.http import JsonResponse
+
+from . import routers
+
+# 默认5分钟无操作自动登出
+DEFAULT_INACTIVITY_TIMEOUT = 300
+
+# 默认活动时间的记录粒度（秒），存储的时间戳不足该间隔时不写会话
+DEFAULT_ACTIVITY_GRANULARITY = 30
+
+# 未写入会话的请求时间记录在签名 Cookie 中
+ACTIVITY_COOKIE_NAME = 'ft_activity'
+ACTIVITY_COOKIE_SALT = 'file_transfer.activity'
+
+
+def get_inactivity_timeout():
+    return getattr(settings, 'SESSION_INACTIVITY_TIMEOUT', DEFAULT_INACTIVITY_TIMEOUT)
+
+
+def get_activity_granularity():
+    return getattr(settings, 'SESSION_ACTIVITY_GRANULARITY', DEFAULT_ACTIVITY_GRANULARITY)
+
+
+def touch_activity(request, last_activity=None, now=None):
+    """记录最后活动时间，只有存储值早于记录粒度时才修改会话（从而触发一次会话写入）"""
+    now = now or timezone.now()
+    if last_activity is None:
+        last_activity = request.session.get('last_activity')
+        if last_activity:
+            try:
+                last_activity = timezone.datetime.fromisoformat(last_activity)
+            except (ValueError, TypeError):
+                last_activity = None
+    if last_activity is None or (now - last_activity).total_seconds() >= get_activity_granularity():
+        request.session['last_activity'] = now.isoformat()
+        return True
+    return False
+
+
+def parse_activity(value):
+    """解析会话中的最后活动时间，格式错误时返回 None"""
+    try:
+        return timezone.datetime.fromisoformat(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def get_last_activity(request, last_activity):
+    """用户实际的最后请求时间
+
+    按粒度节流时，会话中的时间戳之后可能还有未写入会话的请求，这些请求的时间记录在签名 Cookie 中。
+    Cookie 绑定用户和会话中的时间戳，且只在粒度范围内有效，会话写入新的时间戳后自动失效。
+    """
+    value = request.get_signed_cookie(ACTIVITY_COOKIE_NAME, default=None, salt=ACTIVITY_COOKIE_SALT)
+    if not value or last_activity is None:
+        return last_activity
+    try:
+        user_id, anchor, seen = value.split('|')
+        seen = float(seen)
+    except ValueError:
+        return last_activity
+    if user_id != str(request.user.pk) or anchor != str(last_activity.timestamp()):
+        return last_activity
+    offset = seen - last_activity.timestamp()
+    if not 0 < offset < get_activity_granularity():
+        return last_activity
+    return last_activity + datetime.timedelta(seconds=offset)
+
+
+def set_activity_cookie(response, request, last_activity, now):
+    """本次请求未写入会话时，在 Cookie 中记录请求时间"""
+    response.set_signed_cookie(
+        ACTIVITY_COOKIE_NAME,
+        f'{request.user.pk}|{last_activity.timestamp()}|{now.timestamp()}',
+        salt=ACTIVITY_COOKIE_SALT,
+        max_age=get_inactivity_timeout() + get_activity_granularity(),
+        httponly=True,
+        samesite='Lax',
+    )
+    return response
+
+
+async def atouch_activity(request, now=None):
+    """touch_activity 的异步版本：先通过异步接口加载会话，之后的读写不再访问会话存储"""
+    await request.session.aget('last_activity')
+    return touch_activity(request, now=now)
+
+
+def _resolved(user):
+    async def auser():
+        return user
+    return auser
+
+
+class SessionActivityMiddleware:
+    """会话超时与用户活动跟踪中间件
+
+    每个请求最多修改一次会话中的 last_activity，且只在存储的时间戳早于
+    SESSION_ACTIVITY_GRANULARITY 时修改，避免每个请求都写入会话存储。
+    未写入会话的请求时间记录在签名 Cookie 中，超时按实际的最后请求时间计算。
+    不依赖数据库会话，可配合缓存或签名 Cookie 会话引擎使用。
+    同时支持同步和异步调用，ASGI 下不会为每个请求切换到线程池执行。
+    """
+
+    sync_capable = True
+    async_capable = True
 
-class SessionTimeoutMiddleware:
-    """会话超时中间件"""
-    
     def __init__(self, get_response):
         self.get_response = get_response
-    
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _expired_response(self, request):
+        # 对于AJAX请求，返回JSON响应
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return JsonResponse({
+                'status': 'expired',
+                'message': 'Session expired due to inactivity',
+                'redirect_url': reverse('file_transfer:custom_login')
+            }, status=401)
+        # 对于普通请求，重定向到登录页
+        return redirect('file_transfer:custom_login')
+
+    def _check(self, request, last_activity, now):
+        """返回 (会话中的最后活动时间, 应返回的超时响应类型)，类型为 None、'invalid' 或 'expired'"""
+        if not last_activity:
+            return None, None
+        last_activity = parse_activity(last_activity)
+        if last_activity is None:
+            # 如果时间格式错误，清除会话
+            return None, 'invalid'
+        # 超过无操作时间（按实际的最后请求计算），自动登出
+        if (now - get_last_activity(request, last_activity)).total_seconds() > get_inactivity_timeout():
+            return last_activity, 'expired'
+        return last_activity, None
+
+    def _finish(self, request, response, last_activity, now):
+        if last_activity is not None and request.session.get('last_activity') == last_activity.isoformat():
+            set_activity_cookie(response, request, last_activity, now)
+        return response
+
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
         # 处理请求前
-        if request.user.is_authenticated:
-            # 检查会话是否超时
-            last_activity = request.session.get('last_activity')
-            if last_activity:
-                try:
-                    last_activity = timezone.datetime.fromisoformat(last_activity)
-                    time_diff = timezone.now() - last_activity
-                    
-                    # 如果超过5分钟，自动登出
-                    if time_diff.total_seconds() > 300:
-                        # 确保彻底登出并清理会话
-                        request.session.flush()
-                        logout(request)
-                        # 对于AJAX请求，返回JSON响应
-                        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                            from django.http import JsonResponse
-                            return JsonResponse({
-                                'status': 'expired',
-                                'message': 'Session expired due to inactivity',
-                                'redirect_url': reverse('file_transfer:custom_login')
-                            }, status=401)
-                        # 对于普通请求，重定向到登录页
-                        return redirect('file_transfer:custom_login')
-                except (ValueError, TypeError):
-                    # 如果时间格式错误，清除会话
-                    request.session.flush()
-                    logout(request)
-                    return redirect('file_transfer:custom_login')
-            
-            # 更新最后活动时间
-            request.session['last_activity'] = timezone.now().isoformat()
-        
+        user = request.user
+        # 异步视图通过 auser() 获取用户，复用这里已加载的用户，避免再查询一次
+        request.auser = _resolved(user)
+        if not user.is_authenticated:
+            return self.get_response(request)
+
+        now = timezone.now()
+        # 检查会话是否超时
+        last_activity, outcome = self._check(request, request.session.get('last_activity'), now)
+        if outcome:
+            # 确保彻底登出并清理会话
+            request.session.flush()
+            logout(request)
+            if outcome == 'invalid':
+                return redirect('file_transfer:custom_login')
+            return self._expired_response(request)
+
+        # 更新最后活动时间（按粒度节流）
+        touch_activity(request, last_activity, now)
         response = self.get_response(request)
-        return response
+        return self._finish(request, response, last_activity, now)
+
+    async def __acall__(self, request):
+        user = await request.auser()
+        # 视图中通过 sync_to_async 执行的同步代码读取 request.user 时不再查询
+        request.user = user
+        if not user.is_authenticated:
+            return await self.get_response(request)
+
+        now = timezone.now()
+        last_activity, outcome = self._check(request, await request.session.aget('last_activity'), now)
+        if outcome:
+            await request.session.aflush()
+            await alogout(request)
+            if outcome == 'invalid':
+                return redirect('file_transfer:custom_login')
+            return self._expired_response(request)
+
+        # 会话已加载，此处不再访问会话存储
+        touch_activity(request, last_activity, now)
+        response = await self.get_response(request)
+        return self._finish(request, response, last_activity, now)
+
+
+class ReplicaPinningMiddleware:
+    """写入后的短时间内将同一客户端的读取固定到主库
+
+    请求中写入了 file_transfer 的模型时，在响应中设置 Cookie 记录固定截止时间；
+    截止时间之前的请求从一开始就读取主库，避免刚上传或删除的文件因副本延迟而不可见。
+    POST 等写请求总是读取主库。
+    """
+
+    cookie_name = 'db_pin'
+    safe_methods = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    sync_capable = True
+    async_capable = True
 
-class ActivityTrackingMiddleware:
-    """用户活动跟踪中间件"""
-    
     def __init__(self, get_response):
         self.get_response = get_response
-    
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _is_pinned(self, request):
+        # 写请求中读取的数据（删除、编辑、管理后台操作前加载的记录）会用于计算统计的变化量，
+        # 从开始就读取主库，避免按副本中的旧值计算
+        if request.method not in self.safe_methods:
+            return True
+        try:
+            return float(request.COOKIES.get(self.cookie_name, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def _pin_response(self, response):
+        if routers.wrote_to_primary() and routers.get_replicas():
+            pin_seconds = routers.get_pin_seconds()
+            response.set_cookie(
+                self.cookie_name,
+                str(time.time() + pin_seconds),
+                max_age=pin_seconds,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
     def __call__(self, request):
-        response = self.get_response(request)
-        
-        # 如果用户已认证，记录活动
-        if request.user.is_authenticated and request.method in ['GET', 'POST', 'PUT', 'DELETE']:
-            # 排除静态文件和媒体文件
-            if not any(path in request.path for path in ['/static/', '/media/', '/admin/']):
-                request.session['last_activity'] = timezone.now().isoformat()
-        
-        return response
\ No newline at end of file
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        with routers.request_scope(self._is_pinned(request)):
+            response = self.get_response(request)
+            return self._pin_response(response)
+
+    async def __acall__(self, request):
+        # 路由状态保存在 contextvars 中，sync_to_async 执行的 ORM 调用对它的修改会传回当前协程
+        with routers.request_scope(self._is_pinned(request)):
+            response = await self.get_response(request)
+            return self._pin_response(response)
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:11
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_transfer', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('original_name', models.CharField(max_length=255, verbose_name='原始文件名')),
+                ('file_size', models.BigIntegerField(verbose_name='文件大小(字节)')),
+                ('file_type', models.CharField(max_length=100, verbose_name='文件类型')),
+                ('chunk_size', models.PositiveIntegerField(verbose_name='分块大小(字节)')),
+                ('description', models.TextField(blank=True, verbose_name='文件描述')),
+                ('tags', models.CharField(blank=True, max_length=500, verbose_name='标签')),
+                ('status', models.CharField(choices=[('uploading', '上传中'), ('assembling', '合并中'), ('completed', '已完成')], default='uploading', max_length=20, verbose_name='状态')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='创建时间')),
+                ('file_transfer', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='file_transfer.filetransfer', verbose_name='文件记录')),
+                ('uploaded_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='上传用户')),
+            ],
+            options={
+                'verbose_name': '分块上传会话',
+                'verbose_name_plural': '分块上传会话',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='UploadChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField(verbose_name='分块序号')),
+                ('size', models.PositiveIntegerField(verbose_name='分块大小(字节)')),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='接收时间')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='file_transfer.uploadsession', verbose_name='上传会话')),
+            ],
+            options={
+                'verbose_name': '上传分块',
+                'verbose_name_plural': '上传分块',
+                'ordering': ['index'],
+                'constraints': [models.UniqueConstraint(fields=('session', 'index'), name='unique_upload_chunk')],
+            },
+        ),
+    ]
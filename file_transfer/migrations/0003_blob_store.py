@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:13
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_transfer', '0002_chunked_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True, verbose_name='SHA-256')),
+                ('file', models.FileField(max_length=255, upload_to='', verbose_name='存储路径')),
+                ('size', models.BigIntegerField(verbose_name='文件大小(字节)')),
+                ('ref_count', models.PositiveIntegerField(default=0, verbose_name='引用计数')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='创建时间')),
+            ],
+            options={
+                'verbose_name': '文件实体',
+                'verbose_name_plural': '文件实体',
+            },
+        ),
+        migrations.AddField(
+            model_name='filetransfer',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='file_transfers', to='file_transfer.blob', verbose_name='文件实体'),
+        ),
+    ]
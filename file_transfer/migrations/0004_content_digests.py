@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_transfer', '0003_blob_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filetransfer',
+            name='crc32',
+            field=models.CharField(blank=True, db_index=True, max_length=8, verbose_name='CRC32'),
+        ),
+        migrations.AddField(
+            model_name='filetransfer',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64, verbose_name='SHA-256'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+from django.db import migrations
+
+from file_transfer.search import FTS_SOURCE_VIEW, FTS_TABLE, PG_SEARCH_VECTOR
+
+TABLE = 'file_transfer_filetransfer'
+
+TRGM_COLUMNS = ['original_name', 'description', 'tags']
+
+SQLITE_FORWARD = [
+    # 外部内容表使用视图，额外提供所有者列，检索时可在 FTS 内部按用户求交集
+    f"""CREATE VIEW {FTS_SOURCE_VIEW} AS
+        SELECT id, original_name, description, tags, 'u' || uploaded_by_id AS owner FROM {TABLE}""",
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        original_name, description, tags, owner,
+        content='{FTS_SOURCE_VIEW}', content_rowid='id',
+        tokenize='unicode61', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, original_name, description, tags, owner)
+        VALUES (new.id, new.original_name, new.description, new.tags, 'u' || new.uploaded_by_id);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, original_name, description, tags, owner)
+        VALUES ('delete', old.id, old.original_name, old.description, old.tags, 'u' || old.uploaded_by_id);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF original_name, description, tags, uploaded_by_id ON {TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, original_name, description, tags, owner)
+        VALUES ('delete', old.id, old.original_name, old.description, old.tags, 'u' || old.uploaded_by_id);
+        INSERT INTO {FTS_TABLE}(rowid, original_name, description, tags, owner)
+        VALUES (new.id, new.original_name, new.description, new.tags, 'u' || new.uploaded_by_id);
+    END""",
+    # 为已有数据建立索引
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_au',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ad',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ai',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+    f'DROP VIEW IF EXISTS {FTS_SOURCE_VIEW}',
+]
+
+POSTGRESQL_FORWARD = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    f'CREATE INDEX IF NOT EXISTS file_transfer_search_gin ON {TABLE} USING GIN (({PG_SEARCH_VECTOR}))',
+] + [
+    # 中文等无法分词的查询回退到 icontains，由三元组索引加速（表达式与 Django 生成的 UPPER(col::text) 一致）
+    f'CREATE INDEX IF NOT EXISTS file_transfer_{column}_trgm ON {TABLE} USING GIN (UPPER({column}::text) gin_trgm_ops)'
+    for column in TRGM_COLUMNS
+]
+
+POSTGRESQL_REVERSE = [
+    f'DROP INDEX IF EXISTS file_transfer_{column}_trgm' for column in TRGM_COLUMNS
+] + [
+    'DROP INDEX IF EXISTS file_transfer_search_gin',
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        vendor = schema_editor.connection.vendor
+        for sql in statements.get(vendor, []):
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_transfer', '0004_content_digests'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRESQL_FORWARD}),
+            _run({'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRESQL_REVERSE}),
+        ),
+    ]
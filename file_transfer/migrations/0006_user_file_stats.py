@@ -0,0 +1,54 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def populate_stats(apps, schema_editor):
+    """为已有文件记录计算初始统计，与 file_transfer.stats.compute_stats 的口径一致"""
+    FileTransfer = apps.get_model('file_transfer', 'FileTransfer')
+    UserFileStat = apps.get_model('file_transfer', 'UserFileStat')
+    files = FileTransfer.objects.order_by()
+
+    values = {}
+    for row in files.values('uploaded_by_id', 'status').annotate(count=Count('id'), size=Sum('file_size')):
+        user_id = row['uploaded_by_id']
+        values[(user_id, 'files')] = values.get((user_id, 'files'), 0) + row['count']
+        values[(user_id, 'size')] = values.get((user_id, 'size'), 0) + (row['size'] or 0)
+        values[(user_id, 'status:' + row['status'])] = row['count']
+    for row in files.values('uploaded_by_id', 'file_type').annotate(count=Count('id')):
+        values[(row['uploaded_by_id'], 'type:' + row['file_type'])] = row['count']
+
+    UserFileStat.objects.bulk_create(
+        UserFileStat(user_id=user_id, name=name, value=value)
+        for (user_id, name), value in values.items()
+        if value
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_transfer', '0005_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserFileStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=110, verbose_name='统计项')),
+                ('value', models.BigIntegerField(default=0, verbose_name='数值')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='file_stats', to=settings.AUTH_USER_MODEL, verbose_name='用户')),
+            ],
+            options={
+                'verbose_name': '用户文件统计',
+                'verbose_name_plural': '用户文件统计',
+                'constraints': [models.UniqueConstraint(fields=('user', 'name'), name='unique_user_file_stat')],
+            },
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
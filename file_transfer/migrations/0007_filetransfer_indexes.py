@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_transfer', '0006_user_file_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='filetransfer',
+            index=models.Index(fields=['uploaded_by', '-uploaded_at', '-id'], name='ft_user_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='filetransfer',
+            index=models.Index(fields=['uploaded_by', 'status', '-uploaded_at'], name='ft_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='filetransfer',
+            index=models.Index(fields=['uploaded_by', 'file_type'], name='ft_user_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='filetransfer',
+            index=models.Index(fields=['status', 'uploaded_at', 'id'], name='ft_status_uploaded_idx'),
+        ),
+    ]
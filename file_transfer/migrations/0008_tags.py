@@ -0,0 +1,105 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:52
+
+import django.db.models.deletion
+import re
+
+from django.db import migrations, models
+
+TAG_MAX_LENGTH = 50
+SEPARATOR_RE = re.compile(r'[,，]')
+
+
+def parse_tags(text):
+    """与 Tag.parse 的规则一致：按逗号拆分、去除空白、转为小写并去重"""
+    names = []
+    for part in SEPARATOR_RE.split(text or ''):
+        name = part.strip().lower()[:TAG_MAX_LENGTH].strip()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def split_existing_tags(apps, schema_editor):
+    """将已有记录的 tags 文本拆分为 Tag/FileTag，并补充每个用户的标签计数"""
+    FileTransfer = apps.get_model('file_transfer', 'FileTransfer')
+    Tag = apps.get_model('file_transfer', 'Tag')
+    FileTag = apps.get_model('file_transfer', 'FileTag')
+    UserFileStat = apps.get_model('file_transfer', 'UserFileStat')
+
+    links = []
+    counts = {}
+    rows = FileTransfer.objects.exclude(tags='').values_list('pk', 'uploaded_by_id', 'tags')
+    for pk, user_id, text in rows.iterator():
+        for name in parse_tags(text):
+            links.append((pk, name))
+            counts[(user_id, name)] = counts.get((user_id, name), 0) + 1
+    if not links:
+        return
+
+    names = {name for _, name in links}
+    Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+    tag_ids = dict(Tag.objects.filter(name__in=names).values_list('name', 'pk'))
+    FileTag.objects.bulk_create(
+        [FileTag(file_transfer_id=pk, tag_id=tag_ids[name]) for pk, name in links],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    UserFileStat.objects.bulk_create(
+        [UserFileStat(user_id=user_id, name='tag:' + name, value=count) for (user_id, name), count in counts.items()],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_transfer', '0007_filetransfer_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='标签名')),
+            ],
+            options={
+                'verbose_name': '标签',
+                'verbose_name_plural': '标签',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='FileTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_transfer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='file_transfer.filetransfer', verbose_name='文件记录')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='file_transfer.tag', verbose_name='标签')),
+            ],
+            options={
+                'verbose_name': '文件标签',
+                'verbose_name_plural': '文件标签',
+            },
+        ),
+        # 指定 through 的多对多字段没有数据库列，只修改状态；SQLite 上直接 AddField 会重建
+        # file_transfer_filetransfer 表，导致全文检索视图失效、触发器丢失
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='filetransfer',
+                    name='tag_set',
+                    field=models.ManyToManyField(blank=True, related_name='file_transfers', through='file_transfer.FileTag', to='file_transfer.tag', verbose_name='标签集合'),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='filetag',
+            index=models.Index(fields=['tag', 'file_transfer'], name='filetag_tag_file_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='filetag',
+            constraint=models.UniqueConstraint(fields=('file_transfer', 'tag'), name='unique_file_tag'),
+        ),
+        migrations.RunPython(split_existing_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_transfer', '0008_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='active_writers',
+            field=models.PositiveIntegerField(default=0, verbose_name='写入中的分块数'),
+        ),
+        migrations.AddField(
+            model_name='uploadsession',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='过期时间'),
+        ),
+    ]
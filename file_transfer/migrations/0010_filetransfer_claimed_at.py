@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 08:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_transfer', '0009_upload_session_expiry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filetransfer',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='认领时间'),
+        ),
+    ]
@@ -2,6 +2,54 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 import os
+import re
+import uuid
+
+class Blob(models.Model):
+    """按 SHA-256 内容寻址的文件实体，多个文件记录可共享同一个 Blob"""
+    sha256 = models.CharField(max_length=64, unique=True, verbose_name='SHA-256')
+    file = models.FileField(max_length=255, verbose_name='存储路径')
+    size = models.BigIntegerField(verbose_name='文件大小(字节)')
+    ref_count = models.PositiveIntegerField(default=0, verbose_name='引用计数')
+    created_at = models.DateTimeField(default=timezone.now, verbose_name='创建时间')
+
+    class Meta:
+        verbose_name = '文件实体'
+        verbose_name_plural = '文件实体'
+
+    def __str__(self):
+        return f"{self.sha256} ({self.ref_count})"
+
+
+class Tag(models.Model):
+    """规范化的标签（去除首尾空白、转为小写），所有用户共用"""
+    MAX_LENGTH = 50
+    SEPARATOR_RE = re.compile(r'[,，]')
+
+    name = models.CharField(max_length=MAX_LENGTH, unique=True, verbose_name='标签名')
+
+    class Meta:
+        verbose_name = '标签'
+        verbose_name_plural = '标签'
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def normalize(cls, name):
+        return name.strip().lower()[:cls.MAX_LENGTH].strip()
+
+    @classmethod
+    def parse(cls, text):
+        """将逗号分隔的标签文本解析为去重的标签名列表，保持原有顺序"""
+        names = []
+        for part in cls.SEPARATOR_RE.split(text or ''):
+            name = cls.normalize(part)
+            if name and name not in names:
+                names.append(name)
+        return names
+
 
 class FileTransfer(models.Model):
     STATUS_CHOICES = [
@@ -17,22 +65,58 @@ class FileTransfer(models.Model):
     file_path = models.FileField(upload_to='uploads/%Y/%m/%d/', verbose_name='文件路径')
     file_type = models.CharField(max_length=100, verbose_name='文件类型')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='状态')
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='file_transfers', verbose_name='文件实体')
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True, verbose_name='SHA-256')
+    crc32 = models.CharField(max_length=8, blank=True, db_index=True, verbose_name='CRC32')
     
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='上传用户')
     uploaded_at = models.DateTimeField(default=timezone.now, verbose_name='上传时间')
     completed_at = models.DateTimeField(null=True, blank=True, verbose_name='完成时间')
+    # 后台 worker 认领记录的时间，超过租期仍在处理中的记录会被退回待处理
+    claimed_at = models.DateTimeField(null=True, blank=True, verbose_name='认领时间')
     
     description = models.TextField(blank=True, verbose_name='文件描述')
     tags = models.CharField(max_length=500, blank=True, verbose_name='标签')
+    # tags 文本解析后的规范化标签，保存时由 signals 同步，用于按标签精确/前缀筛选
+    tag_set = models.ManyToManyField(Tag, through='FileTag', related_name='file_transfers', blank=True, verbose_name='标签集合')
+    
+    # 参与用户统计的字段，从数据库加载时记录其值，保存时据此增量更新统计
+    STATS_FIELDS = ('uploaded_by_id', 'status', 'file_type', 'file_size', 'tags')
     
     class Meta:
         verbose_name = '文件传输'
         verbose_name_plural = '文件传输'
         ordering = ['-uploaded_at']
+        indexes = [
+            # 历史、仪表板最近上传和游标分页：按用户过滤，按 (uploaded_at, id) 倒序
+            models.Index(fields=['uploaded_by', '-uploaded_at', '-id'], name='ft_user_uploaded_idx'),
+            # 历史按状态筛选
+            models.Index(fields=['uploaded_by', 'status', '-uploaded_at'], name='ft_user_status_idx'),
+            # 历史按类型筛选和统计重建时的分组
+            models.Index(fields=['uploaded_by', 'file_type'], name='ft_user_type_idx'),
+            # 后台 worker 按上传顺序认领待处理记录
+            models.Index(fields=['status', 'uploaded_at', 'id'], name='ft_status_uploaded_idx'),
+        ]
     
     def __str__(self):
         return f"{self.original_name} - {self.uploaded_by.username}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_stats = instance.stats_snapshot()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._loaded_stats = self.stats_snapshot()
+
+    def stats_snapshot(self):
+        """当前参与统计的字段值，存在延迟加载的字段时返回 None"""
+        if self.get_deferred_fields().intersection(self.STATS_FIELDS):
+            return None
+        return tuple(getattr(self, name) for name in self.STATS_FIELDS)
+    
     def get_file_size_display(self):
         """返回人类可读的文件大小"""
         if self.file_size < 1024:
@@ -52,3 +136,113 @@ class FileTransfer(models.Model):
         """判断是否为图片文件"""
         image_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']
         return self.get_file_extension().lower() in image_extensions
+    
+    def get_tag_list(self):
+        """规范化的标签名列表（直接解析 tags 文本，不查询数据库）"""
+        return Tag.parse(self.tags)
+
+
+class FileTag(models.Model):
+    """文件与标签的关联"""
+    file_transfer = models.ForeignKey(FileTransfer, on_delete=models.CASCADE, verbose_name='文件记录')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, verbose_name='标签')
+
+    class Meta:
+        verbose_name = '文件标签'
+        verbose_name_plural = '文件标签'
+        constraints = [
+            models.UniqueConstraint(fields=['file_transfer', 'tag'], name='unique_file_tag'),
+        ]
+        indexes = [
+            # 按标签查找文件
+            models.Index(fields=['tag', 'file_transfer'], name='filetag_tag_file_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.file_transfer_id}:{self.tag_id}"
+
+
+class UploadSession(models.Model):
+    """分块上传会话"""
+    STATUS_CHOICES = [
+        ('uploading', '上传中'),
+        ('assembling', '合并中'),
+        ('completed', '已完成'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='上传用户')
+    original_name = models.CharField(max_length=255, verbose_name='原始文件名')
+    file_size = models.BigIntegerField(verbose_name='文件大小(字节)')
+    file_type = models.CharField(max_length=100, verbose_name='文件类型')
+    chunk_size = models.PositiveIntegerField(verbose_name='分块大小(字节)')
+    description = models.TextField(blank=True, verbose_name='文件描述')
+    tags = models.CharField(max_length=500, blank=True, verbose_name='标签')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading', verbose_name='状态')
+    file_transfer = models.OneToOneField(FileTransfer, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='文件记录')
+    created_at = models.DateTimeField(default=timezone.now, verbose_name='创建时间')
+    # 每次写入分块时延长；过期仍未完成的会话由 purge_upload_sessions 清理
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True, verbose_name='过期时间')
+    # 正在写入暂存文件的请求数，不为 0 时不能开始合并
+    active_writers = models.PositiveIntegerField(default=0, verbose_name='写入中的分块数')
+
+    class Meta:
+        verbose_name = '分块上传会话'
+        verbose_name_plural = '分块上传会话'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.original_name} ({self.id})"
+
+    @property
+    def total_chunks(self):
+        """分块总数（空文件也占一个分块）"""
+        return max(1, -(-self.file_size // self.chunk_size))
+
+    def chunk_offset(self, index):
+        """分块在文件中的起始偏移"""
+        return index * self.chunk_size
+
+    def chunk_length(self, index):
+        """分块的期望长度，最后一块可能不足 chunk_size"""
+        return min(self.chunk_size, self.file_size - self.chunk_offset(index))
+
+
+class UploadChunk(models.Model):
+    """已写入暂存文件的分块"""
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks', verbose_name='上传会话')
+    index = models.PositiveIntegerField(verbose_name='分块序号')
+    size = models.PositiveIntegerField(verbose_name='分块大小(字节)')
+    received_at = models.DateTimeField(default=timezone.now, verbose_name='接收时间')
+
+    class Meta:
+        verbose_name = '上传分块'
+        verbose_name_plural = '上传分块'
+        ordering = ['index']
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'index'], name='unique_upload_chunk'),
+        ]
+
+    def __str__(self):
+        return f"{self.session_id}#{self.index}"
+
+
+class UserFileStat(models.Model):
+    """按用户累计的文件统计计数
+
+    每个计数一行，name 为 files、size、status:<状态>、type:<文件类型> 或 tag:<标签>，
+    在上传、删除和状态变更时增量更新，仪表板一次查询即可取得全部统计。
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='file_stats', verbose_name='用户')
+    name = models.CharField(max_length=110, verbose_name='统计项')
+    value = models.BigIntegerField(default=0, verbose_name='数值')
+
+    class Meta:
+        verbose_name = '用户文件统计'
+        verbose_name_plural = '用户文件统计'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'name'], name='unique_user_file_stat'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.name}={self.value}"
@@ -0,0 +1,132 @@
+"""基于游标（keyset）的分页
+
+按 (uploaded_at, id) 倒序分页，与 FileTransfer.Meta.ordering 一致。翻页时用
+WHERE (uploaded_at, id) < (上一页最后一条) 代替 OFFSET，翻到多深都只读取一页数据，
+也不需要每页执行 COUNT(*)。游标是签名后的不透明字符串，客户端无法伪造。
+
+按相关度排序的检索结果没有稳定的 keyset，游标中记录偏移量。
+"""
+from datetime import datetime
+
+from django.core import signing
+from django.db.models import Q
+
+CURSOR_SALT = 'file_transfer.pagination.cursor'
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# 近似计数的上限，超过时只显示“上限+”
+DEFAULT_COUNT_LIMIT = 1000
+
+
+class InvalidCursor(ValueError):
+    """游标无法解析或已被篡改"""
+
+
+class CursorPage:
+    """一页数据及前后页游标"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+def encode_cursor(payload):
+    return signing.dumps(payload, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor):
+    try:
+        return signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        raise InvalidCursor('无效的分页游标')
+
+
+def _key(obj):
+    return [obj.uploaded_at.isoformat(), obj.id]
+
+
+def _keyset_page(queryset, payload, page_size):
+    if payload is None:
+        direction, key = 'next', None
+    else:
+        try:
+            direction = payload['d']
+            key = (datetime.fromisoformat(payload['k'][0]), int(payload['k'][1]))
+        except (KeyError, IndexError, TypeError, ValueError):
+            raise InvalidCursor('无效的分页游标')
+
+    if direction == 'prev':
+        uploaded_at, pk = key
+        rows = list(queryset.filter(
+            Q(uploaded_at__gt=uploaded_at) | Q(uploaded_at=uploaded_at, id__gt=pk)
+        ).order_by('uploaded_at', 'id')[:page_size + 1])
+        has_previous = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_next = True
+    else:
+        if key is not None:
+            uploaded_at, pk = key
+            queryset = queryset.filter(Q(uploaded_at__lt=uploaded_at) | Q(uploaded_at=uploaded_at, id__lt=pk))
+        rows = list(queryset.order_by('-uploaded_at', '-id')[:page_size + 1])
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_previous = key is not None
+
+    next_cursor = encode_cursor({'d': 'next', 'k': _key(rows[-1])}) if has_next and rows else None
+    previous_cursor = encode_cursor({'d': 'prev', 'k': _key(rows[0])}) if has_previous and rows else None
+    return CursorPage(rows, next_cursor, previous_cursor)
+
+
+def _offset_page(queryset, payload, page_size):
+    offset = 0
+    if payload is not None:
+        try:
+            offset = max(0, int(payload['o']))
+        except (KeyError, TypeError, ValueError):
+            raise InvalidCursor('无效的分页游标')
+
+    rows = list(queryset[offset:offset + page_size + 1])
+    next_cursor = encode_cursor({'o': offset + page_size}) if len(rows) > page_size else None
+    previous_cursor = encode_cursor({'o': max(0, offset - page_size)}) if offset > 0 else None
+    return CursorPage(rows[:page_size], next_cursor, previous_cursor)
+
+
+def paginate(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE, ranked=False):
+    """返回 cursor 指向的一页
+
+    ranked 为 True 表示 queryset 已按相关度排序，此时使用偏移量游标并保留原有排序。
+    """
+    page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+    payload = decode_cursor(cursor) if cursor else None
+    if ranked:
+        return _offset_page(queryset, payload, page_size)
+    return _keyset_page(queryset, payload, page_size)
+
+
+def bounded_count(queryset, limit=DEFAULT_COUNT_LIMIT):
+    """最多统计 limit 条，返回 (count, is_exact)"""
+    count = queryset.order_by()[:limit + 1].count()
+    if count > limit:
+        return limit, False
+    return count, True
@@ -0,0 +1,159 @@
+"""上传后的后台处理
+
+上传请求只负责把数据安全落盘并创建状态为 pending 的文件记录，
+后台 worker 通过原子更新认领记录后依次完成摘要校验、MIME 类型识别和缩略图生成，
+最后将状态推进到 completed（出错时为 failed）。
+
+认领时记录 claimed_at，worker 崩溃后记录会停留在 processing；超过租期 FILE_PROCESSING_LEASE
+的记录由其他 worker 退回 pending 重新认领，原 worker 之后提交的结果按认领时间比对后丢弃。
+"""
+import datetime
+import logging
+import mimetypes
+import time
+
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image
+
+from . import stats, thumbnails
+from .blobstore import hash_path
+from .models import FileTransfer
+
+try:
+    import magic
+except ImportError:  # python-magic 依赖系统 libmagic，缺失时回退到 Pillow 和扩展名
+    magic = None
+
+logger = logging.getLogger(__name__)
+
+# 每次查询候选记录的数量
+CLAIM_BATCH_SIZE = 10
+
+# 默认认领租期
+DEFAULT_LEASE = datetime.timedelta(minutes=10)
+
+# worker 检查超时认领的间隔（秒）
+REQUEUE_INTERVAL = 60
+
+
+def get_lease():
+    return getattr(settings, 'FILE_PROCESSING_LEASE', DEFAULT_LEASE)
+
+
+def claim_next_pending():
+    """认领一条待处理记录，返回 FileTransfer 或 None
+
+    通过 status='pending' 条件下的 UPDATE 实现比较并交换，多个 worker 并发认领时
+    同一条记录只会被一个 worker 拿到，在 SQLite 和 PostgreSQL 上行为一致。
+    """
+    candidates = FileTransfer.objects.filter(status='pending').order_by('uploaded_at', 'id')
+    for pk, user_id in candidates.values_list('id', 'uploaded_by_id')[:CLAIM_BATCH_SIZE]:
+        if FileTransfer.objects.filter(pk=pk, status='pending').update(status='processing', claimed_at=timezone.now()):
+            stats.record_status_change(user_id, 'pending', 'processing')
+            return FileTransfer.objects.get(pk=pk)
+    return None
+
+
+def requeue_stale():
+    """把认领超过租期仍在处理中的记录退回 pending，返回退回的记录数
+
+    没有认领时间的 processing 记录来自引入租期之前的 worker，同样视为超时。
+    """
+    cutoff = timezone.now() - get_lease()
+    stale = FileTransfer.objects.filter(status='processing').filter(
+        Q(claimed_at__lt=cutoff) | Q(claimed_at__isnull=True)
+    )
+    requeued = stats.update_status(stale, 'pending', claimed_at=None)
+    if requeued:
+        logger.warning('%d 条记录的认领已超时，退回待处理', requeued)
+    return requeued
+
+
+def _current_claim(file_transfer):
+    """本次认领仍然有效（未被退回或被其他 worker 重新认领）的记录"""
+    return FileTransfer.objects.filter(pk=file_transfer.pk, status='processing', claimed_at=file_transfer.claimed_at)
+
+
+def sniff_mime_type(path, original_name):
+    """根据文件内容识别 MIME 类型，无法识别时返回 None"""
+    if magic is not None:
+        try:
+            return magic.from_file(path, mime=True)
+        except Exception:
+            logger.warning('libmagic 无法识别文件 %s', path, exc_info=True)
+    try:
+        with Image.open(path) as image:
+            mime_type = Image.MIME.get(image.format)
+            if mime_type:
+                return mime_type
+    except Exception:
+        pass
+    return mimetypes.guess_type(original_name)[0]
+
+
+def process_file_transfer(file_transfer):
+    """对已认领的记录执行后台处理并更新状态"""
+    try:
+        path = file_transfer.file_path.path
+        update_fields = ['status', 'completed_at']
+
+        if not file_transfer.sha256:
+            hasher = hash_path(path)
+            file_transfer.sha256 = hasher.sha256
+            file_transfer.crc32 = hasher.crc32
+            update_fields += ['sha256', 'crc32']
+
+        mime_type = sniff_mime_type(path, file_transfer.original_name)
+        if mime_type and mime_type != file_transfer.file_type:
+            file_transfer.file_type = mime_type
+            update_fields.append('file_type')
+
+        if getattr(settings, 'FILE_THUMBNAIL_EAGER', True) and file_transfer.is_image():
+            thumbnails.generate_thumbnails(file_transfer)
+
+        file_transfer.status = 'completed'
+        file_transfer.completed_at = timezone.now()
+        with transaction.atomic():
+            if not _current_claim(file_transfer).select_for_update().exists():
+                logger.warning('文件 %s 的认领已超时，丢弃本次处理结果', file_transfer.pk)
+                return False
+            file_transfer.save(update_fields=update_fields)
+    except Exception:
+        logger.exception('处理文件 %s 失败', file_transfer.pk)
+        stats.update_status(_current_claim(file_transfer), 'failed')
+        return False
+    return True
+
+
+def run_worker(stop_event, poll_interval=1.0, once=False):
+    """循环认领并处理记录，返回处理的记录数
+
+    once 为 True 时处理完当前所有待处理记录后退出。
+    """
+    processed = 0
+    next_requeue = 0.0
+    while not stop_event.is_set():
+        try:
+            if time.monotonic() >= next_requeue:
+                requeue_stale()
+                next_requeue = time.monotonic() + REQUEUE_INTERVAL
+            file_transfer = claim_next_pending()
+        except OperationalError:
+            # 数据库被锁（SQLite 写入超时）或连接中断，关闭失效的连接后重试
+            logger.warning('认领待处理记录失败，稍后重试', exc_info=True)
+            close_old_connections()
+            stop_event.wait(poll_interval)
+            continue
+        if file_transfer is None:
+            if once:
+                break
+            # 空闲时清理失效的数据库连接
+            close_old_connections()
+            stop_event.wait(poll_interval)
+            continue
+        process_file_transfer(file_transfer)
+        processed += 1
+    return processed
@@ -0,0 +1,87 @@
+"""读写分离的数据库路由
+
+file_transfer 应用的模型（文件记录、统计、上传会话等）的读查询分发到 DATABASE_REPLICAS
+中的只读副本，写入始终发往 DATABASE_PRIMARY。其他应用（会话、用户）不参与分流，读写都走主库。
+
+副本存在复制延迟：一旦在当前上下文（一个请求、一个 worker 线程）中写入了路由的模型，
+此后的读取都固定到主库；ReplicaPinningMiddleware 还会通过 Cookie 将同一客户端在
+DATABASE_PRIMARY_PIN_SECONDS 秒内的后续请求也固定到主库，保证用户能立即看到自己的上传和删除。
+POST 等写请求从一开始就读取主库，写入前加载的记录（删除、编辑、管理后台操作）不会来自滞后的副本。
+
+未配置副本时所有查询都发往主库，行为与单库部署相同。
+"""
+import contextlib
+import contextvars
+import random
+
+from django.conf import settings
+
+# 默认写入后固定读主库的时间（秒），应大于副本的典型复制延迟
+DEFAULT_PIN_SECONDS = 5
+
+ROUTED_APP_LABELS = {'file_transfer'}
+
+_pinned = contextvars.ContextVar('file_transfer_db_pinned', default=False)
+_wrote = contextvars.ContextVar('file_transfer_db_wrote', default=False)
+
+
+def get_primary():
+    return getattr(settings, 'DATABASE_PRIMARY', 'default')
+
+
+def get_replicas():
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+
+def get_pin_seconds():
+    return getattr(settings, 'DATABASE_PRIMARY_PIN_SECONDS', DEFAULT_PIN_SECONDS)
+
+
+def pin_to_primary():
+    """当前上下文中后续的读取都走主库"""
+    _pinned.set(True)
+
+
+def is_pinned():
+    return _pinned.get()
+
+
+def wrote_to_primary():
+    """当前上下文中是否写入过路由的模型"""
+    return _wrote.get()
+
+
+@contextlib.contextmanager
+def request_scope(pinned=False):
+    """为一个请求（或一段独立的工作）建立新的固定状态，退出时恢复"""
+    pinned_token = _pinned.set(pinned)
+    wrote_token = _wrote.set(False)
+    try:
+        yield
+    finally:
+        _wrote.reset(wrote_token)
+        _pinned.reset(pinned_token)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        if model._meta.app_label not in ROUTED_APP_LABELS or not replicas or _pinned.get():
+            return get_primary()
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label in ROUTED_APP_LABELS:
+            _wrote.set(True)
+            _pinned.set(True)
+        return get_primary()
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # 主库和副本中的数据相同，它们之间的对象可以互相关联
+        databases = {get_primary(), *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
@@ -0,0 +1,66 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import caching, metrics, routers, stats, tagging
+from .blobstore import release_blob
+from .compression import delete_variants
+from .models import Blob, FileTransfer
+from .thumbnails import cache_key, delete_thumbnails
+
+
+# 为每个新建的数据库连接安装请求级查询计时
+connection_created.connect(metrics.install_query_wrapper, dispatch_uid='file_transfer_metrics_query_wrapper')
+
+
+@receiver(post_delete, sender=FileTransfer)
+def release_file_transfer_blob(sender, instance, **kwargs):
+    """文件记录删除时（包括管理后台和级联删除）释放对 Blob 的引用"""
+    if instance.blob_id:
+        release_blob(instance.blob_id)
+    elif not instance.sha256:
+        # 没有内容摘要的旧记录按记录 ID 缓存缩略图和压缩结果
+        key = cache_key(instance)
+        transaction.on_commit(lambda: delete_thumbnails(key))
+        transaction.on_commit(lambda: delete_variants(key))
+    else:
+        # 没有 Blob 的旧记录按内容摘要与同内容的记录共享缩略图和压缩结果，最后一个共享者删除后才清理
+        key = instance.sha256
+        transaction.on_commit(lambda: delete_unshared_renditions(key))
+
+
+def delete_unshared_renditions(sha256):
+    primary = routers.get_primary()
+    if FileTransfer.objects.using(primary).filter(sha256=sha256).exists():
+        return
+    if Blob.objects.using(primary).filter(sha256=sha256).exists():
+        return
+    delete_thumbnails(sha256)
+    delete_variants(sha256)
+
+
+@receiver(post_delete, sender=Blob)
+def delete_blob_thumbnails(sender, instance, **kwargs):
+    """内容的最后一个引用释放后删除其缓存的缩略图和压缩结果"""
+    transaction.on_commit(lambda: delete_thumbnails(instance.sha256))
+    transaction.on_commit(lambda: delete_variants(instance.sha256))
+
+
+@receiver(post_save, sender=FileTransfer)
+def update_stats_on_save(sender, instance, created, **kwargs):
+    """创建或修改文件记录时同步标签关联、增量更新所属用户的统计，并使其页面缓存失效"""
+    loaded = getattr(instance, '_loaded_stats', None)
+    if created or loaded is None or dict(zip(FileTransfer.STATS_FIELDS, loaded))['tags'] != instance.tags:
+        tagging.sync_tags(instance, created)
+    if created:
+        stats.record_created(instance)
+    else:
+        stats.record_saved(instance)
+    caching.invalidate_user(instance.uploaded_by_id)
+
+
+@receiver(post_delete, sender=FileTransfer)
+def update_stats_on_delete(sender, instance, **kwargs):
+    stats.record_deleted(instance)
+    caching.invalidate_user(instance.uploaded_by_id)
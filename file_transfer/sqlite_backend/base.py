@@ -0,0 +1,97 @@
+"""SQLite 生产模式数据库后端
+
+在 Django 自带的 sqlite3 后端之上：
+- 新建连接时执行调优的 PRAGMA（WAL 日志、synchronous=NORMAL、busy_timeout、mmap 和页缓存大小）
+- 事务默认以 BEGIN IMMEDIATE 开始，写事务在开始时就取得写锁，由 SQLite 按 busy_timeout
+  排队串行执行，避免两个延迟事务都先读后写时锁升级失败（此时 SQLite 不等待，直接报
+  database is locked）
+- 事务外的单条语句和 BEGIN 本身遇到锁冲突时按指数退避重试，事务内的语句不重试，
+  由调用方整体回滚
+
+启用方式：将 DATABASES['default']['ENGINE'] 设为 'file_transfer.sqlite_backend'
+（settings.py 中的 SQLITE_PRODUCTION_MODE）。OPTIONS 中可用 pragmas 覆盖单项 PRAGMA，
+write_retries / write_retry_delay 调整重试次数和初始退避时间（秒），
+transaction_mode 与 Django 自带后端含义相同。
+"""
+import random
+import re
+import time
+
+from django.db.backends.sqlite3 import base
+from django.db.backends.sqlite3.base import Database
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,  # 毫秒
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # 负数表示 KiB，即 64MB
+    'temp_store': 'MEMORY',
+}
+DEFAULT_WRITE_RETRIES = 5
+DEFAULT_WRITE_RETRY_DELAY = 0.05
+
+_PRAGMA_NAME_RE = re.compile(r'^[a-z_]+$')
+_PRAGMA_VALUE_RE = re.compile(r'^-?\w+$')
+
+
+def is_locked_error(exc):
+    message = str(exc).lower()
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+class RetryingCursorWrapper(base.SQLiteCursorWrapper):
+    """锁冲突时重试事务外语句的游标"""
+
+    db = None
+
+    def _retry(self, method, *args):
+        retries = self.db.write_retries if self.db is not None else 0
+        delay = self.db.write_retry_delay if self.db is not None else 0
+        attempt = 0
+        while True:
+            try:
+                return method(*args)
+            except Database.OperationalError as exc:
+                # 事务内的语句失败后整个事务已不可用，不能单独重试
+                if attempt >= retries or not is_locked_error(exc) or self.db.in_atomic_block:
+                    raise
+            # 加入随机抖动，避免多个等待者同时醒来再次冲突
+            time.sleep(delay * (2 ** attempt) * (0.5 + random.random()))
+            attempt += 1
+
+    def execute(self, query, params=None):
+        return self._retry(super().execute, query, params)
+
+    def executemany(self, query, param_list):
+        # 参数可能是生成器，重试前先物化
+        return self._retry(super().executemany, query, list(param_list))
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        self.pragmas = {**DEFAULT_PRAGMAS, **kwargs.pop('pragmas', {})}
+        self.write_retries = kwargs.pop('write_retries', DEFAULT_WRITE_RETRIES)
+        self.write_retry_delay = kwargs.pop('write_retry_delay', DEFAULT_WRITE_RETRY_DELAY)
+        if 'transaction_mode' not in self.settings_dict['OPTIONS']:
+            self.transaction_mode = 'IMMEDIATE'
+        # Python sqlite3 的 timeout 即 busy_timeout，二者保持一致
+        kwargs.setdefault('timeout', int(self.pragmas.get('busy_timeout', 5000)) / 1000)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            if not _PRAGMA_NAME_RE.match(name) or not _PRAGMA_VALUE_RE.match(str(value)):
+                raise ValueError(f'无效的 SQLite PRAGMA: {name}={value!r}')
+            if name == 'journal_mode' and self.is_in_memory_db():
+                # 内存数据库不支持 WAL
+                continue
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def create_cursor(self, name=None):
+        cursor = self.connection.cursor(factory=RetryingCursorWrapper)
+        cursor.db = self
+        return cursor
@@ -0,0 +1,202 @@
+"""按用户增量维护的文件统计
+
+仪表板原先每次访问都要对用户的全部记录执行多次 COUNT/SUM/GROUP BY，
+现在改为读取 UserFileStat 中预先累计的计数，一次查询即可。
+
+计数在以下路径中增量更新：
+- 创建、保存、删除文件记录：signals.py 中的 post_save/post_delete 处理器，
+  保存时与 FileTransfer.from_db 记录的加载值比较得出变化量
+- 绕过信号的 queryset.update()：通过 update_status() 或 record_status_change() 更新
+
+读取后用于计算变化量的数据必须来自主库：副本存在复制延迟，按旧值计算的变化量会让计数逐渐偏离。
+写请求由 ReplicaPinningMiddleware 在开始时固定到主库，这里读取后写入的函数也显式使用主库。
+
+计数出现偏差时可用 rebuild_file_stats 命令从文件记录重新计算。
+"""
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+
+from . import caching, routers
+from .models import FileTag, FileTransfer, Tag, UserFileStat
+
+FILES = 'files'
+SIZE = 'size'
+STATUS_PREFIX = 'status:'
+TYPE_PREFIX = 'type:'
+TAG_PREFIX = 'tag:'
+
+# 仪表板显示的文件类型和标签数量
+TOP_FILE_TYPES = 10
+TOP_TAGS = 30
+
+
+def _contributions(snapshot, sign=1):
+    """一条记录对其所属用户各计数的贡献，返回 {(user_id, name): value}"""
+    user_id, status, file_type, file_size, tags = snapshot
+    contributions = {
+        (user_id, FILES): sign,
+        (user_id, SIZE): sign * (file_size or 0),
+        (user_id, STATUS_PREFIX + status): sign,
+        (user_id, TYPE_PREFIX + file_type): sign,
+    }
+    for name in Tag.parse(tags):
+        contributions[(user_id, TAG_PREFIX + name)] = sign
+    return contributions
+
+
+def apply_deltas(deltas):
+    """按 {(user_id, name): delta} 原子地增减计数
+
+    计数行不存在且增量为正时创建；减少不存在的计数直接忽略，
+    避免在用户被级联删除的过程中重新插入统计行。
+    """
+    for (user_id, name), delta in deltas.items():
+        if not delta:
+            continue
+        if UserFileStat.objects.filter(user_id=user_id, name=name).update(value=F('value') + delta):
+            continue
+        if delta < 0:
+            continue
+        try:
+            with transaction.atomic(using=routers.get_primary()):
+                UserFileStat.objects.create(user_id=user_id, name=name, value=delta)
+        except IntegrityError:
+            # 并发创建了同一计数行
+            UserFileStat.objects.filter(user_id=user_id, name=name).update(value=F('value') + delta)
+
+
+def record_created(instance):
+    apply_deltas(_contributions(instance.stats_snapshot()))
+    instance._loaded_stats = instance.stats_snapshot()
+
+
+def record_saved(instance):
+    """记录已有文件记录的保存，根据加载时的值计算变化量"""
+    old = getattr(instance, '_loaded_stats', None)
+    new = instance.stats_snapshot()
+    if old is None or new is None or old == new:
+        instance._loaded_stats = new
+        return
+    deltas = Counter(_contributions(new))
+    deltas.update(_contributions(old, -1))
+    apply_deltas(deltas)
+    instance._loaded_stats = new
+
+
+def record_deleted(instance):
+    snapshot = instance.stats_snapshot()
+    if snapshot is not None:
+        apply_deltas(_contributions(snapshot, -1))
+
+
+def record_status_change(user_id, old_status, new_status, count=1):
+    """记录 queryset.update() 等绕过信号的状态变更，同时使该用户的页面缓存失效"""
+    if old_status == new_status:
+        return
+    apply_deltas({
+        (user_id, STATUS_PREFIX + old_status): -count,
+        (user_id, STATUS_PREFIX + new_status): count,
+    })
+    caching.invalidate_user(user_id)
+
+
+def update_status(queryset, status, **fields):
+    """替代 queryset.update(status=...)，同时调整各用户的状态计数，返回更新的行数"""
+    primary = routers.get_primary()
+    with transaction.atomic(using=primary):
+        changed = Counter(
+            queryset.using(primary).select_for_update().exclude(status=status).values_list('uploaded_by_id', 'status')
+        )
+        updated = queryset.update(status=status, **fields)
+        for (user_id, old_status), count in changed.items():
+            record_status_change(user_id, old_status, status, count)
+    return updated
+
+
+def get_user_stats(user):
+    """读取用户的统计，只执行一次查询"""
+    total_files = total_size = 0
+    status_counts = {}
+    type_counts = []
+    tag_counts = []
+    for name, value in UserFileStat.objects.filter(user=user).values_list('name', 'value'):
+        if name == FILES:
+            total_files = value
+        elif name == SIZE:
+            total_size = value
+        elif name.startswith(STATUS_PREFIX):
+            status_counts[name[len(STATUS_PREFIX):]] = value
+        elif name.startswith(TYPE_PREFIX) and value > 0:
+            type_counts.append({'file_type': name[len(TYPE_PREFIX):], 'count': value})
+        elif name.startswith(TAG_PREFIX) and value > 0:
+            tag_counts.append({'tag': name[len(TAG_PREFIX):], 'count': value})
+
+    type_counts.sort(key=lambda stat: (-stat['count'], stat['file_type']))
+    # 标签云取使用最多的标签，按名称排列
+    tag_counts.sort(key=lambda stat: (-stat['count'], stat['tag']))
+    tag_counts = sorted(tag_counts[:TOP_TAGS], key=lambda stat: stat['tag'])
+    return {
+        'total_files': total_files,
+        'total_size': total_size,
+        'status_stats': {
+            status_name: status_counts.get(status_code, 0)
+            for status_code, status_name in FileTransfer.STATUS_CHOICES
+        },
+        'file_type_stats': type_counts[:TOP_FILE_TYPES],
+        'tag_stats': tag_counts,
+    }
+
+
+def compute_stats(user_ids=None):
+    """从文件记录重新计算计数，返回 {(user_id, name): value}"""
+    files = FileTransfer.objects.order_by()
+    if user_ids is not None:
+        files = files.filter(uploaded_by_id__in=user_ids)
+
+    expected = defaultdict(int)
+    for row in files.values('uploaded_by_id', 'status').annotate(count=Count('id'), size=Sum('file_size')):
+        user_id = row['uploaded_by_id']
+        expected[(user_id, FILES)] += row['count']
+        expected[(user_id, SIZE)] += row['size'] or 0
+        expected[(user_id, STATUS_PREFIX + row['status'])] = row['count']
+    for row in files.values('uploaded_by_id', 'file_type').annotate(count=Count('id')):
+        expected[(row['uploaded_by_id'], TYPE_PREFIX + row['file_type'])] = row['count']
+
+    file_tags = FileTag.objects.order_by()
+    if user_ids is not None:
+        file_tags = file_tags.filter(file_transfer__uploaded_by_id__in=user_ids)
+    for row in file_tags.values('file_transfer__uploaded_by_id', 'tag__name').annotate(count=Count('id')):
+        expected[(row['file_transfer__uploaded_by_id'], TAG_PREFIX + row['tag__name'])] = row['count']
+    return dict(expected)
+
+
+def diff_stats(user_ids=None):
+    """比较当前计数与重新计算的结果，返回计数不一致的用户 ID 集合"""
+    expected = compute_stats(user_ids)
+    stored = UserFileStat.objects.exclude(value=0)
+    if user_ids is not None:
+        stored = stored.filter(user_id__in=user_ids)
+    current = {(user_id, name): value for user_id, name, value in stored.values_list('user_id', 'name', 'value')}
+    return {
+        user_id for user_id, name in expected.keys() | current.keys()
+        if expected.get((user_id, name), 0) != current.get((user_id, name), 0)
+    }
+
+
+def rebuild_stats(user_ids=None):
+    """丢弃现有计数并从文件记录重建"""
+    routers.pin_to_primary()
+    with transaction.atomic(using=routers.get_primary()):
+        expected = compute_stats(user_ids)
+        stored = UserFileStat.objects.all()
+        if user_ids is not None:
+            stored = stored.filter(user_id__in=user_ids)
+        stored.delete()
+        UserFileStat.objects.bulk_create(
+            UserFileStat(user_id=user_id, name=name, value=value)
+            for (user_id, name), value in expected.items()
+            if value
+        )
+    return len({user_id for user_id, _ in expected})
@@ -0,0 +1,66 @@
+"""按哈希分散目录的文件存储
+
+FileField 的 upload_to（如 uploads/%Y/%m/%d/）会把同一天的上传全部放进一个目录，
+目录项达到数万时 ext4/xfs 上的查找和打开都会变慢。ShardedFileSystemStorage 保留路径的第一级
+（uploads），其余部分替换为文件名哈希的两级目录：uploads/ab/cd/<文件名>。
+某个目录的条目数达到 FILE_STORAGE_MAX_DIR_ENTRIES 时，新文件放入用哈希后续字符建立的下一级目录。
+
+Blob 存储的路径（blobs/ab/cd/<sha256>）本身已按内容摘要分散，直接保存、不再改写。
+已有文件可通过 python manage.py shard_storage 在线迁移到新布局。
+"""
+import hashlib
+import itertools
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+# 默认每个目录最多的条目数
+DEFAULT_MAX_DIR_ENTRIES = 10000
+
+# 固定的分散层数及目录已满时最多扩展到的层数，每层使用两位十六进制
+FANOUT_LEVELS = 2
+MAX_LEVELS = 6
+
+SHARDED_NAME = re.compile(r'^[^/]+/(?:[0-9a-f]{2}/){%d,%d}[^/]+$' % (FANOUT_LEVELS, MAX_LEVELS))
+
+
+def get_max_dir_entries():
+    return getattr(settings, 'FILE_STORAGE_MAX_DIR_ENTRIES', DEFAULT_MAX_DIR_ENTRIES)
+
+
+def is_sharded(name):
+    """name 是否已经是分散目录布局（包括 Blob 路径）"""
+    return bool(SHARDED_NAME.match(name))
+
+
+class ShardedFileSystemStorage(FileSystemStorage):
+    """保存时把 upload_to 生成的路径改写为哈希分散的目录"""
+
+    def generate_filename(self, filename):
+        return self.shard(super().generate_filename(filename))
+
+    def shard(self, name):
+        """返回 name 在分散布局中的路径，已分散的路径原样返回"""
+        name = name.replace('\\', '/')
+        if is_sharded(name):
+            return name
+        directory, basename = posixpath.split(name)
+        top = directory.split('/')[0] if directory else 'files'
+        digest = hashlib.sha256(name.encode()).hexdigest()
+        parts = [digest[i:i + 2] for i in range(0, MAX_LEVELS * 2, 2)]
+        depth = FANOUT_LEVELS
+        while depth < MAX_LEVELS and self._is_full(posixpath.join(top, *parts[:depth])):
+            depth += 1
+        return posixpath.join(top, *parts[:depth], basename)
+
+    def _is_full(self, directory):
+        # 只数到上限为止，未满的目录通常只有少量条目
+        limit = get_max_dir_entries()
+        try:
+            with os.scandir(self.path(directory)) as entries:
+                return sum(1 for _ in itertools.islice(entries, limit)) >= limit
+        except FileNotFoundError:
+            return False
@@ -0,0 +1,136 @@
+"""规范化标签的同步、筛选与批量编辑
+
+FileTransfer.tags 仍是用户编辑和全文检索使用的逗号分隔文本，解析后的规范化标签保存在
+Tag / FileTag 中：单条记录保存时由 signals 同步，批量编辑通过 bulk_add_tags / bulk_remove_tags
+按批执行固定次数的查询，不随记录数增长。按标签筛选走 Tag.name 唯一索引和 FileTag 索引，
+不再对 tags 文本做 icontains。
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+
+from . import caching, routers, stats
+from .models import FileTag, FileTransfer, Tag
+
+# 批量编辑每批处理的记录数（受数据库单条语句参数数量限制）
+BULK_BATCH_SIZE = 500
+
+
+def ensure_tags(names):
+    """返回 {名称: Tag}，不存在的标签一次性创建"""
+    names = set(names)
+    if not names:
+        return {}
+    Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+    return {tag.name: tag for tag in Tag.objects.filter(name__in=names)}
+
+
+def sync_tags(file_transfer, created=False):
+    """使文件记录的标签关联与 tags 文本一致"""
+    names = set(file_transfer.get_tag_list())
+    if created:
+        current = set()
+    else:
+        current = set(FileTag.objects.filter(file_transfer=file_transfer).values_list('tag__name', flat=True))
+
+    added = names - current
+    if added:
+        FileTag.objects.bulk_create(
+            [FileTag(file_transfer=file_transfer, tag=tag) for tag in ensure_tags(added).values()],
+            ignore_conflicts=True,
+        )
+    removed = current - names
+    if removed:
+        FileTag.objects.filter(file_transfer=file_transfer, tag__name__in=removed).delete()
+
+
+def filter_by_tag(queryset, tag='', prefix=''):
+    """按规范化标签精确匹配或前缀匹配筛选文件记录
+
+    前缀匹配使用 [prefix, prefix + U+10FFFF) 的范围条件，可以命中 Tag.name 的索引
+    （SQLite 中大小写不敏感的 LIKE 无法使用普通索引）。
+    """
+    if tag:
+        tags = Tag.objects.filter(name=Tag.normalize(tag))
+        queryset = queryset.filter(pk__in=FileTag.objects.filter(tag__in=tags).values('file_transfer_id'))
+    if prefix:
+        prefix = Tag.normalize(prefix)
+        tags = Tag.objects.filter(name__gte=prefix, name__lt=prefix + '\U0010ffff')
+        queryset = queryset.filter(pk__in=FileTag.objects.filter(tag__in=tags).values('file_transfer_id'))
+    return queryset
+
+
+def _format_tags(names):
+    """拼接为 tags 文本，超出字段长度的标签被舍弃"""
+    max_length = FileTransfer._meta.get_field('tags').max_length
+    text = ''
+    for name in names:
+        candidate = f'{text}, {name}' if text else name
+        if len(candidate) > max_length:
+            break
+        text = candidate
+    return text
+
+
+def bulk_edit_tags(queryset, add=(), remove=()):
+    """为 queryset 中的记录添加和移除标签，返回标签发生变化的记录数
+
+    每批记录执行固定次数的查询：锁定并读取、插入关联、删除关联、一条 UPDATE 写回文本，
+    以及按用户和标签合并后的计数更新。
+    """
+    add = [name for name in dict.fromkeys(Tag.normalize(name) for name in add) if name]
+    remove = {name for name in (Tag.normalize(name) for name in remove) if name}
+    add = [name for name in add if name not in remove]
+    tags = ensure_tags(add)
+    changed = 0
+
+    pks = list(queryset.order_by().values_list('pk', flat=True))
+    for start in range(0, len(pks), BULK_BATCH_SIZE):
+        # 读取的标签文本用于计算计数的变化量，从主库读取
+        batch = FileTransfer.objects.using(routers.get_primary()).filter(pk__in=pks[start:start + BULK_BATCH_SIZE])
+        with transaction.atomic(using=routers.get_primary()):
+            rows = list(batch.select_for_update().values_list('pk', 'uploaded_by_id', 'tags'))
+            new_links = []
+            new_text = {}
+            deltas = Counter()
+            for pk, user_id, text in rows:
+                names = Tag.parse(text)
+                kept = [name for name in names if name not in remove]
+                added = [name for name in add if name not in names]
+                if len(kept) == len(names) and not added:
+                    continue
+                new_text[pk] = _format_tags(kept + added)
+                added = [name for name in added if name in Tag.parse(new_text[pk])]
+                new_links.extend(FileTag(file_transfer_id=pk, tag=tags[name]) for name in added)
+                for name in added:
+                    deltas[(user_id, stats.TAG_PREFIX + name)] += 1
+                for name in set(names) - set(kept):
+                    deltas[(user_id, stats.TAG_PREFIX + name)] -= 1
+            if not new_text:
+                continue
+
+            if new_links:
+                FileTag.objects.bulk_create(new_links, ignore_conflicts=True)
+            if remove:
+                FileTag.objects.filter(file_transfer_id__in=new_text, tag__name__in=remove).delete()
+            # 一条 UPDATE 写入整批记录的新标签文本
+            FileTransfer.objects.filter(pk__in=new_text).update(tags=Case(
+                *(When(pk=pk, then=Value(text)) for pk, text in new_text.items()),
+                default=F('tags'),
+            ))
+            stats.apply_deltas(deltas)
+            for user_id in {user_id for user_id, _ in deltas}:
+                caching.invalidate_user(user_id)
+            changed += len(new_text)
+    return changed
+
+
+def bulk_add_tags(queryset, names):
+    """为 queryset 中的所有记录添加标签，返回标签发生变化的记录数"""
+    return bulk_edit_tags(queryset, add=names)
+
+
+def bulk_remove_tags(queryset, names):
+    """从 queryset 中的所有记录移除标签，返回标签发生变化的记录数"""
+    return bulk_edit_tags(queryset, remove=names)
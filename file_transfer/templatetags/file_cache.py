@@ -0,0 +1,37 @@
+from django import template
+
+from file_transfer import caching
+
+register = template.Library()
+
+
+class UserCacheNode(template.Node):
+    def __init__(self, nodelist, name, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        request = context.get('request')
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return self.nodelist.render(context)
+        parts = [var.resolve(context) for var in self.vary_on]
+        return caching.get_or_set(user.pk, self.name, parts, lambda: self.nodelist.render(context))
+
+
+@register.tag('usercache')
+def do_usercache(parser, token):
+    """按当前用户缓存模板片段，用户的文件发生变化时自动失效
+
+    用法：{% usercache "名称" [区分参数 ...] %} ... {% endusercache %}
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' 至少需要一个参数（缓存片段名称）")
+    name = bits[1]
+    if not (name[0] == name[-1] and name[0] in ('"', "'")):
+        raise template.TemplateSyntaxError(f"'{bits[0]}' 的片段名称必须是字符串")
+    nodelist = parser.parse(('endusercache',))
+    parser.delete_first_token()
+    return UserCacheNode(nodelist, name[1:-1], [parser.compile_filter(bit) for bit in bits[2:]])
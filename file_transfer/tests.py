@@ -1,11 +1,54 @@
-from django.test import TestCase, Client
+from django.test import AsyncClient, TestCase, Client, override_settings
 from django.urls import reverse
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.http import HttpResponse
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+import collections
 import datetime
+import gzip
+import re
+import unittest
+import uuid
+import hashlib
+import io
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from unittest import mock
+from PIL import Image
+from django.apps import apps
+from . import archives, blobstore, caching, captcha, compression, metrics, processing, routers, search, stats, storage, tagging, thumbnails, upload_handlers, uploads
+from .models import Blob, FileTag, FileTransfer, Tag, UploadSession, UserFileStat
 
 # Create your tests here.
 
+def temp_cache_settings(location):
+	return {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}}
+
+
+def setUpModule():
+	# 默认缓存是 BASE_DIR/cache 下的共享文件缓存，测试中的写入和清空不能落到真实目录
+	cache_dir = tempfile.mkdtemp()
+	cache_override = override_settings(CACHES=temp_cache_settings(cache_dir))
+	cache_override.enable()
+	unittest.addModuleCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+	unittest.addModuleCleanup(cache_override.disable)
+
+
 class AuthAndSessionTimeoutTests(TestCase):
 	def setUp(self):
 		self.client = Client()
@@ -36,3 +79,2304 @@ class AuthAndSessionTimeoutTests(TestCase):
 		response2 = self.client.get(self.dashboard_url, follow=False)
 		self.assertEqual(response2.status_code, 302)
 		self.assertTrue(self.login_url in response2['Location'])
+
+
+class TempMediaMixin:
+	"""将 MEDIA_ROOT 指向临时目录并提供创建文件记录的辅助方法"""
+
+	def setUp(self):
+		super().setUp()
+		self.media_root = tempfile.mkdtemp()
+		self.media_override = override_settings(MEDIA_ROOT=self.media_root)
+		self.media_override.enable()
+		self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+		self.addCleanup(self.media_override.disable)
+		# 页面缓存按用户 ID 区分，测试之间会复用相同的 ID，每个测试使用独立的缓存目录
+		cache_dir = tempfile.mkdtemp()
+		cache_override = override_settings(CACHES=temp_cache_settings(cache_dir))
+		cache_override.enable()
+		self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+		self.addCleanup(cache_override.disable)
+
+	def create_file_transfer(self, user, content=b'hello world', name='hello.txt', content_type='text/plain', **kwargs):
+		return FileTransfer.objects.create(
+			file_name=name,
+			original_name=name,
+			file_size=len(content),
+			file_path=SimpleUploadedFile(name, content, content_type=content_type),
+			file_type=content_type,
+			uploaded_by=user,
+			**kwargs
+		)
+
+
+class FileDownloadStreamingTests(TempMediaMixin, TestCase):
+	def setUp(self):
+		super().setUp()
+		self.user = User.objects.create_user(username='downloader', password='pass12345')
+		self.client.force_login(self.user)
+
+	@override_settings(FILE_DOWNLOAD_BLOCK_SIZE=1024)
+	def test_download_is_streamed_in_blocks(self):
+		content = bytes(range(256)) * 20
+		file_transfer = self.create_file_transfer(self.user, content=content, name='data.bin', content_type='application/octet-stream')
+		response = self.client.get(reverse('file_transfer:file_download', args=[file_transfer.id]))
+		self.assertEqual(response.status_code, 200)
+		self.assertTrue(response.streaming)
+		self.assertEqual(response['Content-Length'], str(len(content)))
+		self.assertIn('attachment', response['Content-Disposition'])
+		chunks = list(response.streaming_content)
+		self.assertTrue(all(len(chunk) <= 1024 for chunk in chunks))
+		self.assertEqual(b''.join(chunks), content)
+
+	def test_missing_file_returns_404(self):
+		file_transfer = self.create_file_transfer(self.user)
+		file_transfer.file_path.delete(save=False)
+		file_transfer.file_path = 'uploads/missing.txt'
+		file_transfer.save()
+		response = self.client.get(reverse('file_transfer:file_download', args=[file_transfer.id]))
+		self.assertEqual(response.status_code, 404)
+
+
+class FileDownloadRangeTests(TempMediaMixin, TestCase):
+	def setUp(self):
+		super().setUp()
+		self.user = User.objects.create_user(username='ranger', password='pass12345')
+		self.client.force_login(self.user)
+		self.content = b'0123456789abcdefghij'
+		self.file_transfer = self.create_file_transfer(self.user, content=self.content, name='range.txt')
+		self.url = reverse('file_transfer:file_download', args=[self.file_transfer.id])
+
+	def test_full_response_advertises_ranges_and_validators(self):
+		response = self.client.get(self.url)
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response['Accept-Ranges'], 'bytes')
+		self.assertTrue(response['ETag'].startswith('"'))
+		self.assertIn('Last-Modified', response)
+
+	def test_single_range(self):
+		response = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+		self.assertEqual(response.status_code, 206)
+		self.assertEqual(response['Content-Range'], 'bytes 2-5/20')
+		self.assertEqual(response['Content-Length'], '4')
+		self.assertEqual(b''.join(response.streaming_content), b'2345')
+
+	def test_suffix_and_open_ended_ranges(self):
+		response = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+		self.assertEqual(b''.join(response.streaming_content), b'hij')
+		response = self.client.get(self.url, HTTP_RANGE='bytes=18-')
+		self.assertEqual(response['Content-Range'], 'bytes 18-19/20')
+		self.assertEqual(b''.join(response.streaming_content), b'ij')
+
+	def test_multiple_ranges(self):
+		response = self.client.get(self.url, HTTP_RANGE='bytes=0-1,10-12')
+		self.assertEqual(response.status_code, 206)
+		self.assertTrue(response['Content-Type'].startswith('multipart/byteranges; boundary='))
+		body = b''.join(response.streaming_content)
+		self.assertEqual(int(response['Content-Length']), len(body))
+		self.assertIn(b'Content-Range: bytes 0-1/20\r\n\r\n01\r\n', body)
+		self.assertIn(b'Content-Range: bytes 10-12/20\r\n\r\nabc\r\n', body)
+
+	def test_unsatisfiable_range(self):
+		response = self.client.get(self.url, HTTP_RANGE='bytes=50-60')
+		self.assertEqual(response.status_code, 416)
+		self.assertEqual(response['Content-Range'], 'bytes */20')
+
+	def test_any_range_of_empty_file_is_unsatisfiable(self):
+		empty = self.create_file_transfer(self.user, content=b'', name='empty.txt')
+		url = reverse('file_transfer:file_download', args=[empty.id])
+		for header in ('bytes=-5', 'bytes=0-', 'bytes=0-0', 'bytes=-1,0-'):
+			response = self.client.get(url, HTTP_RANGE=header)
+			self.assertEqual(response.status_code, 416, header)
+			self.assertEqual(response['Content-Range'], 'bytes */0')
+
+	def test_if_none_match_returns_304(self):
+		etag = self.client.get(self.url)['ETag']
+		response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 304)
+
+	def test_if_range_mismatch_returns_full_body(self):
+		response = self.client.get(self.url, HTTP_RANGE='bytes=0-3', HTTP_IF_RANGE='"stale"')
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(b''.join(response.streaming_content), self.content)
+
+	def test_if_range_match_returns_partial_body(self):
+		etag = self.client.get(self.url)['ETag']
+		response = self.client.get(self.url, HTTP_RANGE='bytes=0-3', HTTP_IF_RANGE=etag)
+		self.assertEqual(response.status_code, 206)
+		self.assertEqual(b''.join(response.streaming_content), b'0123')
+
+
+class FileDownloadBackendTests(TempMediaMixin, TestCase):
+	def setUp(self):
+		super().setUp()
+		self.user = User.objects.create_user(username='offloader', password='pass12345')
+		self.client.force_login(self.user)
+		self.file_transfer = self.create_file_transfer(self.user, content=b'offloaded', name='report 1.txt')
+		self.url = reverse('file_transfer:file_download', args=[self.file_transfer.id])
+
+	@override_settings(FILE_DOWNLOAD_BACKEND='x-accel-redirect', FILE_DOWNLOAD_ACCEL_PREFIX='/protected/')
+	def test_x_accel_redirect_backend(self):
+		response = self.client.get(self.url, HTTP_RANGE='bytes=0-1')
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response.content, b'')
+		self.assertEqual(response['X-Accel-Redirect'], '/protected/' + self.file_transfer.file_path.name.replace(' ', '%20'))
+		self.assertIn('attachment', response['Content-Disposition'])
+		self.assertEqual(response['Content-Type'], 'text/plain')
+		self.assertIn('ETag', response)
+
+	@override_settings(FILE_DOWNLOAD_BACKEND='x-sendfile')
+	def test_x_sendfile_backend(self):
+		response = self.client.get(self.url)
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response.content, b'')
+		self.assertEqual(response['X-Sendfile'], self.file_transfer.file_path.path)
+		self.assertNotIn('X-Accel-Redirect', response)
+
+	@override_settings(FILE_DOWNLOAD_BACKEND='x-sendfile')
+	def test_offload_still_requires_login(self):
+		self.client.logout()
+		response = self.client.get(self.url)
+		self.assertEqual(response.status_code, 302)
+		self.assertNotIn('X-Sendfile', response)
+
+	def test_stream_backend_is_default(self):
+		response = self.client.get(self.url)
+		self.assertNotIn('X-Sendfile', response)
+		self.assertNotIn('X-Accel-Redirect', response)
+		self.assertEqual(b''.join(response.streaming_content), b'offloaded')
+
+	@override_settings(FILE_DOWNLOAD_BACKEND='bogus')
+	def test_unknown_backend_is_rejected(self):
+		from django.core.exceptions import ImproperlyConfigured
+		with self.assertRaises(ImproperlyConfigured):
+			self.client.get(self.url)
+
+
+
+class FileDownloadCompressionTests(TempMediaMixin, TestCase):
+	def setUp(self):
+		super().setUp()
+		self.user = User.objects.create_user(username='compressor', password='pass12345')
+		self.client.force_login(self.user)
+		self.content = b'timestamp,level,message\n' + b'2026-01-01,INFO,service started\n' * 2000
+		self.file_transfer = self.create_file_transfer(self.user, content=self.content, name='app.csv', content_type='text/csv')
+		self.url = reverse('file_transfer:file_download', args=[self.file_transfer.id])
+
+	def get(self, url=None, encoding='gzip, deflate', **headers):
+		return self.client.get(url or self.url, HTTP_ACCEPT_ENCODING=encoding, **headers)
+
+	def test_gzip_for_compressible_types(self):
+		response = self.get()
+		self.assertEqual(response['Content-Encoding'], 'gzip')
+		self.assertIn('Accept-Encoding', response['Vary'])
+		self.assertTrue(response['ETag'].endswith('-gzip"'))
+		body = b''.join(response.streaming_content)
+		self.assertLess(len(body), len(self.content) // 10)
+		self.assertEqual(gzip.decompress(body), self.content)
+
+	def test_no_compression_without_accept_encoding_or_for_ranges(self):
+		response = self.client.get(self.url)
+		self.assertNotIn('Content-Encoding', response)
+		self.assertEqual(b''.join(response.streaming_content), self.content)
+		response = self.get(HTTP_RANGE='bytes=0-8')
+		self.assertEqual(response.status_code, 206)
+		self.assertNotIn('Content-Encoding', response)
+		self.assertEqual(b''.join(response.streaming_content), self.content[:9])
+		self.assertNotIn('Content-Encoding', self.get(encoding='gzip;q=0, identity'))
+
+	def test_already_compressed_types_are_not_compressed(self):
+		image = self.create_file_transfer(self.user, content=make_png(), name='photo.png', content_type='image/png')
+		response = self.get(reverse('file_transfer:file_download', args=[image.id]))
+		self.assertNotIn('Content-Encoding', response)
+		self.assertNotIn('Accept-Encoding', response.get('Vary', ''))
+
+	def test_negotiation(self):
+		self.assertEqual(compression.negotiate('gzip, br, zstd', ['zstd', 'br', 'gzip']), 'zstd')
+		self.assertEqual(compression.negotiate('gzip;q=1, br;q=0.5', ['zstd', 'br', 'gzip']), 'gzip')
+		self.assertEqual(compression.negotiate('*', ['br', 'gzip']), 'br')
+		self.assertEqual(compression.negotiate('x-gzip', ['gzip']), 'gzip')
+		self.assertIsNone(compression.negotiate('identity', ['gzip']))
+		self.assertIsNone(compression.negotiate('*;q=0', ['gzip']))
+
+	@unittest.skipUnless(compression.brotli, '未安装 brotli')
+	def test_brotli(self):
+		response = self.get(encoding='br')
+		self.assertEqual(response['Content-Encoding'], 'br')
+		self.assertEqual(compression.brotli.decompress(b''.join(response.streaming_content)), self.content)
+
+	@unittest.skipUnless(compression.zstandard, '未安装 zstandard')
+	def test_zstd(self):
+		response = self.get(encoding='zstd')
+		self.assertEqual(response['Content-Encoding'], 'zstd')
+		body = b''.join(response.streaming_content)
+		self.assertEqual(compression.zstandard.ZstdDecompressor().decompressobj().decompress(body), self.content)
+
+	@override_settings(FILE_COMPRESSION_CACHE_MIN_HITS=2)
+	def test_hot_files_are_encoded_once(self):
+		path = compression.variant_path(self.file_transfer, 'gzip')
+		b''.join(self.get().streaming_content)
+		self.assertFalse(os.path.exists(path))
+		# 第二次下载时边压缩边写入缓存
+		second = b''.join(self.get().streaming_content)
+		self.assertTrue(os.path.exists(path))
+		with mock.patch.object(compression, 'iter_compressed') as iter_compressed:
+			response = self.get()
+			third = b''.join(response.streaming_content)
+		iter_compressed.assert_not_called()
+		self.assertEqual(third, second)
+		self.assertEqual(response['Content-Length'], str(len(third)))
+		self.assertEqual(gzip.decompress(third), self.content)
+
+	@override_settings(FILE_COMPRESSION_CACHE_MIN_HITS=1, FILE_DOWNLOAD_BLOCK_SIZE=1024)
+	def test_aborted_download_leaves_no_cache(self):
+		path = compression.variant_path(self.file_transfer, 'gzip')
+		response = self.get()
+		next(iter(response.streaming_content))
+		response.close()
+		self.assertFalse(os.path.exists(path))
+		self.assertEqual(os.listdir(os.path.dirname(path)), [])
+
+	@override_settings(FILE_COMPRESSION_CACHE_MIN_HITS=1)
+	def test_variants_deleted_with_content(self):
+		b''.join(self.get().streaming_content)
+		path = compression.variant_path(self.file_transfer, 'gzip')
+		self.assertTrue(os.path.exists(path))
+		with self.captureOnCommitCallbacks(execute=True):
+			self.file_transfer.delete()
+		self.assertFalse(os.path.exists(path))
+
+	@override_settings(FILE_COMPRESSION_CACHE_MIN_HITS=1)
+	def test_legacy_variants_deleted_with_last_sharing_record(self):
+		digest = hashlib.sha256(self.content).hexdigest()
+		first, second = (
+			self.create_file_transfer(self.user, content=self.content, name=name, content_type='text/csv', sha256=digest)
+			for name in ('first.csv', 'second.csv')
+		)
+		b''.join(self.get(reverse('file_transfer:file_download', args=[first.id])).streaming_content)
+		path = compression.variant_path(first, 'gzip')
+		self.assertTrue(os.path.exists(path))
+		with self.captureOnCommitCallbacks(execute=True):
+			first.delete()
+		self.assertTrue(os.path.exists(path))
+		with self.captureOnCommitCallbacks(execute=True):
+			second.delete()
+		self.assertFalse(os.path.exists(path))
+
+	@override_settings(FILE_COMPRESSION_CACHE_MIN_HITS=1)
+	def test_variant_deleted_after_check_falls_back_to_streaming(self):
+		b''.join(self.get().streaming_content)
+		path = compression.variant_path(self.file_transfer, 'gzip')
+		os.remove(path)
+		# 检查时缓存仍在，随后被并发删除
+		with mock.patch.object(compression.os.path, 'exists', return_value=True):
+			response = self.get()
+			body = b''.join(response.streaming_content)
+		self.assertEqual(response['Content-Encoding'], 'gzip')
+		self.assertEqual(gzip.decompress(body), self.content)
+
+
+class AsyncViewTests(TempMediaMixin, TestCase):
+	"""通过 AsyncClient 以 ASGI 方式请求，中间件和视图都以异步方式执行"""
+
+	def setUp(self):
+		super().setUp()
+		self.user = User.objects.create_user(username='asyncer', password='pass12345')
+		self.content = os.urandom(5000)
+		self.file_transfer = self.create_file_transfer(self.user, content=self.content, name='data.bin', content_type='application/octet-stream')
+		self.async_client = AsyncClient()
+		self.async_client.force_login(self.user)
+
+	@override_settings(DEBUG=True)
+	def test_middleware_stack_is_not_adapted(self):
+		# DEBUG 下 Django 为同步中间件包装 sync_to_async 时会记录日志
+		from django.core.handlers.asgi import ASGIHandler
+		with self.assertNoLogs('django.request', level='DEBUG'):
+			ASGIHandler()
+
+	@override_settings(FILE_DOWNLOAD_BLOCK_SIZE=1024)
+	async def test_download_iterates_asynchronously(self):
+		response = await self.async_client.get(reverse('file_transfer:file_download', args=[self.file_transfer.id]))
+		self.assertEqual(response.status_code, 200)
+		self.assertTrue(response.is_async)
+		chunks = [chunk async for chunk in response.streaming_content]
+		self.assertGreater(len(chunks), 1)
+		self.assertEqual(b''.join(chunks), self.content)
+
+	@override_settings(FILE_DOWNLOAD_BLOCK_SIZE=1024)
+	async def test_export_iterates_asynchronously(self):
+		response = await self.async_client.get(reverse('file_transfer:file_export'), {'ids': self.file_transfer.id})
+		self.assertEqual(response.status_code, 200)
+		self.assertTrue(response.is_async)
+		chunks = [chunk async for chunk in response.streaming_content]
+		self.assertGreater(len(chunks), 1)
+		with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+			self.assertEqual(archive.read('data.bin'), self.content)
+
+	async def test_download_range_and_missing(self):
+		url = reverse('file_transfer:file_download', args=[self.file_transfer.id])
+		response = await self.async_client.get(url, headers={'range': 'bytes=0-9'})
+		self.assertEqual(response.status_code, 206)
+		self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), self.content[:10])
+		response = await self.async_client.get(reverse('file_transfer:file_download', args=[self.file_transfer.id + 100]))
+		self.assertEqual(response.status_code, 404)
+
+	async def test_heartbeat_and_check(self):
+		url = reverse('file_transfer:check_session')
+		response = await self.async_client.post(url, {'action': 'heartbeat'}, content_type='application/json')
+		self.assertEqual(response.json()['status'], 'ok')
+		response = await self.async_client.post(url, {'action': 'check'}, content_type='application/json')
+		self.assertEqual(response.json()['status'], 'valid')
+
+	async def test_file_list_api(self):
+		response = await self.async_client.get(reverse('file_transfer:file_list_api'))
+		self.assertEqual([item['id'] for item in response.json()['results']], [self.file_transfer.id])
+		response = await self.async_client.get(reverse('file_transfer:file_list_api'), {'cursor': 'bogus'})
+		self.assertEqual(response.status_code, 400)
+
+	async def test_inactive_session_expires(self):
+		session = await self.async_client.asession()
+		await session.aset('last_activity', (timezone.now() - datetime.timedelta(minutes=6)).isoformat())
+		await session.asave()
+		response = await self.async_client.get(reverse('file_transfer:dashboard'))
+		self.assertEqual(response.status_code, 302)
+		self.assertIn(reverse('file_transfer:custom_login'), response['Location'])
+		response = await self.async_client.get(reverse('file_transfer:file_list_api'))
+		self.assertEqual(response.status_code, 302)
+
+@override_settings(FILE_UPLOAD_CHUNK_SIZE=4, FILE_UPLOAD_MIN_CHUNK_SIZE=1)
+class ChunkedUploadTests(TempMediaMixin, TestCase):
+	def setUp(self):
+		super().setUp()
+		self.user = User.objects.create_user(username='chunker', password='pass12345')
+		self.client.force_login(self.user)
+		self.content = b'abcdefghij'
+
+	def create_session(self, **overrides):
+		payload = {'file_name': 'notes.txt', 'file_size': len(self.content), 'file_type': 'text/plain', 'tags': 'a,b'}
+		payload.update(overrides)
+		return self.client.post(reverse('file_transfer:chunked_upload_create'), data=json.dumps(payload), content_type='application/json')
+
+	def put_chunk(self, upload_id, index, data, **params):
+		url = reverse('file_transfer:chunked_upload_chunk', args=[upload_id, index])
+		if params:
+			url += '?' + '&'.join(f'{k}={v}' for k, v in params.items())
+		return self.client.put(url, data=data, content_type='application/octet-stream')
+
+	def test_out_of_order_chunks_are_assembled(self):
+		response = self.create_session()
+		self.assertEqual(response.status_code, 201)
+		upload_id = response.json()['upload_id']
+		self.assertEqual(response.json()['total_chunks'], 3)
+
+		self.assertEqual(self.put_chunk(upload_id, 2, b'ij').status_code, 200)
+		self.assertEqual(self.put_chunk(upload_id, 0, b'abcd', offset=0).status_code, 200)
+
+		status = self.client.get(reverse('file_transfer:chunked_upload_status', args=[upload_id])).json()
+		self.assertEqual(status['received_chunks'], [0, 2])
+		self.assertEqual(status['missing_chunks'], [[1, 1]])
+
+		self.assertEqual(self.put_chunk(upload_id, 1, b'efgh').status_code, 200)
+		response = self.client.post(reverse('file_transfer:chunked_upload_complete', args=[upload_id]))
+		self.assertEqual(response.status_code, 201)
+
+		file_transfer = FileTransfer.objects.get(id=response.json()['file_id'])
+		self.assertEqual(file_transfer.uploaded_by, self.user)
+		self.assertEqual(file_transfer.file_size, len(self.content))
+		self.assertEqual(file_transfer.tags, 'a,b')
+		with open(file_transfer.file_path.path, 'rb') as f:
+			self.assertEqual(f.read(), self.content)
+		self.assertFalse(os.path.exists(os.path.join(self.media_root, 'chunked', f'{upload_id}.part')))
+
+	def test_complete_with_missing_chunks_fails(self):
+		upload_id = self.create_session().json()['upload_id']
+		self.put_chunk(upload_id, 0, b'abcd')
+		response = self.client.post(reverse('file_transfer:chunked_upload_complete', args=[upload_id]))
+		self.assertEqual(response.status_code, 400)
+		self.assertFalse(FileTransfer.objects.exists())
+
+	def test_chunk_with_wrong_length_or_offset_is_rejected(self):
+		upload_id = self.create_session().json()['upload_id']
+		self.assertEqual(self.put_chunk(upload_id, 0, b'abc').status_code, 400)
+		self.assertEqual(self.put_chunk(upload_id, 1, b'efgh', offset=0).status_code, 400)
+		self.assertEqual(self.put_chunk(upload_id, 5, b'efgh').status_code, 400)
+
+	def test_chunk_size_and_count_are_bounded(self):
+		with self.settings(FILE_UPLOAD_MIN_CHUNK_SIZE=256 * 1024):
+			response = self.create_session(file_size=100 * 1024 * 1024, chunk_size=1)
+			self.assertEqual(response.status_code, 400)
+			self.assertFalse(UploadSession.objects.exists())
+			# 只有一个分块的小文件不受最小分块限制
+			self.assertEqual(self.create_session(chunk_size=16).status_code, 201)
+		self.assertEqual(self.create_session(chunk_size=32 * 1024 * 1024).status_code, 400)
+		with self.settings(FILE_UPLOAD_MAX_CHUNKS=2):
+			self.assertEqual(self.create_session().status_code, 400)
+
+	def test_missing_chunks_are_ranges(self):
+		self.assertEqual(uploads.missing_ranges(10, [0, 1, 4, 9]), [[2, 3], [5, 8]])
+		self.assertEqual(uploads.missing_ranges(3, []), [[0, 2]])
+		self.assertEqual(uploads.missing_ranges(2, [0, 1]), [])
+
+	def test_complete_waits_for_chunk_in_flight(self):
+		upload_id = self.create_session().json()['upload_id']
+		self.put_chunk(upload_id, 0, b'abcd')
+		self.put_chunk(upload_id, 1, b'efgh')
+		session = UploadSession.objects.get(pk=upload_id)
+		results = []
+
+		class Body(io.BytesIO):
+			def read(body, size=-1):
+				# 分块写入过程中尝试合并
+				if not results:
+					results.append(self.client.post(reverse('file_transfer:chunked_upload_complete', args=[upload_id])).status_code)
+				return super().read(size)
+
+		uploads.write_chunk(session, 2, Body(b'ij'), 2)
+		self.assertEqual(results, [409])
+		self.assertEqual(UploadSession.objects.get(pk=upload_id).active_writers, 0)
+		response = self.client.post(reverse('file_transfer:chunked_upload_complete', args=[upload_id]))
+		self.assertEqual(response.status_code, 201)
+		# 会话结束后的分块请求返回 409
+		self.assertEqual(self.put_chunk(upload_id, 2, b'ij').status_code, 409)
+
+	def test_stale_writer_does_not_block_complete(self):
+		upload_id = self.create_session().json()['upload_id']
+		self.put_chunk(upload_id, 0, b'abcd')
+		self.put_chunk(upload_id, 1, b'efgh')
+		self.put_chunk(upload_id, 2, b'ij')
+		# 注销失败的写入者：登记仍在但已超过租期
+		UploadSession.objects.filter(pk=upload_id).update(active_writers=1)
+		self.assertEqual(self.client.post(reverse('file_transfer:chunked_upload_complete', args=[upload_id])).status_code, 409)
+		UploadSession.objects.filter(pk=upload_id).update(
+			expires_at=uploads._expiry() - uploads.WRITER_LEASE - datetime.timedelta(seconds=1),
+		)
+		self.assertEqual(self.client.post(reverse('file_transfer:chunked_upload_complete', args=[upload_id])).status_code, 201)
+
+	def test_failed_assembly_returns_to_uploading(self):
+		upload_id = self.create_session().json()['upload_id']
+		self.put_chunk(upload_id, 0, b'abcd')
+		self.put_chunk(upload_id, 1, b'efgh')
+		self.put_chunk(upload_id, 2, b'ij')
+		session = UploadSession.objects.get(pk=upload_id)
+		with mock.patch.object(uploads, 'store_local_file', side_effect=OSError('disk full')):
+			with self.assertRaises(OSError):
+				uploads.complete_session(session)
+		self.assertEqual(UploadSession.objects.get(pk=upload_id).status, 'uploading')
+		self.assertFalse(FileTransfer.objects.exists())
+		response = self.client.post(reverse('file_transfer:chunked_upload_complete', args=[upload_id]))
+		self.assertEqual(response.status_code, 201)
+
+	def test_missing_staging_file_is_conflict(self):
+		upload_id = self.create_session().json()['upload_id']
+		os.remove(os.path.join(self.media_root, 'chunked', f'{upload_id}.part'))
+		self.assertEqual(self.put_chunk(upload_id, 0, b'abcd').status_code, 409)
+		self.assertEqual(UploadSession.objects.get(pk=upload_id).active_writers, 0)
+
+	def test_purge_expired_sessions(self):
+		expired_id = self.create_session().json()['upload_id']
+		active_id = self.create_session().json()['upload_id']
+		UploadSession.objects.filter(pk=expired_id).update(expires_at=timezone.now() - datetime.timedelta(seconds=1))
+		out = io.StringIO()
+		call_command('purge_upload_sessions', stdout=out)
+		self.assertIn('已清理 1 个', out.getvalue())
+		self.assertEqual(list(UploadSession.objects.values_list('pk', flat=True)), [uuid.UUID(active_id)])
+		self.assertFalse(os.path.exists(os.path.join(self.media_root, 'chunked', f'{expired_id}.part')))
+		self.assertTrue(os.path.exists(os.path.join(self.media_root, 'chunked', f'{active_id}.part')))
+
+	def test_purge_abandoned_assembly(self):
+		stuck_id = self.create_session().json()['upload_id']
+		assembling_id = self.create_session().json()['upload_id']
+		UploadSession.objects.filter(pk=stuck_id).update(status='assembling', expires_at=timezone.now() - datetime.timedelta(seconds=1))
+		UploadSession.objects.filter(pk=assembling_id).update(status='assembling')
+		self.assertEqual(uploads.purge_expired_sessions(), 1)
+		self.assertEqual(list(UploadSession.objects.values_list('pk', flat=True)), [uuid.UUID(assembling_id)])
+		self.assertFalse(os.path.exists(os.path.join(self.media_root, 'chunked', f'{stuck_id}.part')))
+
+	def test_session_validation_matches_upload_form(self):
+		self.assertEqual(self.create_session(file_name='virus.exe').status_code, 400)
+		self.assertEqual(self.create_session(file_size=101 * 1024 * 1024).status_code, 400)
+
+	def test_other_users_cannot_access_session(self):
+		upload_id = self.create_session().json()['upload_id']
+		other = User.objects.create_user(username='intruder', password='pass12345')
+		self.client.force_login(other)
+		self.assertEqual(self.put_chunk(upload_id, 0, b'abcd').status_code, 404)
+
+
+
+class ChunkedUploadConcurrencyTests(unittest.TestCase):
+	"""在默认 sqlite3 后端的文件数据库上真正并行地上传分块
+
+	测试数据库是内存库且在事务中运行，无法复现多连接争用写锁，因此继承 unittest.TestCase。
+	"""
+
+	alias = 'chunk_concurrency'
+
+	@classmethod
+	def setUpClass(cls):
+		from django.db import connections
+		super().setUpClass()
+		cls.db_dir = tempfile.mkdtemp()
+		connections.settings[cls.alias] = {
+			**connection.settings_dict,
+			'ENGINE': 'django.db.backends.sqlite3',
+			'NAME': os.path.join(cls.db_dir, 'uploads.sqlite3'),
+			'OPTIONS': {},
+			'TEST': {},
+		}
+		call_command('migrate', database=cls.alias, verbosity=0)
+		connections[cls.alias].close()
+
+	@classmethod
+	def tearDownClass(cls):
+		from django.db import connections
+		connections[cls.alias].close()
+		del connections[cls.alias]
+		del connections.settings[cls.alias]
+		shutil.rmtree(cls.db_dir, ignore_errors=True)
+		super().tearDownClass()
+
+	def setUp(self):
+		media_root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+		override = override_settings(DATABASE_PRIMARY=self.alias, MEDIA_ROOT=media_root, FILE_UPLOAD_MIN_CHUNK_SIZE=1)
+		override.enable()
+		self.addCleanup(override.disable)
+		self.user = User.objects.create_user(username=f'parallel-{uuid.uuid4().hex[:8]}', password='pass12345')
+
+	def test_parallel_chunk_puts(self):
+		from django.db import connections
+		chunks = [bytes([65 + i]) * 64 for i in range(24)]
+		client = Client()
+		client.force_login(self.user)
+		response = client.post(reverse('file_transfer:chunked_upload_create'), data=json.dumps({
+			'file_name': 'parallel.txt', 'file_size': 64 * len(chunks), 'file_type': 'text/plain', 'chunk_size': 64,
+		}), content_type='application/json')
+		self.assertEqual(response.status_code, 201)
+		upload_id = response.json()['upload_id']
+		barrier = threading.Barrier(len(chunks))
+		results = {}
+
+		def put(index):
+			worker = Client()
+			worker.force_login(self.user)
+			barrier.wait()
+			try:
+				url = reverse('file_transfer:chunked_upload_chunk', args=[upload_id, index])
+				results[index] = worker.put(url, data=chunks[index], content_type='application/octet-stream').status_code
+			finally:
+				connections.close_all()
+
+		threads = [threading.Thread(target=put, args=(i,)) for i in range(len(chunks))]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		self.assertEqual(results, {i: 200 for i in range(len(chunks))})
+		session = UploadSession.objects.get(pk=upload_id)
+		self.assertEqual(session.active_writers, 0)
+		self.assertEqual(session.chunks.count(), len(chunks))
+		response = client.post(reverse('file_transfer:chunked_upload_complete', args=[upload_id]))
+		self.assertEqual(response.status_code, 201)
+		with open(FileTransfer.objects.get(id=response.json()['file_id']).file_path.path, 'rb') as f:
+			self.assertEqual(f.read(), b''.join(chunks))
+
+	def test_locked_database_is_retryable(self):
+		client = Client()
+		client.force_login(self.user)
+		upload_id = client.post(reverse('file_transfer:chunked_upload_create'), data=json.dumps({
+			'file_name': 'busy.txt', 'file_size': 4, 'file_type': 'text/plain',
+		}), content_type='application/json').json()['upload_id']
+		url = reverse('file_transfer:chunked_upload_chunk', args=[upload_id, 0])
+		with mock.patch.object(uploads.UploadChunk.objects, 'bulk_create', side_effect=OperationalError('database is locked')):
+			response = client.put(url, data=b'abcd', content_type='application/octet-stream')
+		self.assertEqual(response.status_code, 503)
+		self.assertEqual(response['Retry-After'], '1')
+		self.assertEqual(UploadSession.objects.get(pk=upload_id).active_writers, 0)
+		self.assertEqual(client.put(url, data=b'abcd', content_type='application/octet-stream').status_code, 200)
+
+class BlobStoreTests(TempMediaMixin, TestCase):
+	def setUp(self):
+		super().setUp()
+		self.user = User.objects.create_user(username='deduper', password='pass12345')
+		self.client.force_login(self.user)
+
+	def upload(self, content, name='installer.pdf'):
+		response = self.client.post(reverse('file_transfer:file_upload'), {
+			'file': SimpleUploadedFile(name, content, content_type='application/pdf'),
+		})
+		self.assertEqual(response.status_code, 302)
+		return FileTransfer.objects.filter(uploaded_by=self.user).latest('id')
+
+	def test_identical_uploads_share_one_blob(self):
+		first = self.upload(b'same bytes', name='a.pdf')
+		second = self.upload(b'same bytes', name='b.pdf')
+		self.assertEqual(first.blob_id, second.blob_id)
+		self.assertEqual(first.file_path.name, second.file_path.name)
+		self.assertEqual(Blob.objects.count(), 1)
+		self.assertEqual(Blob.objects.get().ref_count, 2)
+		self.assertEqual(Blob.objects.get().sha256, hashlib.sha256(b'same bytes').hexdigest())
+
+	def test_release_and_reupload_of_same_content(self):
+		first = self.upload(b'recycled')
+		with self.captureOnCommitCallbacks(execute=True):
+			# 最后一个引用释放后、事务提交前又上传了相同内容，复用尚未删除的 Blob
+			first.delete()
+			blob, created = blobstore.store_uploaded_file(SimpleUploadedFile('again.pdf', b'recycled'))
+		self.assertFalse(created)
+		self.assertEqual(Blob.objects.get().ref_count, 1)
+		with open(blob.file.path, 'rb') as f:
+			self.assertEqual(f.read(), b'recycled')
+
+	def test_rolled_back_delete_keeps_blob_file(self):
+		file_transfer = self.upload(b'survivor')
+		pk, path = file_transfer.pk, file_transfer.file_path.path
+		with self.captureOnCommitCallbacks(execute=True) as callbacks:
+			with self.assertRaises(RuntimeError):
+				with transaction.atomic():
+					file_transfer.delete()
+					raise RuntimeError
+		self.assertEqual(callbacks, [])
+		self.assertTrue(FileTransfer.objects.filter(pk=pk).exists())
+		self.assertEqual(Blob.objects.get().ref_count, 1)
+		with open(path, 'rb') as f:
+			self.assertEqual(f.read(), b'survivor')
+
+	def test_leftover_file_is_rewritten(self):
+		digest = hashlib.sha256(b'complete content').hexdigest()
+		path = os.path.join(self.media_root, blobstore.blob_name(digest))
+		os.makedirs(os.path.dirname(path))
+		with open(path, 'wb') as f:
+			f.write(b'partial')
+		file_transfer = self.upload(b'complete content')
+		with open(file_transfer.file_path.path, 'rb') as f:
+			self.assertEqual(f.read(), b'complete content')
+
+	def test_blob_removed_only_with_last_reference(self):
+		first = self.upload(b'shared')
+		second = self.upload(b'shared')
+		path = first.file_path.path
+
+		with self.captureOnCommitCallbacks(execute=True):
+			self.client.post(reverse('file_transfer:file_delete', args=[first.id]))
+		self.assertTrue(os.path.exists(path))
+		self.assertEqual(Blob.objects.get().ref_count, 1)
+
+		with self.captureOnCommitCallbacks(execute=True):
+			self.client.post(reverse('file_transfer:file_delete', args=[second.id]))
+		self.assertFalse(os.path.exists(path))
+		self.assertFalse(Blob.objects.exists())
+
+	def test_migrate_to_blobs_command_reclaims_duplicates(self):
+		legacy = [self.create_file_transfer(self.user, content=b'duplicate', name=f'copy{i}.txt') for i in range(3)]
+		old_paths = [f.file_path.path for f in legacy]
+		out = io.StringIO()
+		call_command('migrate_to_blobs', stdout=out)
+
+		self.assertIn('回收空间 18 字节', out.getvalue())
+		blob = Blob.objects.get()
+		self.assertEqual(blob.ref_count, 3)
+		self.assertEqual(set(FileTransfer.objects.values_list('blob', flat=True)), {blob.id})
+		self.assertFalse(any(os.path.exists(p) for p in old_paths))
+		self.assertTrue(os.path.exists(blob.file.path))
+
+
+class UploadHashingTests(TempMediaMixin, TestCase):
+	def setUp(self):
+		super().setUp()
+		self.user = User.objects.create_user(username='hasher', password='pass12345')
+		self.client.force_login(self.user)
+
+	def upload_without_rereading(self, content):
+		with mock.patch('file_transfer.forms.hash_file', side_effect=AssertionError('file was re-read')):
+			response = self.client.post(reverse('file_transfer:file_upload'), {
+				'file': SimpleUploadedFile('data.csv', content, content_type='text/csv'),
+			})
+		self.assertEqual(response.status_code, 302)
+		return FileTransfer.objects.get(uploaded_by=self.user)
+
+	def test_small_upload_digests_computed_in_memory_handler(self):
+		content = b'id,name\n1,a\n'
+		file_transfer = self.upload_without_rereading(content)
+		self.assertEqual(file_transfer.sha256, hashlib.sha256(content).hexdigest())
+		self.assertEqual(file_transfer.crc32, f'{zlib.crc32(content):08x}')
+
+	@override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=16)
+	def test_large_upload_digests_computed_in_temporary_file_handler(self):
+		content = b'x' * 100000
+		file_transfer = self.upload_without_rereading(content)
+		self.assertEqual(file_transfer.sha256, hashlib.sha256(content).hexdigest())
+		self.assertEqual(file_transfer.blob.sha256, file_transfer.sha256)
+
+	@override_settings(FILE_UPLOAD_COMPUTE_CRC32=False)
+	def test_crc32_is_optional(self):
+		file_transfer = self.upload_without_rereading(b'abc')
+		self.assertEqual(file_transfer.crc32, '')
+
+	def test_etag_uses_content_digest(self):
+		file_transfer = self.upload_without_rereading(b'etag me')
+		response = self.client.get(reverse('file_transfer:file_download', args=[file_transfer.id]))
+		self.assertEqual(response['ETag'], f'"{file_transfer.sha256}"')
+
+
+
+@override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=16)
+class StagedUploadTests(TempMediaMixin, TestCase):
+	def setUp(self):
+		super().setUp()
+		self.user = User.objects.create_user(username='stager', password='pass12345')
+		self.client.force_login(self.user)
+
+	def upload(self, content, name='data.bin'):
+		return self.client.post(reverse('file_transfer:file_upload'), {
+			'file': SimpleUploadedFile(name, content, content_type='application/octet-stream'),
+		})
+
+	def incoming_files(self):
+		directory = upload_handlers.get_incoming_dir()
+		return os.listdir(directory) if os.path.isdir(directory) else []
+
+	def test_large_upload_is_moved_into_blob_storage(self):
+		content = os.urandom(200000)
+		moved = []
+		real_replace = os.replace
+
+		def replace(source, destination):
+			moved.append((source, destination))
+			return real_replace(source, destination)
+
+		with mock.patch('file_transfer.forms.store_uploaded_file', side_effect=AssertionError('file was copied')), \
+				mock.patch('file_transfer.blobstore.os.replace', side_effect=replace):
+			response = self.upload(content)
+		self.assertEqual(response.status_code, 302)
+		file_transfer = FileTransfer.objects.get(uploaded_by=self.user)
+		self.assertEqual(len(moved), 1)
+		self.assertEqual(os.path.dirname(moved[0][0]), upload_handlers.get_incoming_dir())
+		self.assertEqual(moved[0][1], file_transfer.file_path.path)
+		with open(file_transfer.file_path.path, 'rb') as f:
+			self.assertEqual(f.read(), content)
+		self.assertEqual(file_transfer.sha256, hashlib.sha256(content).hexdigest())
+		self.assertEqual(self.incoming_files(), [])
+
+	def test_duplicate_content_discards_staged_file(self):
+		content = os.urandom(100000)
+		self.upload(content, 'a.bin')
+		self.upload(content, 'b.bin')
+		self.assertEqual(Blob.objects.get().ref_count, 2)
+		self.assertEqual(self.incoming_files(), [])
+
+	def test_invalid_upload_removes_staged_file(self):
+		response = self.upload(os.urandom(100000), 'setup.exe')
+		self.assertEqual(response.status_code, 200)
+		self.assertFalse(FileTransfer.objects.exists())
+		self.assertEqual(self.incoming_files(), [])
+
+	def test_oversize_upload_is_rejected_while_streaming(self):
+		handler = upload_handlers.StagedFileUploadHandler
+		with mock.patch('file_transfer.upload_handlers.MAX_UPLOAD_SIZE', 1000), \
+				mock.patch.object(handler, 'receive_data_chunk', autospec=True, side_effect=handler.receive_data_chunk) as receive:
+			response = self.upload(os.urandom(1024 * 1024))
+		self.assertEqual(response.status_code, 200)
+		self.assertContains(response, '文件大小不能超过100MB')
+		# Content-Length 已超过上限，文件数据一块也不写入
+		self.assertEqual(receive.call_count, 0)
+		self.assertFalse(FileTransfer.objects.exists())
+		self.assertEqual(self.incoming_files(), [])
+
+	def test_oversize_upload_without_content_length_hint_is_rejected_while_streaming(self):
+		handler = upload_handlers.StagedFileUploadHandler
+		# 请求体未超过上限与表单开销之和，只能在接收时发现
+		with mock.patch('file_transfer.upload_handlers.MAX_UPLOAD_SIZE', 1000), \
+				mock.patch.object(handler, 'receive_data_chunk', autospec=True, side_effect=handler.receive_data_chunk) as receive:
+			response = self.upload(os.urandom(2000))
+		self.assertContains(response, '文件大小不能超过100MB')
+		self.assertEqual(receive.call_count, 1)
+		self.assertFalse(FileTransfer.objects.exists())
+		self.assertEqual(self.incoming_files(), [])
+
+	def test_stale_staged_files_are_purged(self):
+		directory = upload_handlers.get_incoming_dir()
+		os.makedirs(directory)
+		names = ('stale.upload', 'fresh.upload', 'other.txt')
+		for name in names:
+			with open(os.path.join(directory, name), 'wb') as f:
+				f.write(b'partial')
+		old = time.time() - upload_handlers.get_incoming_max_age().total_seconds() - 60
+		for name in ('stale.upload', 'other.txt'):
+			os.utime(os.path.join(directory, name), (old, old))
+
+		out = io.StringIO()
+		call_command('purge_upload_sessions', stdout=out)
+		self.assertIn('1 个遗留的暂存文件', out.getvalue())
+		self.assertCountEqual(self.incoming_files(), ['fresh.upload', 'other.txt'])
+
+		os.utime(os.path.join(directory, 'fresh.upload'), (old, old))
+		out = io.StringIO()
+		call_command('process_uploads', '--once', stdout=out)
+		self.assertIn('已清理 1 个遗留的上传暂存文件', out.getvalue())
+		self.assertEqual(self.incoming_files(), ['other.txt'])
+
+
+class ShardedStorageTests(TempMediaMixin, TestCase):
+	def setUp(self):
+		super().setUp()
+		self.user = User.objects.create_user(username='sharder', password='pass12345')
+		self.client.force_login(self.user)
+
+	def create_legacy_file(self, name, content=b'legacy content'):
+		path = os.path.join(self.media_root, name)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(path, 'wb') as f:
+			f.write(content)
+		return FileTransfer.objects.create(
+			file_name='old.txt', original_name='old.txt', file_size=len(content), file_path=name,
+			file_type='text/plain', uploaded_by=self.user,
+		)
+
+	def test_upload_to_path_is_sharded(self):
+		file_transfer = self.create_file_transfer(self.user)
+		self.assertRegex(file_transfer.file_path.name, r'^uploads/[0-9a-f]{2}/[0-9a-f]{2}/hello\.txt$')
+		self.assertTrue(storage.is_sharded(file_transfer.file_path.name))
+		self.assertFalse(storage.is_sharded('uploads/2024/01/01/hello.txt'))
+
+	@override_settings(FILE_STORAGE_MAX_DIR_ENTRIES=2)
+	def test_full_directory_spills_into_next_level(self):
+		sharded = storage.ShardedFileSystemStorage()
+		names = [
+			sharded.save(sharded.generate_filename('uploads/2024/01/01/same.txt'), ContentFile(b'x'))
+			for _ in range(3)
+		]
+		self.assertEqual(len(set(names)), 3)
+		self.assertEqual(os.path.dirname(names[0]), os.path.dirname(names[1]))
+		self.assertEqual(names[0].count('/'), 3)
+		self.assertEqual(names[2].count('/'), 4)
+		self.assertTrue(names[2].startswith(os.path.dirname(names[0]) + '/'))
+
+	def test_shard_storage_command_moves_legacy_files(self):
+		old_name = 'uploads/2024/01/01/old.txt'
+		first = self.create_legacy_file(old_name)
+		second = FileTransfer.objects.create(
+			file_name='old.txt', original_name='old.txt', file_size=14, file_path=old_name,
+			file_type='text/plain', uploaded_by=self.user,
+		)
+		sharded = self.create_file_transfer(self.user)
+		old_path = first.file_path.path
+		both_resolve = []
+
+		def check_paths(user_id):
+			# 记录切换后、旧路径删除前，新旧两个路径都可以打开
+			new_name = FileTransfer.objects.get(pk=first.pk).file_path.name
+			both_resolve.append(os.path.exists(old_path) and os.path.exists(os.path.join(self.media_root, new_name)))
+
+		out = io.StringIO()
+		with mock.patch('file_transfer.management.commands.shard_storage.invalidate_user', side_effect=check_paths):
+			call_command('shard_storage', grace=0.01, stdout=out)
+		self.assertIn('迁移 1 个文件', out.getvalue())
+		self.assertEqual(both_resolve, [True])
+
+		first.refresh_from_db()
+		second.refresh_from_db()
+		self.assertTrue(storage.is_sharded(first.file_path.name))
+		self.assertEqual(first.file_path.name, second.file_path.name)
+		self.assertFalse(os.path.exists(old_path))
+		self.assertEqual(FileTransfer.objects.get(pk=sharded.pk).file_path.name, sharded.file_path.name)
+
+		response = self.client.get(reverse('file_transfer:file_download', args=[first.id]))
+		self.assertEqual(b''.join(response.streaming_content), b'legacy content')
+
+	def test_interrupted_shard_storage_resumes_deletions(self):
+		from file_transfer.management.commands import shard_storage
+		first = self.create_legacy_file('uploads/2024/01/01/first.txt')
+		self.create_legacy_file('uploads/2024/01/02/second.txt')
+		old_path = first.file_path.path
+		journal = os.path.join(self.media_root, shard_storage.JOURNAL_NAME)
+
+		handler = signal.getsignal(signal.SIGINT)
+		out = io.StringIO()
+		# 迁移第一个文件后收到 SIGINT：不再迁移后续文件，也不等待保留时间
+		with mock.patch.object(shard_storage, 'invalidate_user', side_effect=lambda _: signal.raise_signal(signal.SIGINT)):
+			call_command('shard_storage', grace=3600, stdout=out)
+		self.assertIn('迁移 1 个文件', out.getvalue())
+		self.assertIn('1 个旧路径将在下次运行时删除', out.getvalue())
+		self.assertTrue(os.path.exists(old_path))
+		self.assertTrue(os.path.exists(journal))
+		self.assertIs(signal.getsignal(signal.SIGINT), handler)
+
+		later = time.time() + 3601
+		with mock.patch.object(shard_storage.time, 'time', return_value=later):
+			call_command('shard_storage', grace=0, stdout=io.StringIO())
+		self.assertFalse(os.path.exists(old_path))
+		self.assertFalse(os.path.exists(journal))
+		self.assertTrue(all(storage.is_sharded(name) for name in FileTransfer.objects.values_list('file_path', flat=True)))
+
+	def test_journaled_path_still_referenced_is_kept(self):
+		from file_transfer.management.commands import shard_storage
+		referenced = self.create_legacy_file('uploads/2024/01/01/kept.txt')
+		orphan = os.path.join(self.media_root, 'uploads/2024/01/01/orphan.txt')
+		with open(orphan, 'wb') as f:
+			f.write(b'orphan')
+		# 日志先于记录切换写入，中断时记录可能仍引用旧路径
+		pending = collections.deque([(0, referenced.file_path.name), (0, 'uploads/2024/01/01/orphan.txt')])
+		shard_storage.Command()._remove_expired(storage.ShardedFileSystemStorage(), pending)
+		self.assertEqual(pending, collections.deque())
+		self.assertTrue(os.path.exists(referenced.file_path.path))
+		self.assertFalse(os.path.exists(orphan))
+
+	def test_shard_storage_dry_run(self):
+		file_transfer = self.create_legacy_file('uploads/2024/01/01/old.txt')
+		out = io.StringIO()
+		call_command('shard_storage', dry_run=True, stdout=out)
+		self.assertIn('[dry-run] 迁移 1 个文件', out.getvalue())
+		file_transfer.refresh_from_db()
+		self.assertEqual(file_transfer.file_path.name, 'uploads/2024/01/01/old.txt')
+		self.assertTrue(os.path.exists(file_transfer.file_path.path))
+
+def make_png(size=(1000, 500), color=(200, 40, 40)):
+	buf = io.BytesIO()
+	Image.new('RGB', size, color).save(buf, 'PNG')
+	return buf.getvalue()
+
+
+class ThumbnailTests(TempMediaMixin, TestCase):
+	def setUp(self):
+		super().setUp()
+		self.user = User.objects.create_user(username='viewer', password='pass12345')
+		self.client.force_login(self.user)
+
+	def upload_image(self, content=None):
+		self.client.post(reverse('file_transfer:file_upload'), {
+			'file': SimpleUploadedFile('photo.png', content or make_png(), content_type='image/png'),
+		})
+		return FileTransfer.objects.filter(uploaded_by=self.user).latest('id')
+
+	def test_thumbnail_is_bounded_and_cached(self):
+		file_transfer = self.upload_image()
+		url = reverse('file_transfer:file_thumbnail', args=[file_transfer.id, 'small'])
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response['Content-Type'], thumbnails.get_content_type())
+		with Image.open(io.BytesIO(b''.join(response.streaming_content))) as image:
+			self.assertLessEqual(max(image.size), 64)
+		self.assertTrue(os.path.exists(thumbnails.thumbnail_path(file_transfer, 'small')))
+
+		with mock.patch('file_transfer.thumbnails._render') as render:
+			self.assertEqual(self.client.get(url).status_code, 200)
+		render.assert_not_called()
+
+	def test_non_image_and_unknown_size_return_404(self):
+		file_transfer = self.upload_image()
+		self.assertEqual(self.client.get(reverse('file_transfer:file_thumbnail', args=[file_transfer.id, 'huge'])).status_code, 404)
+		text = self.create_file_transfer(self.user)
+		self.assertEqual(self.client.get(reverse('file_transfer:file_thumbnail', args=[text.id, 'small'])).status_code, 404)
+
+	@override_settings(FILE_THUMBNAIL_EAGER=True)
+	def test_eager_generation_after_upload(self):
+		file_transfer = self.upload_image()
+		call_command('process_uploads', '--once', stdout=io.StringIO())
+		for size in thumbnails.get_sizes():
+			self.assertTrue(os.path.exists(thumbnails.thumbnail_path(file_transfer, size)))
+
+	def test_thumbnails_removed_with_last_reference(self):
+		file_transfer = self.upload_image()
+		self.client.get(reverse('file_transfer:file_thumbnail', args=[file_transfer.id, 'medium']))
+		path = thumbnails.thumbnail_path(file_transfer, 'medium')
+		self.assertTrue(os.path.exists(path))
+		with self.captureOnCommitCallbacks(execute=True):
+			self.client.post(reverse('file_transfer:file_delete', args=[file_transfer.id]))
+		self.assertFalse(os.path.exists(path))
+
+
+	def test_legacy_thumbnails_removed_with_last_sharing_record(self):
+		content = make_png()
+		digest = hashlib.sha256(content).hexdigest()
+		first, second = (
+			self.create_file_transfer(self.user, content=content, name=name, content_type='image/png', sha256=digest)
+			for name in ('first.png', 'second.png')
+		)
+		self.assertIsNone(first.blob_id)
+		self.assertEqual(self.client.get(reverse('file_transfer:file_thumbnail', args=[first.id, 'small'])).status_code, 200)
+		path = thumbnails.thumbnail_path(first, 'small')
+		with self.captureOnCommitCallbacks(execute=True):
+			first.delete()
+		self.assertTrue(os.path.exists(path))
+		with self.captureOnCommitCallbacks(execute=True):
+			second.delete()
+		self.assertFalse(os.path.exists(path))
+
+	def test_thumbnail_deleted_before_open_is_regenerated(self):
+		file_transfer = self.upload_image()
+		url = reverse('file_transfer:file_thumbnail', args=[file_transfer.id, 'small'])
+		self.client.get(url)
+		get_thumbnail = thumbnails.get_thumbnail
+		calls = []
+
+		def deleted_after_check(file_transfer, size):
+			path = get_thumbnail(file_transfer, size)
+			if not calls:
+				# 检查存在之后、打开之前被并发删除
+				os.remove(path)
+			calls.append(path)
+			return path
+
+		with mock.patch.object(thumbnails, 'get_thumbnail', side_effect=deleted_after_check):
+			response = self.client.get(url)
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(len(calls), 2)
+		with Image.open(io.BytesIO(b''.join(response.streaming_content))) as image:
+			self.assertLessEqual(max(image.size), 64)
+
+class UploadProcessingTests(TempMediaMixin, TestCase):
+	def setUp(self):
+		super().setUp()
+		self.user = User.objects.create_user(username='worker', password='pass12345')
+
+	def test_worker_processes_pending_rows(self):
+		image = self.create_file_transfer(self.user, content=make_png(), name='photo.png', content_type='application/octet-stream')
+		text = self.create_file_transfer(self.user, content=b'plain text', name='notes.txt')
+		out = io.StringIO()
+		call_command('process_uploads', '--once', stdout=out)
+		self.assertIn('共处理 2 个文件', out.getvalue())
+
+		image.refresh_from_db()
+		self.assertEqual(image.status, 'completed')
+		self.assertIsNotNone(image.completed_at)
+		self.assertEqual(image.file_type, 'image/png')
+		self.assertEqual(image.sha256, hashlib.sha256(make_png()).hexdigest())
+		self.assertTrue(os.path.exists(thumbnails.thumbnail_path(image, 'small')))
+
+		text.refresh_from_db()
+		self.assertEqual(text.status, 'completed')
+
+	def test_claim_is_exclusive(self):
+		file_transfer = self.create_file_transfer(self.user)
+		claimed = processing.claim_next_pending()
+		self.assertEqual(claimed.pk, file_transfer.pk)
+		self.assertEqual(claimed.status, 'processing')
+		self.assertIsNone(processing.claim_next_pending())
+
+	def test_stale_claim_is_reclaimed_after_crash(self):
+		file_transfer = self.create_file_transfer(self.user)
+		# worker 认领后崩溃，记录停留在处理中
+		processing.claim_next_pending()
+		call_command('process_uploads', '--once', stdout=io.StringIO())
+		file_transfer.refresh_from_db()
+		self.assertEqual(file_transfer.status, 'processing')
+
+		FileTransfer.objects.filter(pk=file_transfer.pk).update(
+			claimed_at=timezone.now() - processing.get_lease() - datetime.timedelta(seconds=1)
+		)
+		with self.assertLogs('file_transfer.processing', level='WARNING'):
+			call_command('process_uploads', '--once', stdout=io.StringIO())
+		file_transfer.refresh_from_db()
+		self.assertEqual(file_transfer.status, 'completed')
+		counts = dict(UserFileStat.objects.filter(user=self.user).values_list('name', 'value'))
+		self.assertEqual(counts['status:processing'], 0)
+		self.assertEqual(counts['status:completed'], 1)
+
+	def test_result_of_expired_claim_is_discarded(self):
+		file_transfer = self.create_file_transfer(self.user)
+		slow = processing.claim_next_pending()
+		FileTransfer.objects.filter(pk=file_transfer.pk).update(claimed_at=timezone.now() - datetime.timedelta(days=1))
+		slow.refresh_from_db()
+		with self.assertLogs('file_transfer.processing', level='WARNING'):
+			self.assertEqual(processing.requeue_stale(), 1)
+		current = processing.claim_next_pending()
+		self.assertEqual(current.pk, file_transfer.pk)
+		with self.assertLogs('file_transfer.processing', level='WARNING'):
+			self.assertFalse(processing.process_file_transfer(slow))
+		self.assertTrue(processing.process_file_transfer(current))
+		counts = dict(UserFileStat.objects.filter(user=self.user).values_list('name', 'value'))
+		self.assertEqual(counts['status:processing'], 0)
+		self.assertEqual(counts['status:completed'], 1)
+
+	def test_claim_retried_after_operational_error(self):
+		file_transfer = self.create_file_transfer(self.user)
+		claim = processing.claim_next_pending
+		attempts = []
+
+		def flaky_claim():
+			attempts.append(None)
+			if len(attempts) == 1:
+				raise OperationalError('database is locked')
+			return claim()
+
+		with mock.patch.object(processing, 'claim_next_pending', flaky_claim):
+			with self.assertLogs('file_transfer.processing', level='WARNING'):
+				processed = processing.run_worker(threading.Event(), poll_interval=0, once=True)
+		self.assertEqual(processed, 1)
+		file_transfer.refresh_from_db()
+		self.assertEqual(file_transfer.status, 'completed')
+
+	def test_failure_marks_row_failed(self):
+		file_transfer = self.create_file_transfer(self.user)
+		os.remove(file_transfer.file_path.path)
+		with self.assertLogs('file_transfer.processing', level='ERROR'):
+			call_command('process_uploads', '--once', stdout=io.StringIO())
+		file_transfer.refresh_from_db()
+		self.assertEqual(file_transfer.status, 'failed')
+		self.assertIsNone(file_transfer.completed_at)
+
+	def test_upload_leaves_row_pending(self):
+		self.client.force_login(self.user)
+		self.client.post(reverse('file_transfer:file_upload'), {
+			'file': SimpleUploadedFile('photo.png', make_png(), content_type='image/png'),
+		})
+		file_transfer = FileTransfer.objects.get()
+		self.assertEqual(file_transfer.status, 'pending')
+		self.assertFalse(os.path.exists(thumbnails.thumbnail_path(file_transfer, 'small')))
+
+
+@override_settings(CAPTCHA_POOL_SIZE=5, CAPTCHA_POOL_LOW_WATER=2)
+class CaptchaPoolTests(TestCase):
+	def test_captcha_view_uses_pooled_code(self):
+		pool = captcha.get_pool()
+		pool.refill()
+		expected_code, expected_png = pool._items[0]
+		response = self.client.get(reverse('file_transfer:captcha'))
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response['Content-Type'], 'image/png')
+		self.assertEqual(response.content, expected_png)
+		self.assertEqual(self.client.session['login_captcha'], expected_code)
+
+	def test_pool_never_hands_out_same_captcha_twice(self):
+		pool = captcha.CaptchaPool(size=3, low_water=0)
+		pool.refill()
+		with mock.patch.object(pool, 'start_refill'):
+			items = [pool.pop() for _ in range(5)]
+		self.assertEqual(len(set(png for _, png in items)), 5)
+
+	def test_pool_refills_below_low_water(self):
+		pool = captcha.CaptchaPool(size=4, low_water=2)
+		pool.refill()
+		with mock.patch.object(pool, 'start_refill') as start_refill:
+			pool.pop()
+			start_refill.assert_not_called()
+			pool.pop()
+			start_refill.assert_called_once()
+
+	@override_settings(CAPTCHA_POOL_SIZE=0)
+	def test_pool_can_be_disabled(self):
+		with mock.patch('file_transfer.captcha.render_captcha', return_value=('ABCDE', b'png')) as render:
+			response = self.client.get(reverse('file_transfer:captcha'))
+		render.assert_called_once()
+		self.assertEqual(self.client.session['login_captcha'], 'ABCDE')
+		self.assertEqual(len(captcha.get_pool()), 0)
+
+	def test_login_with_pooled_captcha(self):
+		User.objects.create_user(username='captcha', password='pass12345')
+		self.client.get(reverse('file_transfer:captcha'))
+		response = self.client.post(reverse('file_transfer:custom_login'), {
+			'username': 'captcha',
+			'password': 'pass12345',
+			'captcha': self.client.session['login_captcha'].lower(),
+		})
+		self.assertRedirects(response, reverse('file_transfer:dashboard'), fetch_redirect_response=False)
+
+
+class SessionWriteTests(TestCase):
+	def setUp(self):
+		self.user = User.objects.create_user(username='active', password='pass12345')
+		self.client.force_login(self.user)
+		self.url = reverse('file_transfer:file_history')
+
+	def set_last_activity(self, seconds_ago):
+		session = self.client.session
+		session['last_activity'] = (timezone.now() - datetime.timedelta(seconds=seconds_ago)).isoformat()
+		session.save()
+		# 签名 Cookie 会话的数据保存在 Cookie 中
+		self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+	def count_session_writes(self, **extra):
+		from django.contrib.sessions.backends.db import SessionStore
+		with mock.patch.object(SessionStore, 'save', autospec=True, side_effect=SessionStore.save) as save:
+			response = self.client.get(self.url, **extra)
+		return response, save.call_count
+
+	def test_recent_activity_causes_no_session_write(self):
+		self.set_last_activity(5)
+		response, writes = self.count_session_writes()
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(writes, 0)
+
+	def test_stale_activity_causes_exactly_one_write(self):
+		self.set_last_activity(45)
+		response, writes = self.count_session_writes()
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(writes, 1)
+		stored = timezone.datetime.fromisoformat(self.client.session['last_activity'])
+		self.assertLess((timezone.now() - stored).total_seconds(), 5)
+
+	@override_settings(SESSION_ACTIVITY_GRANULARITY=0)
+	def test_zero_granularity_writes_every_request(self):
+		self.set_last_activity(1)
+		self.assertEqual(self.count_session_writes()[1], 1)
+
+	def test_inactivity_timeout_is_unchanged(self):
+		self.set_last_activity(299)
+		self.assertEqual(self.client.get(self.url).status_code, 200)
+		self.set_last_activity(301)
+		response = self.client.get(self.url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+		self.assertEqual(response.status_code, 401)
+		self.assertEqual(response.json()['status'], 'expired')
+
+	def request_at(self, moment, **extra):
+		with mock.patch('django.utils.timezone.now', return_value=moment):
+			return self.client.get(self.url, **extra)
+
+	def start_active_session(self):
+		"""会话写入最后活动时间后 20 秒内再请求一次（不写会话），返回这次请求的时间"""
+		self.set_last_activity(0)
+		written = timezone.datetime.fromisoformat(self.client.session['last_activity'])
+		last_request = written + datetime.timedelta(seconds=20)
+		from django.contrib.sessions.backends.db import SessionStore
+		with mock.patch.object(SessionStore, 'save', autospec=True, side_effect=SessionStore.save) as save:
+			self.assertEqual(self.request_at(last_request).status_code, 200)
+		self.assertEqual(save.call_count, 0)
+		return last_request
+
+	def test_timeout_counts_from_unwritten_request(self):
+		last_request = self.start_active_session()
+		response = self.request_at(last_request + datetime.timedelta(seconds=299))
+		self.assertEqual(response.status_code, 200)
+
+	def test_expires_after_timeout_from_unwritten_request(self):
+		last_request = self.start_active_session()
+		response = self.request_at(last_request + datetime.timedelta(seconds=301), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+		self.assertEqual(response.status_code, 401)
+		self.assertEqual(response.json()['status'], 'expired')
+
+	def test_tampered_activity_cookie_is_ignored(self):
+		from .middleware import ACTIVITY_COOKIE_NAME
+		last_request = self.start_active_session()
+		# 签名 Cookie 的格式为 值:时间戳:签名
+		value, signed = self.client.cookies[ACTIVITY_COOKIE_NAME].value.split(':', 1)
+		user_id, anchor, seen = value.split('|')
+		self.client.cookies[ACTIVITY_COOKIE_NAME] = f'{user_id}|{anchor}|{float(seen) + 9}:{signed}'
+		response = self.request_at(last_request + datetime.timedelta(seconds=299), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+		self.assertEqual(response.status_code, 401)
+
+	@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+	def test_works_with_signed_cookie_sessions(self):
+		self.client.force_login(self.user)
+		self.set_last_activity(301)
+		response = self.client.get(self.url)
+		self.assertEqual(response.status_code, 302)
+		self.assertIn(reverse('file_transfer:custom_login'), response['Location'])
+
+
+class FileSearchTests(TempMediaMixin, TestCase):
+	def setUp(self):
+		super().setUp()
+		self.user = User.objects.create_user(username='searcher', password='pass12345')
+		self.client.force_login(self.user)
+
+	def search(self, query):
+		response = self.client.get(reverse('file_transfer:file_history'), {'search': query})
+		self.assertEqual(response.status_code, 200)
+		return [f.original_name for f in response.context['page_obj']]
+
+	def test_prefix_match_across_fields(self):
+		self.create_file_transfer(self.user, name='quarterly_report.pdf')
+		self.create_file_transfer(self.user, name='notes.txt', description='meeting report draft')
+		self.create_file_transfer(self.user, name='photo.png', tags='holiday,beach')
+		self.assertCountEqual(self.search('rep'), ['quarterly_report.pdf', 'notes.txt'])
+		self.assertEqual(self.search('beac'), ['photo.png'])
+		self.assertEqual(self.search('report draft'), ['notes.txt'])
+
+	def test_results_are_ranked(self):
+		self.create_file_transfer(self.user, name='budget.xlsx', description='annual budget figures budget')
+		self.create_file_transfer(self.user, name='misc.txt', description='mentions budget once among many other unrelated words here')
+		self.assertEqual(self.search('budget'), ['budget.xlsx', 'misc.txt'])
+
+	def test_index_follows_updates_and_deletes(self):
+		file_transfer = self.create_file_transfer(self.user, name='draft.txt')
+		FileTransfer.objects.filter(pk=file_transfer.pk).update(original_name='final.txt')
+		self.assertEqual(self.search('draft'), [])
+		self.assertEqual(self.search('final'), ['final.txt'])
+		file_transfer.delete()
+		self.assertEqual(self.search('final'), [])
+
+	def test_only_own_files_are_searched(self):
+		other = User.objects.create_user(username='other', password='pass12345')
+		self.create_file_transfer(other, name='secret_report.pdf')
+		self.assertEqual(self.search('secret'), [])
+
+	def test_owner_column_is_not_searchable(self):
+		self.create_file_transfer(self.user, name='plain.txt')
+		self.assertEqual(self.search(f'u{self.user.pk}'), [])
+
+	def test_cjk_query_uses_substring_match(self):
+		self.create_file_transfer(self.user, name='年度财务报告.pdf')
+		self.assertEqual(self.search('财务'), ['年度财务报告.pdf'])
+
+
+class HistoryPaginationTests(TempMediaMixin, TestCase):
+	def setUp(self):
+		super().setUp()
+		self.user = User.objects.create_user(username='pager', password='pass12345')
+		self.client.force_login(self.user)
+		now = timezone.now()
+		self.files = []
+		for i in range(7):
+			file_transfer = self.create_file_transfer(self.user, name=f'file{i}.txt')
+			# 两两共用上传时间，验证按 id 打破平局
+			FileTransfer.objects.filter(pk=file_transfer.pk).update(uploaded_at=now - datetime.timedelta(minutes=i // 2))
+			self.files.append(file_transfer)
+		self.expected = [f.pk for f in sorted(
+			FileTransfer.objects.filter(uploaded_by=self.user), key=lambda f: (f.uploaded_at, f.id), reverse=True
+		)]
+		self.api_url = reverse('file_transfer:file_list_api')
+
+	def fetch(self, **params):
+		response = self.client.get(self.api_url, {'page_size': 3, **params})
+		self.assertEqual(response.status_code, 200)
+		return response.json()
+
+	def test_api_pages_forward_and_back(self):
+		seen = []
+		pages = []
+		data = self.fetch()
+		self.assertIsNone(data['previous'])
+		while True:
+			pages.append(data)
+			seen.extend(item['id'] for item in data['results'])
+			if not data['next']:
+				break
+			data = self.fetch(cursor=data['next'])
+		self.assertEqual(seen, self.expected)
+		self.assertEqual(len(pages), 3)
+
+		back = self.fetch(cursor=pages[-1]['previous'])
+		self.assertEqual([item['id'] for item in back['results']], self.expected[3:6])
+		back = self.fetch(cursor=back['previous'])
+		self.assertEqual([item['id'] for item in back['results']], self.expected[:3])
+		self.assertIsNone(back['previous'])
+
+	def test_keyset_queries_avoid_offset_and_count(self):
+		first = self.fetch()
+		# 会话、用户各一次查询，列表本身只需一次查询
+		with self.assertNumQueries(3) as ctx:
+			self.client.get(self.api_url, {'page_size': 3, 'cursor': first['next']})
+		sql = ' '.join(q['sql'] for q in ctx.captured_queries).upper()
+		self.assertNotIn('OFFSET', sql)
+		self.assertNotIn('COUNT(', sql)
+
+	def test_optional_counts(self):
+		self.assertNotIn('count', self.fetch())
+		data = self.fetch(count='exact')
+		self.assertEqual((data['count'], data['count_is_exact']), (7, True))
+		with mock.patch('file_transfer.pagination.DEFAULT_COUNT_LIMIT', 5):
+			data = self.fetch(count='approximate')
+		self.assertEqual((data['count'], data['count_is_exact']), (7, True))
+
+	def test_bounded_count(self):
+		from .pagination import bounded_count
+		queryset = FileTransfer.objects.filter(uploaded_by=self.user)
+		self.assertEqual(bounded_count(queryset, limit=5), (5, False))
+		self.assertEqual(bounded_count(queryset, limit=7), (7, True))
+
+	def test_tampered_cursor_is_rejected(self):
+		cursor = self.fetch()['next']
+		response = self.client.get(self.api_url, {'cursor': cursor[:-2] + 'xx'})
+		self.assertEqual(response.status_code, 400)
+		self.assertEqual(response.json()['status'], 'error')
+
+	def test_api_only_lists_own_files(self):
+		other = User.objects.create_user(username='other', password='pass12345')
+		self.create_file_transfer(other, name='theirs.txt')
+		names = [item['original_name'] for item in self.fetch(page_size=50)['results']]
+		self.assertNotIn('theirs.txt', names)
+		self.assertEqual(len(names), 7)
+
+	def test_history_view_uses_cursor_links(self):
+		response = self.client.get(reverse('file_transfer:file_history'))
+		self.assertEqual(response.status_code, 200)
+		page_obj = response.context['page_obj']
+		self.assertEqual(len(page_obj), 7)
+		self.assertFalse(page_obj.has_other_pages)
+		self.assertEqual(response.context['total_count'], 7)
+
+		# 无效游标回到第一页
+		response = self.client.get(reverse('file_transfer:file_history'), {'cursor': 'bogus'})
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual([f.pk for f in response.context['page_obj']], self.expected)
+
+	def test_ranked_search_pages_by_offset(self):
+		data = self.fetch(search='file')
+		seen = [item['id'] for item in data['results']]
+		while data['next']:
+			data = self.fetch(search='file', cursor=data['next'])
+			seen.extend(item['id'] for item in data['results'])
+		self.assertCountEqual(seen, self.expected)
+
+
+class UserFileStatsTests(TempMediaMixin, TestCase):
+	def setUp(self):
+		super().setUp()
+		self.user = User.objects.create_user(username='stats', password='pass12345')
+		self.admin = User.objects.create_superuser(username='admin', password='pass12345')
+
+	def assertStatsConsistent(self):
+		self.assertEqual(stats.diff_stats(), set())
+
+	def test_create_save_and_delete_update_counters(self):
+		first = self.create_file_transfer(self.user, content=b'12345', name='a.txt')
+		second = self.create_file_transfer(self.user, content=make_png(), name='b.png', content_type='image/png')
+		user_stats = stats.get_user_stats(self.user)
+		self.assertEqual(user_stats['total_files'], 2)
+		self.assertEqual(user_stats['total_size'], 5 + len(make_png()))
+		self.assertEqual(user_stats['status_stats']['待处理'], 2)
+
+		loaded = FileTransfer.objects.get(pk=first.pk)
+		loaded.status = 'completed'
+		loaded.file_type = 'application/octet-stream'
+		loaded.save()
+		self.assertStatsConsistent()
+
+		with self.captureOnCommitCallbacks(execute=True):
+			second.delete()
+		user_stats = stats.get_user_stats(self.user)
+		self.assertEqual(user_stats['total_files'], 1)
+		self.assertEqual(user_stats['status_stats'], {'待处理': 0, '处理中': 0, '已完成': 1, '失败': 0})
+		self.assertEqual(user_stats['file_type_stats'], [{'file_type': 'application/octet-stream', 'count': 1}])
+		self.assertStatsConsistent()
+
+	def test_worker_status_changes_update_counters(self):
+		self.create_file_transfer(self.user, content=make_png(), name='photo.png', content_type='application/octet-stream')
+		broken = self.create_file_transfer(self.user, name='missing.txt')
+		os.remove(broken.file_path.path)
+		with self.assertLogs('file_transfer.processing', level='ERROR'):
+			call_command('process_uploads', '--once', stdout=io.StringIO())
+		user_stats = stats.get_user_stats(self.user)
+		self.assertEqual(user_stats['status_stats']['已完成'], 1)
+		self.assertEqual(user_stats['status_stats']['失败'], 1)
+		self.assertEqual(user_stats['status_stats']['处理中'], 0)
+		self.assertStatsConsistent()
+
+	def test_admin_bulk_actions_update_counters(self):
+		files = [self.create_file_transfer(self.user, name=f'{i}.txt') for i in range(3)]
+		self.client.force_login(self.admin)
+		url = reverse('admin:file_transfer_filetransfer_changelist')
+		self.client.post(url, {'action': 'mark_as_completed', '_selected_action': [f.pk for f in files[:2]]})
+		self.client.post(url, {'action': 'mark_as_failed', '_selected_action': [files[1].pk, files[2].pk]})
+		self.assertEqual(stats.get_user_stats(self.user)['status_stats'], {'待处理': 0, '处理中': 0, '已完成': 1, '失败': 2})
+		self.assertStatsConsistent()
+
+	def test_dashboard_reads_stats_in_one_query(self):
+		for i in range(3):
+			self.create_file_transfer(self.user, name=f'{i}.txt')
+		self.client.force_login(self.user)
+		with CaptureQueriesContext(connection) as ctx:
+			response = self.client.get(reverse('file_transfer:dashboard'))
+		# 统计只查询计数表，文件表只用于最近上传列表
+		app_queries = [q['sql'] for q in ctx.captured_queries if 'file_transfer_' in q['sql']]
+		self.assertEqual(len(app_queries), 2)
+		self.assertNotIn('COUNT(', ' '.join(app_queries).upper())
+		self.assertEqual(response.context['total_files'], 3)
+		self.assertEqual(response.context['file_type_stats'], [{'file_type': 'text/plain', 'count': 3}])
+
+	def test_rebuild_command_repairs_drift(self):
+		self.create_file_transfer(self.user, content=b'abc')
+		UserFileStat.objects.filter(user=self.user, name='files').update(value=42)
+		out, err = io.StringIO(), io.StringIO()
+		call_command('rebuild_file_stats', '--dry-run', stdout=out, stderr=err)
+		self.assertIn(f'用户 {self.user.pk}', err.getvalue())
+		self.assertEqual(stats.get_user_stats(self.user)['total_files'], 42)
+
+		call_command('rebuild_file_stats', stdout=io.StringIO(), stderr=io.StringIO())
+		self.assertEqual(stats.get_user_stats(self.user)['total_files'], 1)
+		self.assertStatsConsistent()
+
+
+
+class TagTests(TempMediaMixin, TestCase):
+	def setUp(self):
+		super().setUp()
+		self.user = User.objects.create_user(username='tagger', password='pass12345')
+		self.client.force_login(self.user)
+
+	def tag_names(self, file_transfer):
+		return set(FileTag.objects.filter(file_transfer=file_transfer).values_list('tag__name', flat=True))
+
+	def history_names(self, **params):
+		response = self.client.get(reverse('file_transfer:file_history'), params)
+		return {f.original_name for f in response.context['page_obj']}
+
+	def test_parse_normalizes_and_dedupes(self):
+		self.assertEqual(Tag.parse(' Doc, docker ，DOC,, 报告 '), ['doc', 'docker', '报告'])
+		self.assertEqual(Tag.parse(''), [])
+
+	def test_save_syncs_tag_links_and_counters(self):
+		file_transfer = self.create_file_transfer(self.user, tags='Doc, Work')
+		self.assertEqual(self.tag_names(file_transfer), {'doc', 'work'})
+
+		loaded = FileTransfer.objects.get(pk=file_transfer.pk)
+		loaded.tags = 'work, docker'
+		loaded.save()
+		self.assertEqual(self.tag_names(loaded), {'work', 'docker'})
+		self.assertEqual(
+			stats.get_user_stats(self.user)['tag_stats'],
+			[{'tag': 'docker', 'count': 1}, {'tag': 'work', 'count': 1}],
+		)
+		self.assertEqual(stats.diff_stats(), set())
+
+		with self.captureOnCommitCallbacks(execute=True):
+			loaded.delete()
+		self.assertFalse(FileTag.objects.exists())
+		self.assertEqual(stats.get_user_stats(self.user)['tag_stats'], [])
+
+	def test_exact_filter_does_not_match_longer_tags(self):
+		self.create_file_transfer(self.user, name='a.txt', tags='doc')
+		self.create_file_transfer(self.user, name='b.txt', tags='docker, misc')
+		self.create_file_transfer(self.user, name='c.txt', tags='misc')
+		self.assertEqual(self.history_names(tag='DOC'), {'a.txt'})
+		self.assertEqual(self.history_names(tag_prefix='doc'), {'a.txt', 'b.txt'})
+		self.assertEqual(self.history_names(tag='missing'), set())
+
+	def test_filter_is_scoped_to_user(self):
+		other = User.objects.create_user(username='other', password='pass12345')
+		self.create_file_transfer(other, name='theirs.txt', tags='doc')
+		self.assertEqual(self.history_names(tag='doc'), set())
+
+	def test_bulk_edit_query_count_is_independent_of_row_count(self):
+		def edit_queries(count):
+			# 每次使用新用户，使两次编辑前的计数行状态相同
+			user = User.objects.create_user(username=f'bulk{count}', password='pass12345')
+			for i in range(count):
+				self.create_file_transfer(user, name=f'{i}.txt', tags='old, keep')
+			files = FileTransfer.objects.filter(uploaded_by=user)
+			with CaptureQueriesContext(connection) as ctx:
+				self.assertEqual(tagging.bulk_edit_tags(files, add=['New'], remove=['old']), count)
+			return len(ctx.captured_queries)
+
+		self.assertEqual(edit_queries(2), edit_queries(20))
+		for file_transfer in FileTransfer.objects.all():
+			self.assertEqual(file_transfer.tags, 'keep, new')
+			self.assertEqual(self.tag_names(file_transfer), {'keep', 'new'})
+		self.assertEqual(stats.diff_stats(), set())
+
+	def test_bulk_tag_api_only_edits_own_files(self):
+		mine = self.create_file_transfer(self.user, tags='a')
+		other = User.objects.create_user(username='other', password='pass12345')
+		theirs = self.create_file_transfer(other, tags='a')
+		response = self.client.post(
+			reverse('file_transfer:bulk_tag_api'),
+			json.dumps({'ids': [mine.pk, theirs.pk], 'add': ['b'], 'remove': ['a']}),
+			content_type='application/json',
+		)
+		self.assertEqual(response.json(), {'status': 'ok', 'updated': 1})
+		mine.refresh_from_db()
+		theirs.refresh_from_db()
+		self.assertEqual((mine.tags, theirs.tags), ('b', 'a'))
+
+		response = self.client.post(reverse('file_transfer:bulk_tag_api'), '{"ids": "x"}', content_type='application/json')
+		self.assertEqual(response.status_code, 400)
+
+	def test_data_migration_splits_existing_tags(self):
+		migration = __import__('file_transfer.migrations.0008_tags', fromlist=['split_existing_tags'])
+		first = self.create_file_transfer(self.user, tags='Doc, 报告，doc')
+		self.create_file_transfer(self.user, tags='报告')
+		# 模拟迁移前的状态：只有 tags 文本
+		FileTag.objects.all().delete()
+		Tag.objects.all().delete()
+		UserFileStat.objects.filter(name__startswith=stats.TAG_PREFIX).delete()
+
+		migration.split_existing_tags(apps, None)
+		self.assertEqual(self.tag_names(first), {'doc', '报告'})
+		self.assertEqual(
+			stats.get_user_stats(self.user)['tag_stats'],
+			[{'tag': 'doc', 'count': 1}, {'tag': '报告', 'count': 2}],
+		)
+		self.assertEqual(stats.diff_stats(), set())
+
+	def test_dashboard_shows_tag_cloud(self):
+		self.create_file_transfer(self.user, tags='alpha, beta')
+		self.create_file_transfer(self.user, tags='beta')
+		response = self.client.get(reverse('file_transfer:dashboard'))
+		self.assertEqual(response.context['tag_stats'], [{'tag': 'alpha', 'count': 1}, {'tag': 'beta', 'count': 2}])
+		self.assertContains(response, '?tag=beta')
+
+
+class ArchiveExportTests(TempMediaMixin, TestCase):
+	def setUp(self):
+		super().setUp()
+		self.user = User.objects.create_user(username='exporter', password='pass12345')
+		self.client.force_login(self.user)
+		self.url = reverse('file_transfer:file_export')
+
+	def download(self, response):
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response['Content-Type'], 'application/zip')
+		self.assertTrue(response.streaming)
+		return b''.join(response.streaming_content)
+
+	def open_zip(self, data):
+		archive = zipfile.ZipFile(io.BytesIO(data))
+		self.assertIsNone(archive.testzip())
+		return archive
+
+	def test_exports_selected_ids(self):
+		text = self.create_file_transfer(self.user, content=b'hello ' * 1000, name='notes.txt')
+		png = make_png()
+		image = self.create_file_transfer(self.user, content=png, name='photo.png', content_type='image/png')
+		self.create_file_transfer(self.user, name='skipped.txt')
+		archive = self.open_zip(self.download(self.client.get(self.url, {'ids': f'{text.pk},{image.pk}'})))
+
+		self.assertEqual(sorted(archive.namelist()), ['notes.txt', 'photo.png'])
+		self.assertEqual(archive.read('notes.txt'), b'hello ' * 1000)
+		self.assertEqual(archive.read('photo.png'), png)
+		# 已压缩的图片直接存储，文本使用 deflate
+		self.assertEqual(archive.getinfo('photo.png').compress_type, zipfile.ZIP_STORED)
+		self.assertEqual(archive.getinfo('notes.txt').compress_type, zipfile.ZIP_DEFLATED)
+
+	def test_exports_history_filter_set_of_own_files(self):
+		self.create_file_transfer(self.user, name='a.txt', tags='doc')
+		self.create_file_transfer(self.user, name='b.txt', tags='docker')
+		other = User.objects.create_user(username='other', password='pass12345')
+		self.create_file_transfer(other, name='c.txt', tags='doc')
+
+		archive = self.open_zip(self.download(self.client.get(self.url, {'tag': 'doc'})))
+		self.assertEqual(archive.namelist(), ['a.txt'])
+
+	def test_rejects_other_users_and_empty_selections(self):
+		other = User.objects.create_user(username='other', password='pass12345')
+		theirs = self.create_file_transfer(other, name='c.txt')
+		self.assertEqual(self.client.get(self.url, {'ids': theirs.pk}).status_code, 404)
+		self.assertEqual(self.client.get(self.url, {'ids': 'x'}).status_code, 400)
+		with override_settings(FILE_ARCHIVE_MAX_FILES=1):
+			self.create_file_transfer(self.user, name='1.txt')
+			self.create_file_transfer(self.user, name='2.txt')
+			self.assertEqual(self.client.get(self.url).status_code, 400)
+
+	def test_duplicate_names_and_missing_files(self):
+		self.create_file_transfer(self.user, content=b'one', name='same.txt')
+		self.create_file_transfer(self.user, content=b'two', name='same.txt')
+		missing = self.create_file_transfer(self.user, name='gone.txt')
+		os.remove(missing.file_path.path)
+		with self.assertLogs('file_transfer.archives', level='WARNING'):
+			archive = self.open_zip(self.download(self.client.get(self.url)))
+		self.assertEqual(sorted(archive.namelist()), ['same (2).txt', 'same.txt'])
+		self.assertEqual({archive.read(name) for name in archive.namelist()}, {b'one', b'two'})
+
+	@override_settings(FILE_DOWNLOAD_BLOCK_SIZE=16 * 1024)
+	def test_streams_in_bounded_chunks(self):
+		content = os.urandom(1024 * 1024)
+		self.create_file_transfer(self.user, content=content, name='random.bin', content_type='application/octet-stream')
+		chunks = list(self.client.get(self.url).streaming_content)
+		# 每读入一块就输出，单次输出不超过分块大小加上条目头
+		self.assertGreater(len(chunks), 32)
+		self.assertLess(max(len(chunk) for chunk in chunks), 16 * 1024 + 1024)
+		self.assertEqual(self.open_zip(b''.join(chunks)).read('random.bin'), content)
+
+	def test_zip64_beyond_limit(self):
+		contents = {f'{i}.bin': os.urandom(5000) for i in range(2)}
+		for name, content in contents.items():
+			self.create_file_transfer(self.user, content=content, name=name, content_type='application/octet-stream')
+		# 将 ZIP64 阈值调低，模拟超过 4GB 的条目和中央目录偏移
+		with mock.patch('zipfile.ZIP64_LIMIT', 1000):
+			data = self.download(self.client.get(self.url))
+		self.assertIn(b'PK\x06\x06', data)  # ZIP64 中央目录结束记录
+		archive = self.open_zip(data)
+		for name, content in contents.items():
+			self.assertEqual(archive.read(name), content)
+
+	def test_is_compressed(self):
+		self.assertTrue(compression.is_compressed(FileTransfer(original_name='a.bin', file_type='video/mp4')))
+		self.assertTrue(compression.is_compressed(FileTransfer(original_name='a.tar.gz', file_type='application/octet-stream')))
+		self.assertFalse(compression.is_compressed(FileTransfer(original_name='a.svg', file_type='image/svg+xml')))
+		self.assertFalse(compression.is_compressed(FileTransfer(original_name='a.csv', file_type='text/csv')))
+
+
+class RequestMetricsTests(TempMediaMixin, TestCase):
+	def setUp(self):
+		super().setUp()
+		self.user = User.objects.create_user(username='measured', password='pass12345')
+		self.admin = User.objects.create_superuser(username='admin', password='pass12345')
+		self.client.force_login(self.user)
+		metrics.reset()
+		self.addCleanup(metrics.reset)
+
+	def test_histogram_quantiles(self):
+		histogram = metrics.Histogram((1, 2, 5, 10))
+		for value in range(1, 11):
+			histogram.observe(value)
+		self.assertEqual(histogram.cumulative(), [(1, 1), (2, 2), (5, 5), (10, 10), (float('inf'), 10)])
+		self.assertEqual(histogram.quantile(0.5), 5)
+		self.assertAlmostEqual(histogram.quantile(0.9), 9)
+		histogram.observe(100)
+		self.assertEqual(histogram.quantile(1.0), 10)
+
+	def test_records_duration_and_queries_per_view(self):
+		self.create_file_transfer(self.user)
+		with CaptureQueriesContext(connection) as ctx:
+			self.client.get(reverse('file_transfer:dashboard'))
+		view = 'file_transfer:dashboard'
+		self.assertEqual(metrics.get_counter('requests_total', view=view, status='2xx'), 1)
+		self.assertEqual(metrics.get_histogram('request_duration_seconds', view=view).count, 1)
+		queries = metrics.get_histogram('request_db_queries', view=view)
+		self.assertEqual(queries.sum, len(ctx.captured_queries))
+		self.assertGreater(metrics.get_histogram('request_db_duration_seconds', view=view).sum, 0)
+
+	def test_counts_bytes(self):
+		file_transfer = self.create_file_transfer(self.user, content=b'x' * 3000, name='data.bin', content_type='application/octet-stream')
+		response = self.client.get(reverse('file_transfer:file_download', args=[file_transfer.id]))
+		b''.join(response.streaming_content)
+		self.assertEqual(metrics.get_counter('response_sent_bytes_total', view='file_transfer:file_download'), 3000)
+
+		# 没有 Content-Length 的流式响应在发送完毕后计入
+		response = self.client.get(reverse('file_transfer:file_export'))
+		body = b''.join(response.streaming_content)
+		response.close()
+		self.assertEqual(metrics.get_counter('response_sent_bytes_total', view='file_transfer:file_export'), len(body))
+
+		payload = json.dumps({'action': 'heartbeat'})
+		self.client.post(reverse('file_transfer:check_session'), payload, content_type='application/json')
+		self.assertEqual(metrics.get_counter('request_received_bytes_total', view='file_transfer:check_session'), len(payload))
+
+	@override_settings(CAPTCHA_POOL_SIZE=0)
+	def test_captcha_render_time(self):
+		self.client.get(reverse('file_transfer:captcha'))
+		self.assertEqual(metrics.get_histogram('captcha_render_seconds').count, 1)
+
+	async def test_async_views_count_queries_from_worker_threads(self):
+		client = AsyncClient()
+		await client.aforce_login(self.user)
+		await client.get(reverse('file_transfer:file_list_api'))
+		self.assertGreater(metrics.get_histogram('request_db_queries', view='file_transfer:file_list_api').sum, 0)
+
+	@override_settings(METRICS_SLOW_REQUEST_SECONDS=0)
+	def test_slow_request_log(self):
+		with self.assertLogs('file_transfer.metrics', level='WARNING') as logs:
+			self.client.get(reverse('file_transfer:dashboard'))
+		self.assertIn('file_transfer:dashboard', logs.output[0])
+		self.assertIn('SELECT', logs.output[0])
+
+	def test_prometheus_endpoint_is_staff_only(self):
+		url = reverse('file_transfer:metrics')
+		self.client.get(reverse('file_transfer:dashboard'))
+		self.assertEqual(self.client.get(url).status_code, 302)
+
+		self.client.force_login(self.admin)
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, 200)
+		self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+		text = response.content.decode()
+		self.assertIn('# TYPE file_transfer_request_duration_seconds histogram', text)
+		self.assertIn('file_transfer_request_duration_seconds_bucket{view="file_transfer:dashboard",le="+Inf"} 1', text)
+		self.assertIn('file_transfer_requests_total{status="2xx",view="file_transfer:dashboard"} 1', text)
+		self.assertIn('file_transfer_page_cache_misses_total{cache="dashboard"}', text)
+
+	@override_settings(METRICS_ENABLED=False)
+	def test_disabled(self):
+		self.client.get(reverse('file_transfer:dashboard'))
+		self.assertEqual(metrics.get_counter('requests_total', view='file_transfer:dashboard', status='2xx'), 0)
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN 的输出格式为 SQLite 专有')
+class QueryPlanTests(TempMediaMixin, TestCase):
+	"""对各视图执行的查询运行 EXPLAIN，出现全表扫描或未命中索引的排序时失败"""
+
+	# SQLite 的全表扫描形如 "SCAN file_transfer_filetransfer"，使用索引时带有 USING ... INDEX
+	FULL_SCAN_RE = re.compile(r'^SCAN (\w+)$')
+	# 排序没有命中索引时需要把结果集整体排序
+	TEMP_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+
+	def setUp(self):
+		super().setUp()
+		self.user = User.objects.create_user(username='planner', password='pass12345')
+		other = User.objects.create_user(username='noise', password='pass12345')
+		self.files = [self.create_file_transfer(self.user, name=f'report{i}.txt') for i in range(3)]
+		self.create_file_transfer(other, name='other.txt')
+		self.client.force_login(self.user)
+		self.tables = set(connection.introspection.table_names())
+
+	def full_scans(self, sql):
+		with connection.cursor() as cursor:
+			cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+			details = [row[-1] for row in cursor.fetchall()]
+		return [
+			detail for detail in details
+			if (match := self.FULL_SCAN_RE.match(detail)) and match.group(1) in self.tables
+			or detail == self.TEMP_SORT
+		]
+
+	def assertNoFullScans(self, func, allow_sort=False):
+		"""allow_sort 为 True 时允许临时排序（按相关度排序的检索结果无法由索引提供顺序）"""
+		with CaptureQueriesContext(connection) as ctx:
+			func()
+		for query in ctx.captured_queries:
+			sql = query['sql']
+			if not sql.lstrip().upper().startswith('SELECT'):
+				continue
+			scans = self.full_scans(sql)
+			if allow_sort:
+				scans = [scan for scan in scans if scan != self.TEMP_SORT]
+			self.assertEqual(scans, [], f'全表扫描: {sql}')
+
+	def get(self, name, *args, **params):
+		response = self.client.get(reverse(f'file_transfer:{name}', args=args), params)
+		self.assertLess(response.status_code, 400)
+		return response
+
+	def test_dashboard(self):
+		self.assertNoFullScans(lambda: self.get('dashboard'))
+
+	def test_history(self):
+		self.assertNoFullScans(lambda: self.get('file_history'))
+		self.assertNoFullScans(lambda: self.get('file_history', status='pending'))
+		self.assertNoFullScans(lambda: self.get('file_history', file_type='text'))
+		self.assertNoFullScans(lambda: self.get('file_history', search='report'), allow_sort=True)
+		self.assertNoFullScans(lambda: self.get('file_history', search='报告'))
+
+	def test_tag_filters(self):
+		tagging.bulk_add_tags(FileTransfer.objects.filter(uploaded_by=self.user), ['docs'])
+		self.assertNoFullScans(lambda: self.get('file_history', tag='docs'))
+		self.assertNoFullScans(lambda: self.get('file_history', tag_prefix='do'))
+		self.assertNoFullScans(lambda: self.get('file_list_api', tag='docs', count='exact'))
+
+	def test_file_list_api_pages(self):
+		cursor = self.get('file_list_api', page_size=1).json()['next']
+		self.assertNoFullScans(lambda: self.get('file_list_api', page_size=1, cursor=cursor, count='approximate'))
+		self.assertNoFullScans(lambda: self.get('file_list_api', status='pending', count='exact'))
+
+	def test_harness_detects_full_scan(self):
+		self.assertTrue(self.full_scans("SELECT * FROM file_transfer_filetransfer WHERE description = 'x'"))
+
+	def test_detail_and_download(self):
+		file_transfer = self.files[0]
+		self.assertNoFullScans(lambda: self.get('file_detail', file_transfer.id))
+		self.assertNoFullScans(lambda: b''.join(self.get('file_download', file_transfer.id).streaming_content))
+
+	def test_worker_claim(self):
+		self.assertNoFullScans(processing.claim_next_pending)
+
+
+class PageCacheTests(TempMediaMixin, TestCase):
+	def setUp(self):
+		super().setUp()
+		self.user = User.objects.create_user(username='cached', password='pass12345')
+		self.admin = User.objects.create_superuser(username='admin', password='pass12345')
+		self.client.force_login(self.user)
+		caching.reset_stats()
+		self.addCleanup(caching.reset_stats)
+
+	def app_queries(self, url, **params):
+		with CaptureQueriesContext(connection) as ctx:
+			response = self.client.get(url, params)
+		self.assertEqual(response.status_code, 200)
+		return response, [q['sql'] for q in ctx.captured_queries if 'file_transfer_' in q['sql']]
+
+	def test_dashboard_is_cached_until_upload(self):
+		url = reverse('file_transfer:dashboard')
+		self.create_file_transfer(self.user, name='a.txt')
+		response, queries = self.app_queries(url)
+		self.assertEqual(response.context['total_files'], 1)
+		self.assertTrue(queries)
+		response, queries = self.app_queries(url)
+		self.assertEqual(queries, [])
+		self.assertEqual(caching.get_stats()['dashboard'], {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+		self.create_file_transfer(self.user, name='b.txt')
+		response, _ = self.app_queries(url)
+		self.assertEqual(response.context['total_files'], 2)
+
+	def test_history_invalidated_by_delete(self):
+		url = reverse('file_transfer:file_history')
+		file_transfer = self.create_file_transfer(self.user, name='gone.txt')
+		self.app_queries(url)
+		response, queries = self.app_queries(url)
+		self.assertEqual(queries, [])
+		self.assertEqual(len(response.context['page_obj']), 1)
+
+		with self.captureOnCommitCallbacks(execute=True):
+			file_transfer.delete()
+		response, _ = self.app_queries(url)
+		self.assertEqual(len(response.context['page_obj']), 0)
+
+	def test_admin_status_change_invalidates(self):
+		file_transfer = self.create_file_transfer(self.user)
+		api_url = reverse('file_transfer:file_list_api')
+		self.assertEqual(self.client.get(api_url).json()['results'][0]['status'], 'pending')
+
+		admin_client = Client()
+		admin_client.force_login(self.admin)
+		admin_client.post(reverse('admin:file_transfer_filetransfer_changelist'), {
+			'action': 'mark_as_completed', '_selected_action': [file_transfer.pk],
+		})
+		self.assertEqual(self.client.get(api_url).json()['results'][0]['status'], 'completed')
+
+	def test_cache_is_per_user(self):
+		other = User.objects.create_user(username='other', password='pass12345')
+		self.create_file_transfer(self.user, name='mine.txt')
+		self.client.get(reverse('file_transfer:file_history'))
+		other_client = Client()
+		other_client.force_login(other)
+		response = other_client.get(reverse('file_transfer:file_history'))
+		self.assertEqual(len(response.context['page_obj']), 0)
+
+	def test_detail_fragment_cached(self):
+		file_transfer = self.create_file_transfer(self.user, name='detail.txt', description='first')
+		url = reverse('file_transfer:file_detail', args=[file_transfer.id])
+		self.assertContains(self.client.get(url), 'first')
+		self.assertContains(self.client.get(url), 'first')
+		self.assertEqual(caching.get_stats()['file_detail']['hits'], 1)
+
+		file_transfer.description = 'second'
+		file_transfer.save()
+		self.assertContains(self.client.get(url), 'second')
+
+	def test_file_based_backend(self):
+		cache_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+		with override_settings(CACHES=temp_cache_settings(cache_dir)):
+			url = reverse('file_transfer:dashboard')
+			self.create_file_transfer(self.user)
+			self.app_queries(url)
+			_, queries = self.app_queries(url)
+			self.assertEqual(queries, [])
+			self.create_file_transfer(self.user, name='second.txt')
+			response, _ = self.app_queries(url)
+			self.assertEqual(response.context['total_files'], 2)
+
+	def test_invalidation_from_worker_process(self):
+		"""process_uploads 在独立进程中失效缓存，web 进程随后读取到新数据"""
+		cache_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+		worker = (
+			'import sys\n'
+			'import django\n'
+			'from django.conf import settings\n'
+			'settings.CACHES = {"default": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": sys.argv[1]}}\n'
+			'django.setup()\n'
+			'from file_transfer import caching\n'
+			'caching.invalidate_user(int(sys.argv[2]))\n'
+		)
+		url = reverse('file_transfer:dashboard')
+		file_transfer = self.create_file_transfer(self.user)
+		with override_settings(CACHES=temp_cache_settings(cache_dir)):
+			self.app_queries(url)
+			# worker 更新状态不经过本进程的信号，只由 worker 进程递增版本号
+			FileTransfer.objects.filter(pk=file_transfer.pk).update(status='completed')
+			response, queries = self.app_queries(url)
+			self.assertEqual(queries, [])
+			self.assertEqual(response.context['recent_files'][0].status, 'pending')
+			subprocess.run(
+				[sys.executable, '-c', worker, cache_dir, str(self.user.pk)],
+				cwd=settings.BASE_DIR, env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'file_transfer_system.settings'},
+				check=True,
+			)
+			response, _ = self.app_queries(url)
+			self.assertEqual(response.context['recent_files'][0].status, 'completed')
+
+	def test_process_local_backend_is_not_used(self):
+		url = reverse('file_transfer:dashboard')
+		self.create_file_transfer(self.user)
+		locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'page-cache-test'}}
+		with override_settings(CACHES=locmem):
+			self.app_queries(url)
+			_, queries = self.app_queries(url)
+			self.assertTrue(queries)
+		with override_settings(CACHES=locmem, FILE_CACHE_ALLOW_PROCESS_LOCAL=True):
+			self.app_queries(url)
+			_, queries = self.app_queries(url)
+			self.assertEqual(queries, [])
+
+	def test_stats_endpoint_is_staff_only(self):
+		url = reverse('file_transfer:cache_stats')
+		self.assertEqual(self.client.get(url).status_code, 302)
+		self.client.get(reverse('file_transfer:dashboard'))
+		self.client.force_login(self.admin)
+		data = self.client.get(url).json()
+		self.assertEqual(data['caches']['dashboard']['misses'], 1)
+
+
+class SQLiteProductionBackendTests(unittest.TestCase):
+	"""SQLite 生产模式后端：在临时文件数据库上验证 PRAGMA 与并发写入
+
+	使用独立的连接别名而不是测试数据库，因此继承 unittest.TestCase。
+	"""
+
+	def open_connection(self, engine='file_transfer.sqlite_backend', **options):
+		from django.db import connections
+		alias = f'sqlite_{engine.rsplit(".", 1)[-1]}_{len(connections.settings)}'
+		connections.settings[alias] = {
+			**connection.settings_dict,
+			'ENGINE': engine,
+			'NAME': os.path.join(self.db_dir, 'stress.sqlite3'),
+			'OPTIONS': options,
+			'TEST': {},
+		}
+		self.addCleanup(self.drop_connection, alias)
+		return alias
+
+	def drop_connection(self, alias):
+		from django.db import connections
+		connections[alias].close()
+		del connections[alias]
+		del connections.settings[alias]
+
+	def setUp(self):
+		self.db_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.db_dir, ignore_errors=True)
+
+	def run_writers(self, alias, writers=8, iterations=25):
+		"""多个线程并发执行“先读后写”的事务，返回 (锁错误数, 最终计数)"""
+		import threading
+		from django.db import OperationalError, connections, transaction
+
+		with connections[alias].cursor() as cursor:
+			cursor.execute('CREATE TABLE counter (id INTEGER PRIMARY KEY, value INTEGER NOT NULL)')
+			cursor.execute('INSERT INTO counter (id, value) VALUES (1, 0)')
+		connections[alias].close()
+
+		errors = []
+		barrier = threading.Barrier(writers)
+
+		def writer():
+			barrier.wait()
+			try:
+				for _ in range(iterations):
+					try:
+						with transaction.atomic(using=alias):
+							with connections[alias].cursor() as cursor:
+								cursor.execute('SELECT value FROM counter WHERE id = 1')
+								value = cursor.fetchone()[0]
+								cursor.execute('UPDATE counter SET value = %s WHERE id = 1', [value + 1])
+					except OperationalError as exc:
+						errors.append(exc)
+			finally:
+				connections[alias].close()
+
+		threads = [threading.Thread(target=writer) for _ in range(writers)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		with connections[alias].cursor() as cursor:
+			cursor.execute('SELECT value FROM counter WHERE id = 1')
+			value = cursor.fetchone()[0]
+		connections[alias].close()
+		return errors, value
+
+	def test_pragmas_applied(self):
+		from django.db import connections
+		alias = self.open_connection(pragmas={'cache_size': -2000})
+		with connections[alias].cursor() as cursor:
+			results = {}
+			for name in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'temp_store'):
+				cursor.execute(f'PRAGMA {name}')
+				results[name] = cursor.fetchone()[0]
+		connections[alias].close()
+		self.assertEqual(results, {
+			'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000, 'cache_size': -2000, 'temp_store': 2,
+		})
+
+	def test_rejects_malformed_pragma(self):
+		from django.db import connections
+		alias = self.open_connection(pragmas={'cache_size': '1; DROP TABLE x'})
+		with self.assertRaises(ValueError):
+			connections[alias].ensure_connection()
+
+	def test_concurrent_writers_do_not_hit_lock_errors(self):
+		errors, value = self.run_writers(self.open_connection())
+		self.assertEqual(errors, [])
+		self.assertEqual(value, 8 * 25)
+
+	def test_locked_autocommit_statement_is_retried(self):
+		from django.db import connections
+		import sqlite3
+		alias = self.open_connection(pragmas={'busy_timeout': 0}, write_retry_delay=0.01)
+		with connections[alias].cursor() as cursor:
+			cursor.execute('CREATE TABLE t (id INTEGER PRIMARY KEY)')
+		# 另一个连接持有写锁，短暂后释放
+		blocker = sqlite3.connect(connections[alias].settings_dict['NAME'], isolation_level=None, check_same_thread=False)
+		blocker.execute('BEGIN IMMEDIATE')
+		import threading
+		timer = threading.Timer(0.05, lambda: blocker.execute('COMMIT'))
+		timer.start()
+		try:
+			with connections[alias].cursor() as cursor:
+				cursor.execute('INSERT INTO t (id) VALUES (1)')
+		finally:
+			timer.join()
+			blocker.close()
+			connections[alias].close()
+
+
+class ReplicaRoutingTests(TestCase):
+	def setUp(self):
+		self.router = routers.PrimaryReplicaRouter()
+
+	@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+	def test_reads_go_to_replicas_until_a_write(self):
+		with routers.request_scope():
+			self.assertIn(self.router.db_for_read(FileTransfer), {'replica1', 'replica2'})
+			# 会话和用户不参与分流
+			self.assertEqual(self.router.db_for_read(User), 'default')
+			self.assertEqual(self.router.db_for_write(User), 'default')
+			self.assertFalse(routers.wrote_to_primary())
+
+			self.assertEqual(self.router.db_for_write(FileTransfer), 'default')
+			self.assertTrue(routers.wrote_to_primary())
+			self.assertEqual(self.router.db_for_read(FileTransfer), 'default')
+		with routers.request_scope():
+			self.assertIn(self.router.db_for_read(FileTransfer), {'replica1', 'replica2'})
+
+	def test_without_replicas_everything_uses_primary(self):
+		with routers.request_scope():
+			self.assertEqual(self.router.db_for_read(FileTransfer), 'default')
+
+	@override_settings(DATABASE_REPLICAS=['replica'], DATABASE_PRIMARY_PIN_SECONDS=30)
+	def test_middleware_pins_follow_up_requests(self):
+		from django.test import RequestFactory
+		from .middleware import ReplicaPinningMiddleware
+
+		seen = []
+
+		def writing_view(request):
+			seen.append(routers.is_pinned())
+			self.router.db_for_write(FileTransfer)
+			return HttpResponse('ok')
+
+		def reading_view(request):
+			seen.append(routers.is_pinned())
+			return HttpResponse('ok')
+
+		factory = RequestFactory()
+		response = ReplicaPinningMiddleware(writing_view)(factory.post('/'))
+		cookie = response.cookies[ReplicaPinningMiddleware.cookie_name]
+		self.assertEqual(cookie['max-age'], 30)
+
+		request = factory.get('/')
+		request.COOKIES[ReplicaPinningMiddleware.cookie_name] = cookie.value
+		ReplicaPinningMiddleware(reading_view)(request)
+		ReplicaPinningMiddleware(reading_view)(factory.get('/'))
+		self.assertEqual(seen, [True, True, False])
+
+
+class ReplicaStandInTests(unittest.TestCase):
+	"""用两个本地 SQLite 文件分别充当主库和副本，复制用 SQLite 在线备份模拟
+
+	使用独立的连接别名而不是测试数据库，因此继承 unittest.TestCase。
+	"""
+
+	aliases = ('standin_primary', 'standin_replica')
+
+	@classmethod
+	def setUpClass(cls):
+		from django.db import connections
+		super().setUpClass()
+		cls.db_dir = tempfile.mkdtemp()
+		for alias in cls.aliases:
+			connections.settings[alias] = {
+				**connection.settings_dict,
+				'ENGINE': 'django.db.backends.sqlite3',
+				'NAME': os.path.join(cls.db_dir, f'{alias}.sqlite3'),
+				'OPTIONS': {},
+				'TEST': {},
+			}
+			call_command('migrate', database=alias, verbosity=0)
+			connections[alias].close()
+
+	@classmethod
+	def tearDownClass(cls):
+		from django.db import connections
+		for alias in cls.aliases:
+			connections[alias].close()
+			del connections[alias]
+			del connections.settings[alias]
+		shutil.rmtree(cls.db_dir, ignore_errors=True)
+		super().tearDownClass()
+
+	def replicate(self):
+		import sqlite3
+		from django.db import connections
+		for alias in self.aliases:
+			connections[alias].close()
+		primary, replica = (sqlite3.connect(connections.settings[alias]['NAME']) for alias in self.aliases)
+		with primary, replica:
+			primary.backup(replica)
+		primary.close()
+		replica.close()
+
+	@override_settings(DATABASE_PRIMARY='standin_primary', DATABASE_REPLICAS=['standin_replica'])
+	def test_read_your_writes_then_replica(self):
+		with routers.request_scope():
+			user = User.objects.create(username='standin')
+			file_transfer = FileTransfer.objects.create(
+				file_name='a.txt', original_name='a.txt', file_size=1,
+				file_path='uploads/a.txt', file_type='text/plain', uploaded_by=user,
+			)
+			self.assertEqual(file_transfer._state.db, 'standin_primary')
+			# 写入后固定到主库，立即可见
+			self.assertTrue(FileTransfer.objects.filter(pk=file_transfer.pk).exists())
+
+		with routers.request_scope():
+			# 新请求读取副本，尚未复制
+			self.assertFalse(FileTransfer.objects.filter(pk=file_transfer.pk).exists())
+
+		self.replicate()
+		with routers.request_scope():
+			loaded = FileTransfer.objects.get(pk=file_transfer.pk)
+			self.assertEqual(loaded._state.db, 'standin_replica')
+			# 从副本读出的对象写回主库
+			loaded.description = 'updated'
+			loaded.save()
+			self.assertEqual(loaded._state.db, 'standin_primary')
+			self.assertEqual(FileTransfer.objects.get(pk=file_transfer.pk).description, 'updated')
+
+	@override_settings(DATABASE_PRIMARY='standin_primary', DATABASE_REPLICAS=['standin_replica'])
+	def test_search_backend_follows_queried_database(self):
+		from django.db import connections
+		with routers.request_scope():
+			user = User.objects.create(username='standin-search')
+			FileTransfer.objects.create(
+				file_name='report.pdf', original_name='quarterly_report.pdf', file_size=1,
+				file_path='uploads/report.pdf', file_type='application/pdf', uploaded_by=user,
+			)
+		self.replicate()
+		with routers.request_scope():
+			# 默认连接是其他类型的数据库时，按副本的类型生成检索 SQL
+			with mock.patch.object(connections['default'], 'vendor', 'postgresql'):
+				results = search.search_file_transfers(FileTransfer.objects.filter(uploaded_by=user), 'quart', owner=user)
+				self.assertEqual(results.db, 'standin_replica')
+				self.assertEqual([f.original_name for f in results], ['quarterly_report.pdf'])
+
+	@override_settings(DATABASE_PRIMARY='standin_primary', DATABASE_REPLICAS=['standin_replica'])
+	def test_stats_stay_consistent_with_lagging_replica(self):
+		with routers.request_scope():
+			user = User.objects.create_user(username='lagging', password='pass12345')
+			kept, deleted = (
+				FileTransfer.objects.create(
+					file_name=name, original_name=name, file_size=1,
+					file_path=f'uploads/{name}', file_type='text/plain', uploaded_by=user,
+				)
+				for name in ('kept.txt', 'deleted.txt')
+			)
+		self.replicate()
+		with routers.request_scope(pinned=True):
+			stats.update_status(FileTransfer.objects.filter(pk__in=[kept.pk, deleted.pk]), 'completed')
+			tagging.bulk_add_tags(FileTransfer.objects.filter(pk=kept.pk), ['old'])
+		# 状态和标签的变更尚未复制到副本
+
+		client = Client()
+		client.force_login(user)
+		response = client.post(reverse('file_transfer:file_delete', args=[deleted.pk]))
+		self.assertEqual(response['Location'], reverse('file_transfer:file_history'))
+		# 不依赖上一个写请求设置的固定 Cookie
+		from .middleware import ReplicaPinningMiddleware
+		del client.cookies[ReplicaPinningMiddleware.cookie_name]
+		response = client.post(
+			reverse('file_transfer:bulk_tag_api'),
+			json.dumps({'ids': [kept.pk], 'remove': ['old']}), content_type='application/json',
+		)
+		self.assertEqual(response.json()['updated'], 1)
+
+		with routers.request_scope(pinned=True):
+			self.assertEqual(stats.diff_stats([user.pk]), set())
+			counts = dict(UserFileStat.objects.filter(user=user).values_list('name', 'value'))
+		self.assertEqual(counts['files'], 1)
+		self.assertEqual(counts['status:completed'], 1)
+		self.assertEqual(counts['status:pending'], 0)
+		self.assertEqual(counts['tag:old'], 0)
@@ -0,0 +1,102 @@
+"""图片缩略图生成与磁盘缓存
+
+缩略图按内容摘要和尺寸缓存在 MEDIA_ROOT/thumbnails/ab/<sha256>_<size>.<ext>，
+相同内容的文件共享缩略图。默认在首次请求时生成，也可以在上传后预先生成。
+"""
+import os
+import tempfile
+
+from django.conf import settings
+from PIL import Image, ImageOps, features
+
+THUMBNAIL_DIR = 'thumbnails'
+
+# 预设尺寸（最长边不超过给定宽高）
+DEFAULT_SIZES = {
+    'small': (64, 64),
+    'medium': (320, 320),
+    'large': (800, 800),
+}
+
+DEFAULT_QUALITY = 80
+
+
+def get_sizes():
+    return getattr(settings, 'FILE_THUMBNAIL_SIZES', DEFAULT_SIZES)
+
+
+def get_format():
+    """优先使用 WebP，Pillow 未编译 WebP 支持时回退到 JPEG"""
+    fmt = getattr(settings, 'FILE_THUMBNAIL_FORMAT', 'WEBP').upper()
+    if fmt == 'WEBP' and not features.check('webp'):
+        fmt = 'JPEG'
+    return fmt
+
+
+def get_content_type():
+    return 'image/webp' if get_format() == 'WEBP' else 'image/jpeg'
+
+
+def cache_key(file_transfer):
+    """以内容摘要作为缓存键，旧记录没有摘要时退化为记录 ID"""
+    return file_transfer.sha256 or f'id{file_transfer.pk}'
+
+
+def thumbnail_path(file_transfer, size):
+    key = cache_key(file_transfer)
+    ext = 'webp' if get_format() == 'WEBP' else 'jpg'
+    return os.path.join(settings.MEDIA_ROOT, THUMBNAIL_DIR, key[:2], f'{key}_{size}.{ext}')
+
+
+def _render(source_path, destination, bounds):
+    with Image.open(source_path) as image:
+        # JPEG 可在解码阶段直接缩小，避免解码全尺寸图片
+        image.draft('RGB', (bounds[0] * 2, bounds[1] * 2))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(bounds, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+        fmt = get_format()
+        has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        target_mode = 'RGBA' if fmt == 'WEBP' and has_alpha else 'RGB'
+        if image.mode != target_mode:
+            image = image.convert(target_mode)
+
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        # 写入临时文件后原子替换，并发请求不会读到不完整的缩略图
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(destination), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, fmt, quality=getattr(settings, 'FILE_THUMBNAIL_QUALITY', DEFAULT_QUALITY))
+            os.replace(tmp_path, destination)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+def get_thumbnail(file_transfer, size):
+    """返回缩略图路径，缓存不存在时生成；不是图片或尺寸未知时返回 None"""
+    bounds = get_sizes().get(size)
+    if bounds is None or not file_transfer.is_image():
+        return None
+    path = thumbnail_path(file_transfer, size)
+    if not os.path.exists(path):
+        _render(file_transfer.file_path.path, path, bounds)
+    return path
+
+
+def generate_thumbnails(file_transfer):
+    """为所有预设尺寸生成缩略图（上传后预生成使用）"""
+    if not file_transfer.is_image():
+        return []
+    return [get_thumbnail(file_transfer, size) for size in get_sizes()]
+
+
+def delete_thumbnails(key):
+    """删除指定缓存键（内容摘要）的所有缩略图"""
+    directory = os.path.join(settings.MEDIA_ROOT, THUMBNAIL_DIR, key[:2])
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.startswith(f'{key}_'):
+            os.remove(os.path.join(directory, name))
+
@@ -0,0 +1,169 @@
+"""在上传数据流入时同步计算摘要的上传处理器
+
+在 Django 默认的内存与临时文件处理器基础上逐块更新摘要，
+完成后将 sha256 / crc32 挂在生成的 UploadedFile 上，保存时无需再次读取文件。
+
+较大的文件由 StagedFileUploadHandler 直接写入 MEDIA_ROOT 下的暂存目录，与 Blob 存储位于同一文件系统，
+保存时通过 os.replace 原子地移动到最终位置，每个字节只写入磁盘一次。Content-Length 已超过大小上限的请求
+在写入任何文件数据前拒绝，未声明长度的请求在接收过程中超过上限即中止，不再读取剩余的请求体。
+进程崩溃时遗留在暂存目录中的文件由 purge_stale_incoming() 按修改时间清理。
+"""
+import datetime
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import (
+    FileUploadHandler,
+    MemoryFileUploadHandler,
+    StopUpload,
+    TemporaryFileUploadHandler,
+)
+
+from .forms import MAX_UPLOAD_SIZE
+from .hashing import ContentHasher
+
+# multipart 请求体中除文件内容外的分隔行、表单字段等开销的上限
+MULTIPART_OVERHEAD = 64 * 1024
+
+# 默认暂存文件的最长保留时间（自最后一次写入起）
+DEFAULT_INCOMING_MAX_AGE = datetime.timedelta(hours=1)
+
+STAGED_SUFFIX = '.upload'
+
+
+def get_incoming_dir():
+    """暂存目录位于 MEDIA_ROOT 下，保证与最终存储路径在同一文件系统"""
+    return os.path.join(settings.MEDIA_ROOT, getattr(settings, 'FILE_UPLOAD_INCOMING_DIR', 'incoming'))
+
+
+def get_incoming_max_age():
+    return getattr(settings, 'FILE_UPLOAD_INCOMING_MAX_AGE', DEFAULT_INCOMING_MAX_AGE)
+
+
+def purge_stale_incoming(max_age=None):
+    """删除暂存目录中超过保留时间未修改的文件（进程崩溃或被强制结束时遗留），返回删除的文件数
+
+    接收中的文件每写入一块都会更新修改时间，不会被误删。
+    """
+    max_age = get_incoming_max_age() if max_age is None else max_age
+    cutoff = time.time() - max_age.total_seconds()
+    purged = 0
+    try:
+        entries = os.scandir(get_incoming_dir())
+    except FileNotFoundError:
+        return 0
+    with entries:
+        for entry in entries:
+            if not entry.name.endswith(STAGED_SUFFIX) or not entry.is_file(follow_symlinks=False):
+                continue
+            try:
+                if entry.stat(follow_symlinks=False).st_mtime >= cutoff:
+                    continue
+                os.remove(entry.path)
+            except FileNotFoundError:
+                # 已被保存或关闭
+                continue
+            purged += 1
+    return purged
+
+
+class HashingUploadHandlerMixin:
+    """只对当前处理器实际接收的数据计算摘要，避免处理器链中重复计算"""
+
+    def new_file(self, *args, **kwargs):
+        # 父类可能抛出 StopFutureHandlers，需先初始化
+        self.hasher = ContentHasher()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        remaining = super().receive_data_chunk(raw_data, start)
+        if remaining is None:
+            self.hasher.update(raw_data)
+        return remaining
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.hasher.sha256
+            file.crc32 = self.hasher.crc32
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    """小文件保存在内存中并计算摘要"""
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    """大文件写入临时文件并计算摘要"""
+
+
+class StagedUploadedFile(UploadedFile):
+    """写入暂存目录的上传文件
+
+    staged_path 供保存时 os.replace 到最终位置；关闭时删除仍留在暂存目录中的文件（未保存或上传中止）。
+    """
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        directory = get_incoming_dir()
+        os.makedirs(directory, exist_ok=True)
+        fd, self.staged_path = tempfile.mkstemp(suffix=STAGED_SUFFIX, dir=directory)
+        super().__init__(os.fdopen(fd, 'w+b'), name, content_type, size, charset, content_type_extra)
+
+    def temporary_file_path(self):
+        return self.staged_path
+
+    def close(self):
+        try:
+            self.file.close()
+        finally:
+            try:
+                os.remove(self.staged_path)
+            except FileNotFoundError:
+                # 已移动到最终位置
+                pass
+
+
+class StagedFileUploadHandler(FileUploadHandler):
+    """大文件直接写入 MEDIA_ROOT 下的暂存文件，超过 MAX_UPLOAD_SIZE 时立即中止"""
+
+    too_large = False
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # 请求体超过上限与表单开销之和时文件必然超限；不在这里中止解析，
+        # 以便文件之前的表单字段（CSRF 令牌）照常读取，到文件开始时再拒绝
+        self.too_large = content_length > MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        if self.too_large:
+            self._reject()
+        self.file = StagedUploadedFile(
+            self.file_name, self.content_type, 0, self.charset, self.content_type_extra
+        )
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > MAX_UPLOAD_SIZE:
+            self._reject()
+        self.file.write(raw_data)
+
+    def _reject(self):
+        # 视图据此提示用户；connection_reset 使解析器不再读取剩余数据
+        self.request.upload_error = '文件大小不能超过100MB'
+        raise StopUpload(connection_reset=True)
+
+    def file_complete(self, file_size):
+        self.file.flush()
+        self.file.seek(0)
+        self.file.size = file_size
+        return self.file
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            self.file.close()
+
+
+class HashingStagedFileUploadHandler(HashingUploadHandlerMixin, StagedFileUploadHandler):
+    """大文件写入暂存目录并计算摘要"""
@@ -0,0 +1,269 @@
+"""分块断点续传上传
+
+流程：创建上传会话 -> 按序号 PUT 分块 -> 查询已接收分块 -> 合并生成 FileTransfer。
+每个分块直接写入暂存文件中的最终偏移位置，合并时通过 os.replace 移动到 Blob 存储，
+不会产生第二份拷贝。不同分块写入互不重叠的区域，因此可以并发上传。
+分块记录用单条 upsert 写入，数据库暂时被锁（OperationalError）时视图返回 503，客户端可重传该分块。
+"""
+import datetime
+import logging
+import os
+import time
+
+from django import forms
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .blobstore import hash_path, store_local_file
+from .forms import validate_upload
+from .models import FileTransfer, UploadChunk, UploadSession
+
+# 默认分块大小 5MB
+DEFAULT_CHUNK_SIZE = 5 * 1024 * 1024
+
+# 客户端可指定的分块大小范围及分块数上限，避免极小分块产生海量分块记录
+DEFAULT_MIN_CHUNK_SIZE = 256 * 1024
+DEFAULT_MAX_CHUNK_SIZE = 16 * 1024 * 1024
+DEFAULT_MAX_CHUNKS = 10000
+
+# 上传会话在最后一次写入分块后的有效期
+DEFAULT_SESSION_TTL = datetime.timedelta(hours=24)
+
+# 从请求体读取数据时的块大小
+READ_BLOCK_SIZE = 64 * 1024
+
+# 写入者登记的租期：登记后超过该时间仍未注销（注销失败或进程崩溃）的写入者不再阻止合并
+WRITER_LEASE = datetime.timedelta(minutes=10)
+
+# 注销写入者时数据库被锁的重试次数
+RELEASE_ATTEMPTS = 5
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkedUploadError(Exception):
+    """分块上传请求不合法"""
+
+
+class ChunkedUploadConflict(ChunkedUploadError):
+    """上传会话的状态不允许当前操作（已结束、正在合并或暂存文件已被清理）"""
+
+
+def get_session_ttl():
+    return getattr(settings, 'FILE_UPLOAD_SESSION_TTL', DEFAULT_SESSION_TTL)
+
+
+def _expiry():
+    return timezone.now() + get_session_ttl()
+
+
+def get_staging_dir():
+    """暂存目录位于 MEDIA_ROOT 下，保证与最终存储路径在同一文件系统"""
+    return os.path.join(settings.MEDIA_ROOT, getattr(settings, 'FILE_UPLOAD_STAGING_DIR', 'chunked'))
+
+
+def get_staging_path(session):
+    return os.path.join(get_staging_dir(), f'{session.id}.part')
+
+
+def create_session(user, original_name, file_size, file_type='', chunk_size=None, description='', tags=''):
+    """创建上传会话并预分配暂存文件"""
+    if not original_name:
+        raise ChunkedUploadError('缺少文件名')
+    try:
+        file_size = int(file_size)
+        chunk_size = int(chunk_size or getattr(settings, 'FILE_UPLOAD_CHUNK_SIZE', DEFAULT_CHUNK_SIZE))
+    except (TypeError, ValueError):
+        raise ChunkedUploadError('文件大小或分块大小无效')
+    if file_size < 0 or chunk_size <= 0:
+        raise ChunkedUploadError('文件大小或分块大小无效')
+    min_chunk_size = getattr(settings, 'FILE_UPLOAD_MIN_CHUNK_SIZE', DEFAULT_MIN_CHUNK_SIZE)
+    max_chunk_size = getattr(settings, 'FILE_UPLOAD_MAX_CHUNK_SIZE', DEFAULT_MAX_CHUNK_SIZE)
+    # 整个文件只有一个分块时，分块大小不影响分块数
+    if chunk_size > max_chunk_size or (chunk_size < min_chunk_size and chunk_size < file_size):
+        raise ChunkedUploadError(f'分块大小应在 {min_chunk_size} 到 {max_chunk_size} 字节之间')
+    max_chunks = getattr(settings, 'FILE_UPLOAD_MAX_CHUNKS', DEFAULT_MAX_CHUNKS)
+    if -(-file_size // chunk_size) > max_chunks:
+        raise ChunkedUploadError(f'分块数不能超过 {max_chunks}')
+    try:
+        validate_upload(original_name, file_size)
+    except forms.ValidationError as e:
+        raise ChunkedUploadError(' '.join(e.messages))
+
+    session = UploadSession.objects.create(
+        uploaded_by=user,
+        original_name=os.path.basename(original_name),
+        file_size=file_size,
+        file_type=file_type or 'application/octet-stream',
+        chunk_size=chunk_size,
+        description=description,
+        tags=tags,
+        expires_at=_expiry(),
+    )
+    os.makedirs(get_staging_dir(), exist_ok=True)
+    with open(get_staging_path(session), 'wb') as f:
+        # 稀疏文件，分块写入时无需扩展文件
+        f.truncate(file_size)
+    return session
+
+
+def write_chunk(session, index, stream, length, offset=None):
+    """将请求体直接写入暂存文件中分块对应的偏移位置
+
+    重复上传同一分块是幂等的，会覆盖原有数据。写入前在数据库中登记为写入者，
+    合并只能在没有写入者时开始，因此不会向已计算摘要或已移走的暂存文件写入数据。
+    """
+    if index < 0 or index >= session.total_chunks:
+        raise ChunkedUploadError('分块序号超出范围')
+    expected_offset = session.chunk_offset(index)
+    if offset is not None and offset != expected_offset:
+        raise ChunkedUploadError(f'分块 {index} 的偏移应为 {expected_offset}')
+    expected_length = session.chunk_length(index)
+    if length != expected_length:
+        raise ChunkedUploadError(f'分块 {index} 的长度应为 {expected_length}')
+
+    # 条件更新：只有会话仍在上传中时才登记，与 complete_session 的认领互斥
+    claimed = UploadSession.objects.filter(pk=session.pk, status='uploading').update(
+        active_writers=F('active_writers') + 1, expires_at=_expiry(),
+    )
+    if not claimed:
+        raise ChunkedUploadConflict('上传会话已结束')
+    try:
+        written = 0
+        try:
+            f = open(get_staging_path(session), 'r+b')
+        except FileNotFoundError:
+            raise ChunkedUploadConflict('上传会话已失效')
+        with f:
+            f.seek(expected_offset)
+            while written < length:
+                data = stream.read(min(READ_BLOCK_SIZE, length - written))
+                if not data:
+                    break
+                f.write(data)
+                written += len(data)
+        if written != length:
+            raise ChunkedUploadError('分块数据不完整')
+        # 单条 INSERT ... ON CONFLICT DO UPDATE：不在事务中先读后写，SQLite 上按 busy_timeout 等待写锁，
+        # 而不是在读锁升级为写锁时立即报 database is locked
+        UploadChunk.objects.bulk_create(
+            [UploadChunk(session=session, index=index, size=written, received_at=timezone.now())],
+            update_conflicts=True,
+            unique_fields=['session', 'index'],
+            update_fields=['size', 'received_at'],
+        )
+    finally:
+        _release_writer(session)
+    return written
+
+
+def _release_writer(session):
+    """注销写入者登记，数据库被锁时重试；仍然失败时由 WRITER_LEASE 过期兜底"""
+    for attempt in range(RELEASE_ATTEMPTS):
+        try:
+            UploadSession.objects.filter(pk=session.pk, active_writers__gt=0).update(
+                active_writers=F('active_writers') - 1,
+            )
+            return
+        except OperationalError:
+            if attempt == RELEASE_ATTEMPTS - 1:
+                logger.warning('上传会话 %s 注销写入者失败，等待登记过期', session.pk, exc_info=True)
+                return
+            time.sleep(0.05 * 2 ** attempt)
+
+
+def received_chunks(session):
+    """已接收分块的序号列表"""
+    return list(session.chunks.values_list('index', flat=True))
+
+
+def missing_ranges(total_chunks, received):
+    """由升序的已接收序号计算缺失分块的闭区间 [[起, 止], ...]，耗时只与已接收数有关"""
+    ranges = []
+    start = 0
+    for index in received:
+        if index > start:
+            ranges.append([start, index - 1])
+        start = index + 1
+    if start < total_chunks:
+        ranges.append([start, total_chunks - 1])
+    return ranges
+
+
+def complete_session(session):
+    """所有分块到齐后将暂存文件移动到存储目录并创建文件记录"""
+    # 原子地将会话切换到合并状态，防止重复合并
+    # 还有分块正在写入时不能合并；最近一次登记（expires_at 随登记延长）已超过租期的写入者视为已结束
+    stale_writers = Q(expires_at__lt=_expiry() - WRITER_LEASE)
+    claimed = UploadSession.objects.filter(
+        Q(active_writers=0) | stale_writers, pk=session.pk, status='uploading',
+    ).update(status='assembling', active_writers=0, expires_at=_expiry())
+    if not claimed:
+        if UploadSession.objects.filter(pk=session.pk, status='uploading').exists():
+            raise ChunkedUploadConflict('还有分块正在上传，请稍后重试')
+        raise ChunkedUploadConflict('上传会话已结束')
+
+    try:
+        missing = session.total_chunks - session.chunks.count()
+        if missing:
+            raise ChunkedUploadError(f'还有 {missing} 个分块未上传')
+
+        if not os.path.exists(get_staging_path(session)):
+            raise ChunkedUploadConflict('上传会话已失效')
+
+        with transaction.atomic():
+            file_transfer = FileTransfer(
+                uploaded_by=session.uploaded_by,
+                original_name=session.original_name,
+                file_name=session.original_name,
+                file_size=session.file_size,
+                file_type=session.file_type,
+                description=session.description,
+                tags=session.tags,
+            )
+            # 分块可能乱序到达，合并时对暂存文件计算一次摘要
+            hasher = hash_path(get_staging_path(session))
+            file_transfer.sha256 = hasher.sha256
+            file_transfer.crc32 = hasher.crc32
+            # 暂存文件移动到去重存储，内容已存在时直接丢弃暂存文件
+            file_transfer.blob, _ = store_local_file(get_staging_path(session), digest=hasher.sha256)
+            file_transfer.file_path.name = file_transfer.blob.file.name
+            file_transfer.save()
+
+            session.status = 'completed'
+            session.file_transfer = file_transfer
+            session.save(update_fields=['status', 'file_transfer'])
+    except BaseException:
+        # 合并失败时恢复为上传中，客户端可补传或重试合并，否则会话会一直停留在合并状态
+        UploadSession.objects.filter(pk=session.pk, status='assembling').update(status='uploading')
+        raise
+    return file_transfer
+
+
+def purge_expired_sessions(now=None):
+    """删除过期仍未完成的上传会话及其暂存文件，返回删除的会话数
+
+    合并开始时会刷新有效期，过期仍处于合并状态的会话是合并进程中途退出留下的，一并清理。
+    """
+    now = now or timezone.now()
+    unfinished = ['uploading', 'assembling']
+    # 旧会话没有过期时间，按创建时间计算
+    expired = UploadSession.objects.filter(status__in=unfinished).filter(
+        Q(expires_at__lt=now) | Q(expires_at__isnull=True, created_at__lt=now - get_session_ttl())
+    )
+    purged = 0
+    for session in expired.only('pk'):
+        # 条件删除：期间有新的写入延长了有效期时跳过
+        deleted, _ = UploadSession.objects.filter(
+            Q(expires_at__lt=now) | Q(expires_at__isnull=True), pk=session.pk, status__in=unfinished,
+        ).delete()
+        if not deleted:
+            continue
+        purged += 1
+        try:
+            os.remove(get_staging_path(session))
+        except FileNotFoundError:
+            pass
+    return purged
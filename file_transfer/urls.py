@@ -10,8 +10,19 @@ urlpatterns = [
 	path('captcha/', views.generate_captcha, name='captcha'),
 	path('check-session/', views.check_session, name='check_session'),
 	path('', views.dashboard, name='dashboard'),
+	path('upload/', views.file_upload, name='file_upload'),
 	path('history/', views.file_history, name='file_history'),
 	path('detail/<int:file_id>/', views.file_detail, name='file_detail'),
 	path('download/<int:file_id>/', views.file_download, name='file_download'),
+	path('thumbnail/<int:file_id>/<slug:size>/', views.file_thumbnail, name='file_thumbnail'),
+	path('export/', views.file_export, name='file_export'),
 	path('delete/<int:file_id>/', views.file_delete, name='file_delete'),
+	path('api/files/', views.file_list_api, name='file_list_api'),
+	path('api/files/tags/', views.bulk_tag_api, name='bulk_tag_api'),
+	path('api/cache/stats/', views.cache_stats, name='cache_stats'),
+	path('metrics/', views.metrics_view, name='metrics'),
+	path('api/uploads/', views.chunked_upload_create, name='chunked_upload_create'),
+	path('api/uploads/<uuid:upload_id>/', views.chunked_upload_status, name='chunked_upload_status'),
+	path('api/uploads/<uuid:upload_id>/chunks/<int:index>/', views.chunked_upload_chunk, name='chunked_upload_chunk'),
+	path('api/uploads/<uuid:upload_id>/complete/', views.chunked_upload_complete, name='chunked_upload_complete'),
 ]
\ No newline at end of file
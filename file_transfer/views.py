@@ -1,66 +1,34 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
+from django.urls import reverse
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth import alogout, authenticate, login, logout
 from django.contrib import messages
-from django.http import HttpResponse, Http404, JsonResponse
-from django.core.paginator import Paginator
-from django.db.models import Q
+from django.http import FileResponse, HttpResponse, Http404, JsonResponse
 from django.utils import timezone
+from django.utils.http import urlencode
 from django.conf import settings
+from django.db import OperationalError
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST, require_http_methods
 import os
 import json
-import io
-import random
-import string
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
+from PIL import Image
 from .models import FileTransfer
 from .forms import FileUploadForm, UserRegistrationForm
-from django.db import models
-
-def _generate_captcha_text(length: int = 5) -> str:
-	return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
-
-def _generate_captcha_image(code: str) -> bytes:
-	width, height = 140, 44
-	image = Image.new('RGB', (width, height), (255, 255, 255))
-	draw = ImageDraw.Draw(image)
-	# 背景噪点
-	for _ in range(150):
-		x1 = random.randint(0, width)
-		y1 = random.randint(0, height)
-		draw.point((x1, y1), fill=(random.randint(150,200), random.randint(150,200), random.randint(150,200)))
-	
-	# 字体（回退到默认字体）
-	try:
-		font = ImageFont.truetype("arial.ttf", 28)
-	except Exception:
-		font = ImageFont.load_default()
-	
-	# 绘制字符
-	for i, ch in enumerate(code):
-		x = 15 + i * 22 + random.randint(-2, 2)
-		y = 10 + random.randint(-3, 3)
-		draw.text((x, y), ch, font=font, fill=(random.randint(0,120), random.randint(0,120), random.randint(0,120)))
-	
-	# 干扰线
-	for _ in range(5):
-		x1 = random.randint(0, width)
-		y1 = random.randint(0, height)
-		x2 = random.randint(0, width)
-		y2 = random.randint(0, height)
-		draw.line(((x1, y1), (x2, y2)), fill=(random.randint(120,180), random.randint(120,180), random.randint(120,180)), width=1)
-	
-	image = image.filter(ImageFilter.SMOOTH)
-	buf = io.BytesIO()
-	image.save(buf, 'PNG')
-	return buf.getvalue()
+from .downloads import build_download_response, stream_asynchronously
+from .search import search_file_transfers
+from .pagination import DEFAULT_PAGE_SIZE, InvalidCursor, bounded_count, paginate
+from .middleware import atouch_activity, get_inactivity_timeout, get_last_activity, parse_activity
+from .models import UploadSession
+from . import archives, caching, captcha, metrics, stats, tagging, thumbnails, uploads
 
 def generate_captcha(request):
-	"""生成验证码图片并保存到会话"""
-	code = _generate_captcha_text()
+	"""从预渲染池取出验证码图片并保存到会话"""
+	code, img_bytes = captcha.get_captcha()
 	request.session['login_captcha'] = code
-	img_bytes = _generate_captcha_image(code)
 	return HttpResponse(img_bytes, content_type='image/png')
 
 def custom_login(request):
@@ -98,28 +66,28 @@ def custom_logout(request):
     return redirect('file_transfer:custom_login')
 
 @csrf_exempt
-def check_session(request):
-    """检查会话状态的API端点"""
+async def check_session(request):
+    """检查会话状态的API端点（异步视图，心跳请求不占用线程池）"""
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
             action = data.get('action')
             
             if action == 'heartbeat':
-                # 更新最后活动时间
-                request.session['last_activity'] = timezone.now().isoformat()
+                # 更新最后活动时间（按粒度节流，避免每次心跳都写会话）
+                await atouch_activity(request)
                 return JsonResponse({'status': 'ok', 'message': 'Session updated'})
             
             elif action == 'check':
                 # 检查会话是否有效
-                if request.user.is_authenticated:
-                    last_activity = request.session.get('last_activity')
+                user = await request.auser()
+                if user.is_authenticated:
+                    last_activity = parse_activity(await request.session.aget('last_activity'))
                     if last_activity:
-                        last_activity = timezone.datetime.fromisoformat(last_activity)
-                        time_diff = timezone.now() - last_activity
+                        time_diff = timezone.now() - get_last_activity(request, last_activity)
                         
-                        if time_diff.total_seconds() > 300:  # 5分钟
-                            logout(request)
+                        if time_diff.total_seconds() > get_inactivity_timeout():  # 5分钟
+                            await alogout(request)
                             return JsonResponse({
                                 'status': 'expired', 
                                 'message': 'Session expired due to inactivity'
@@ -139,8 +107,13 @@ def file_upload(request):
     """文件上传视图"""
     if request.method == 'POST':
         form = FileUploadForm(request.POST, request.FILES)
-        if form.is_valid():
+        # 超过大小上限的上传在接收过程中已被上传处理器中止
+        upload_error = getattr(request, 'upload_error', None)
+        if upload_error:
+            messages.error(request, f'文件上传失败：{upload_error}')
+        elif form.is_valid():
             try:
+                # 文件落盘后立即返回，MIME 识别和缩略图由后台 worker 处理
                 file_transfer = form.save(user=request.user)
                 messages.success(request, f'文件 "{file_transfer.original_name}" 上传成功！')
                 return redirect('file_transfer:file_history')
@@ -154,38 +127,192 @@ def file_upload(request):
         'title': '文件上传'
     })
 
+def _upload_session_payload(session):
+    """分块上传会话的 JSON 表示"""
+    received = uploads.received_chunks(session)
+    return {
+        'upload_id': str(session.id),
+        'file_name': session.original_name,
+        'file_size': session.file_size,
+        'chunk_size': session.chunk_size,
+        'total_chunks': session.total_chunks,
+        'received_chunks': received,
+        # 缺失分块以闭区间 [起, 止] 表示
+        'missing_chunks': uploads.missing_ranges(session.total_chunks, received),
+        'upload_status': session.status,
+    }
+
+@login_required
+@require_POST
+def chunked_upload_create(request):
+    """创建分块上传会话"""
+    try:
+        data = json.loads(request.body)
+        session = uploads.create_session(
+            request.user,
+            original_name=data.get('file_name'),
+            file_size=data.get('file_size'),
+            file_type=data.get('file_type', ''),
+            chunk_size=data.get('chunk_size'),
+            description=data.get('description', ''),
+            tags=data.get('tags', ''),
+        )
+    except json.JSONDecodeError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+    except uploads.ChunkedUploadError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    
+    return JsonResponse({'status': 'ok', **_upload_session_payload(session)}, status=201)
+
+@login_required
+@require_GET
+def chunked_upload_status(request, upload_id):
+    """查询已接收的分块，用于断点续传"""
+    session = get_object_or_404(UploadSession, id=upload_id, uploaded_by=request.user)
+    return JsonResponse({'status': 'ok', **_upload_session_payload(session)})
+
+def _busy_response():
+    """数据库暂时被锁等可重试的错误，客户端稍后重传同一请求即可"""
+    response = JsonResponse({'status': 'error', 'message': '服务器繁忙，请稍后重试'}, status=503)
+    response['Retry-After'] = '1'
+    return response
+
+@login_required
+@require_http_methods(['PUT'])
+def chunked_upload_chunk(request, upload_id, index):
+    """上传单个分块，请求体为分块的原始字节"""
+    session = get_object_or_404(UploadSession, id=upload_id, uploaded_by=request.user)
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+        offset = request.GET.get('offset')
+        offset = int(offset) if offset is not None else None
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid offset or length'}, status=400)
+    
+    try:
+        written = uploads.write_chunk(session, index, request, length, offset=offset)
+    except uploads.ChunkedUploadConflict as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=409)
+    except uploads.ChunkedUploadError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    except OperationalError:
+        return _busy_response()
+    
+    return JsonResponse({'status': 'ok', 'index': index, 'size': written})
+
+@login_required
+@require_POST
+def chunked_upload_complete(request, upload_id):
+    """所有分块上传完成后合并为文件记录"""
+    session = get_object_or_404(UploadSession, id=upload_id, uploaded_by=request.user)
+    try:
+        file_transfer = uploads.complete_session(session)
+    except uploads.ChunkedUploadConflict as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=409)
+    except uploads.ChunkedUploadError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    except OperationalError:
+        return _busy_response()
+    
+    return JsonResponse({
+        'status': 'ok',
+        'file_id': file_transfer.id,
+        'detail_url': reverse('file_transfer:file_detail', args=[file_transfer.id]),
+    }, status=201)
+
 @login_required
-def file_download(request, file_id):
-    """文件下载视图"""
-    file_transfer = get_object_or_404(FileTransfer, id=file_id)
+async def file_download(request, file_id):
+    """文件下载视图（异步视图，ASGI 下文件内容逐块在线程池中读取，下载期间不占用线程）"""
+    file_transfer = await aget_object_or_404(FileTransfer, id=file_id)
     
     # 检查文件是否存在
-    if not os.path.exists(file_transfer.file_path.path):
+    if not await sync_to_async(os.path.exists, thread_sensitive=False)(file_transfer.file_path.path):
         raise Http404("文件不存在")
     
-    # 打开文件并返回响应
-    with open(file_transfer.file_path.path, 'rb') as f:
-        response = HttpResponse(f.read(), content_type=file_transfer.file_type)
-        response['Content-Disposition'] = f'attachment; filename="{file_transfer.original_name}"'
-        return response
+    # 分块流式返回文件，支持断点续传与条件请求
+    response = await sync_to_async(build_download_response, thread_sensitive=False)(request, file_transfer)
+    if isinstance(request, ASGIRequest):
+        stream_asynchronously(response)
+    return response
 
 @login_required
-def file_history(request):
-    """文件传输历史视图"""
+@require_http_methods(['GET', 'POST'])
+def file_export(request):
+    """将多个文件打包为 ZIP 流式下载
+
+    ids 参数（可重复或逗号分隔）指定要打包的文件；未指定时打包与传输历史当前筛选条件
+    （search、status、file_type、tag、tag_prefix）相同的文件。只能打包自己的文件。
+    """
+    params = request.POST if request.method == 'POST' else request.GET
+    raw_ids = [part for value in params.getlist('ids') for part in value.split(',') if part.strip()]
+    if raw_ids:
+        try:
+            ids = [int(pk) for pk in raw_ids]
+        except ValueError:
+            return JsonResponse({'status': 'error', 'message': 'ids 参数格式错误'}, status=400)
+        files = FileTransfer.objects.filter(uploaded_by=request.user, pk__in=ids).order_by('-uploaded_at', '-id')
+    else:
+        files, _, _ = _filtered_history(request)
+    
+    max_files = archives.get_max_files()
+    file_list = list(files[:max_files + 1])
+    if not file_list:
+        return JsonResponse({'status': 'error', 'message': '没有可打包的文件'}, status=404)
+    if len(file_list) > max_files:
+        return JsonResponse(
+            {'status': 'error', 'message': f'一次最多打包 {max_files} 个文件，请缩小筛选范围'}, status=400
+        )
+    response = archives.build_archive_response(file_list)
+    if isinstance(request, ASGIRequest):
+        # ASGI 下同步迭代器会被整体读入内存，改为逐块在线程池中生成
+        stream_asynchronously(response)
+    return response
+
+def _open_thumbnail(file_transfer, size):
+    """打开缩略图；已缓存的缩略图在打开前被并发删除（同内容的最后一个记录被删除）时重新生成一次"""
+    for attempt in range(2):
+        path = thumbnails.get_thumbnail(file_transfer, size)
+        if path is None:
+            return None
+        try:
+            return open(path, 'rb')
+        except FileNotFoundError:
+            if attempt:
+                raise
+
+@login_required
+def file_thumbnail(request, file_id, size):
+    """图片缩略图，首次请求时生成并缓存到磁盘"""
+    file_transfer = get_object_or_404(FileTransfer, id=file_id, uploaded_by=request.user)
+    
+    try:
+        thumbnail = _open_thumbnail(file_transfer, size)
+    except (OSError, Image.DecompressionBombError):
+        # 原文件缺失或无法解码
+        raise Http404("无法生成缩略图")
+    if thumbnail is None:
+        raise Http404("不支持的缩略图")
+    
+    response = FileResponse(thumbnail, content_type=thumbnails.get_content_type())
+    # 缩略图按内容摘要缓存，内容不变时浏览器可长期缓存
+    response['Cache-Control'] = 'private, max-age=86400'
+    return response
+
+def _filtered_history(request):
+    """根据查询参数构建当前用户的文件查询，返回 (查询集, 查询参数, 是否按相关度排序)"""
     # 获取查询参数
     search_query = request.GET.get('search', '')
     status_filter = request.GET.get('status', '')
     file_type_filter = request.GET.get('file_type', '')
+    tag_filter = request.GET.get('tag', '').strip()
+    tag_prefix_filter = request.GET.get('tag_prefix', '').strip()
     
     # 构建查询
     files = FileTransfer.objects.filter(uploaded_by=request.user)
     
     if search_query:
-        files = files.filter(
-            Q(original_name__icontains=search_query) |
-            Q(description__icontains=search_query) |
-            Q(tags__icontains=search_query)
-        )
+        # 全文检索，按相关度排序
+        files = search_file_transfers(files, search_query, owner=request.user)
     
     if status_filter:
         files = files.filter(status=status_filter)
@@ -193,23 +320,142 @@ def file_history(request):
     if file_type_filter:
         files = files.filter(file_type__icontains=file_type_filter)
     
-    # 分页
-    paginator = Paginator(files, 20)  # 每页显示20个文件
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    if tag_filter or tag_prefix_filter:
+        # 规范化标签的精确或前缀匹配，"doc" 不会匹配到 "docker"
+        files = tagging.filter_by_tag(files, tag=tag_filter, prefix=tag_prefix_filter)
+    
+    filters = {
+        'search_query': search_query,
+        'status_filter': status_filter,
+        'file_type_filter': file_type_filter,
+        'tag_filter': tag_filter,
+        'tag_prefix_filter': tag_prefix_filter,
+    }
+    return files, filters, bool(search_query)
+
+def _serialize_file(file_transfer):
+    """文件记录的 JSON 表示"""
+    return {
+        'id': file_transfer.id,
+        'original_name': file_transfer.original_name,
+        'file_size': file_transfer.file_size,
+        'file_type': file_transfer.file_type,
+        'status': file_transfer.status,
+        'uploaded_at': file_transfer.uploaded_at.isoformat(),
+        'completed_at': file_transfer.completed_at.isoformat() if file_transfer.completed_at else None,
+        'description': file_transfer.description,
+        'tags': file_transfer.tags,
+        'tag_names': file_transfer.get_tag_list(),
+        'sha256': file_transfer.sha256,
+        'detail_url': reverse('file_transfer:file_detail', args=[file_transfer.id]),
+        'download_url': reverse('file_transfer:file_download', args=[file_transfer.id]),
+    }
+
+@login_required
+def file_history(request):
+    """文件传输历史视图"""
+    files, filters, ranked = _filtered_history(request)
+    cursor = request.GET.get('cursor')
+    
+    def load_page():
+        # 游标分页，每页显示20个文件；无效游标回到第一页
+        try:
+            page_obj = paginate(files, cursor, ranked=ranked)
+        except InvalidCursor:
+            page_obj = paginate(files, ranked=ranked)
+        # 只统计到上限，避免对大量记录执行完整的 COUNT(*)
+        return (page_obj, *bounded_count(files))
+    
+    page_obj, total_count, count_is_exact = caching.get_or_set(
+        request.user.pk, 'history', (cursor, *filters.values()), load_page
+    )
     
     # 获取状态选项用于筛选
     status_choices = FileTransfer.STATUS_CHOICES
     
     return render(request, 'file_transfer/history.html', {
         'page_obj': page_obj,
-        'search_query': search_query,
-        'status_filter': status_filter,
-        'file_type_filter': file_type_filter,
+        'total_count': total_count,
+        'count_is_exact': count_is_exact,
+        # 翻页链接需要保留的筛选条件
+        'filter_querystring': urlencode({k: v for k, v in request.GET.items() if k in ('search', 'status', 'file_type', 'tag', 'tag_prefix') and v}),
+        **filters,
         'status_choices': status_choices,
         'title': '传输历史'
     })
 
+def _file_list_data(request):
+    files, filters, ranked = _filtered_history(request)
+    cursor = request.GET.get('cursor')
+    page_size = request.GET.get('page_size', DEFAULT_PAGE_SIZE)
+    count_mode = request.GET.get('count')
+    
+    def load_page():
+        page = paginate(files, cursor, page_size, ranked=ranked)
+        data = {
+            'status': 'ok',
+            'results': [_serialize_file(f) for f in page],
+            'next': page.next_cursor,
+            'previous': page.previous_cursor,
+        }
+        if count_mode == 'exact':
+            data['count'], data['count_is_exact'] = files.count(), True
+        elif count_mode == 'approximate':
+            data['count'], data['count_is_exact'] = bounded_count(files)
+        return data
+    
+    return caching.get_or_set(
+        request.user.pk, 'file_list_api', (cursor, page_size, count_mode, *filters.values()), load_page
+    )
+
+@login_required
+@require_GET
+async def file_list_api(request):
+    """文件列表 JSON 接口，参数与传输历史相同，使用 cursor 翻页
+
+    count=exact 返回精确总数，count=approximate 返回有上限的近似总数，默认不统计。
+    查询和缓存读写在一次 sync_to_async 调用中完成。
+    """
+    try:
+        data = await sync_to_async(_file_list_data)(request)
+    except (InvalidCursor, ValueError) as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    return JsonResponse(data)
+
+@login_required
+@require_POST
+def bulk_tag_api(request):
+    """批量编辑当前用户文件的标签
+
+    请求体为 JSON：{"ids": [...], "add": [...], "remove": [...]}，
+    按批执行固定次数的查询，返回标签发生变化的记录数。
+    """
+    try:
+        data = json.loads(request.body)
+        ids = [int(pk) for pk in data.get('ids', [])]
+        add = [str(name) for name in data.get('add', [])]
+        remove = [str(name) for name in data.get('remove', [])]
+    except json.JSONDecodeError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+    except (AttributeError, TypeError, ValueError):
+        return JsonResponse({'status': 'error', 'message': 'ids/add/remove 参数格式错误'}, status=400)
+    
+    files = FileTransfer.objects.filter(uploaded_by=request.user, pk__in=ids)
+    updated = tagging.bulk_edit_tags(files, add=add, remove=remove)
+    return JsonResponse({'status': 'ok', 'updated': updated})
+
+@staff_member_required
+@require_GET
+def cache_stats(request):
+    """当前进程的页面缓存命中/未命中统计（仅管理员）"""
+    return JsonResponse({'status': 'ok', 'pid': os.getpid(), 'caches': caching.get_stats()})
+
+@staff_member_required
+@require_GET
+def metrics_view(request):
+    """当前进程的请求指标，Prometheus 文本格式（仅管理员）"""
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @login_required
 def file_detail(request, file_id):
     """文件详情视图"""
@@ -227,11 +473,11 @@ def file_delete(request, file_id):
     
     if request.method == 'POST':
         try:
-            # 删除物理文件
-            if os.path.exists(file_transfer.file_path.path):
+            # 旧版本上传的文件未进入去重存储，直接删除物理文件
+            if not file_transfer.blob_id and os.path.exists(file_transfer.file_path.path):
                 os.remove(file_transfer.file_path.path)
             
-            # 删除数据库记录
+            # 删除数据库记录，共享的 Blob 在最后一个引用释放时删除
             file_transfer.delete()
             messages.success(request, f'文件 "{file_transfer.original_name}" 已删除')
             return redirect('file_transfer:file_history')
@@ -246,39 +492,17 @@ def file_delete(request, file_id):
 @login_required
 def dashboard(request):
     """仪表板视图"""
-    # 获取统计数据
-    total_files = FileTransfer.objects.filter(uploaded_by=request.user).count()
-    total_size = FileTransfer.objects.filter(uploaded_by=request.user).aggregate(
-        total_size=models.Sum('file_size')
-    )['total_size'] or 0
-    
-    # 按状态统计
-    status_stats = {}
-    for status_code, status_name in FileTransfer.STATUS_CHOICES:
-        count = FileTransfer.objects.filter(
-            uploaded_by=request.user, 
-            status=status_code
-        ).count()
-        status_stats[status_name] = count
-    
-    # 最近上传的文件
-    recent_files = FileTransfer.objects.filter(
-        uploaded_by=request.user
-    ).order_by('-uploaded_at')[:5]
-    
-    # 按文件类型统计
-    file_type_stats = FileTransfer.objects.filter(
-        uploaded_by=request.user
-    ).values('file_type').annotate(
-        count=models.Count('id')
-    ).order_by('-count')[:10]
+    def load_dashboard():
+        # 统计数据（总数、总大小、按状态和文件类型的计数）来自增量维护的计数表，一次查询
+        user_stats = stats.get_user_stats(request.user)
+        # 最近上传的文件
+        user_stats['recent_files'] = list(FileTransfer.objects.filter(
+            uploaded_by=request.user
+        ).order_by('-uploaded_at')[:5])
+        return user_stats
     
     return render(request, 'file_transfer/dashboard.html', {
-        'total_files': total_files,
-        'total_size': total_size,
-        'status_stats': status_stats,
-        'recent_files': recent_files,
-        'file_type_stats': file_type_stats,
+        **caching.get_or_set(request.user.pk, 'dashboard', (), load_dashboard),
         'title': '仪表板'
     })
 
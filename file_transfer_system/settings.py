@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+from datetime import timedelta
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,15 +42,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'file_transfer.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'file_transfer.middleware.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'file_transfer.middleware.SessionTimeoutMiddleware',
-    'file_transfer.middleware.ActivityTrackingMiddleware',
+    'file_transfer.middleware.SessionActivityMiddleware',
 ]
 
 ROOT_URLCONF = 'file_transfer_system.urls'
@@ -79,9 +81,28 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    # 只读副本示例（加入 DATABASE_REPLICAS 后生效）：
+    # 'replica': {
+    #     'ENGINE': 'django.db.backends.postgresql',
+    #     'NAME': 'file_transfer',
+    #     'HOST': 'replica.internal',
+    # },
 }
 
+# 读写分离：file_transfer 的读查询分发到 DATABASE_REPLICAS 中的副本，写入发往 DATABASE_PRIMARY；
+# 写入后 DATABASE_PRIMARY_PIN_SECONDS 秒内同一客户端的读取固定到主库，避开复制延迟
+DATABASE_ROUTERS = ['file_transfer.routers.PrimaryReplicaRouter']
+DATABASE_PRIMARY = 'default'
+DATABASE_REPLICAS = []
+DATABASE_PRIMARY_PIN_SECONDS = 5
+
+# SQLite 生产模式：WAL 日志、调优的 PRAGMA，写事务以 BEGIN IMMEDIATE 开始并在锁冲突时重试，
+# 缓解并发上传和会话保存时的 "database is locked"。PRAGMA 可在 OPTIONS['pragmas'] 中覆盖
+SQLITE_PRODUCTION_MODE = False
+if SQLITE_PRODUCTION_MODE:
+    DATABASES['default']['ENGINE'] = 'file_transfer.sqlite_backend'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -127,15 +148,83 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# 上传文件按文件名哈希分散到两级目录（uploads/ab/cd/），避免同一天的上传堆在一个目录中
+STORAGES = {
+    'default': {'BACKEND': 'file_transfer.storage.ShardedFileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+FILE_STORAGE_MAX_DIR_ENTRIES = 10000  # 单个目录的条目数达到该值时，新文件放入更深一级的目录
+
+# 文件下载配置
+FILE_DOWNLOAD_BLOCK_SIZE = 64 * 1024  # 流式下载每次读取的字节数
+# 文件发送方式：'stream'（Django 流式发送）、'x-accel-redirect'（nginx）、'x-sendfile'（Apache/lighttpd）
+FILE_DOWNLOAD_BACKEND = 'stream'
+FILE_DOWNLOAD_ACCEL_PREFIX = '/protected-media/'  # nginx internal location 前缀
+# 下载压缩：按 Accept-Encoding 协商，br / zstd 需要安装 brotli / zstandard
+FILE_COMPRESSION_ENCODINGS = ['zstd', 'br', 'gzip']  # 服务端优先顺序
+FILE_COMPRESSION_MIN_SIZE = 1024  # 小于该大小的文件不压缩
+FILE_COMPRESSION_CACHE_MIN_HITS = 2  # 同一内容被压缩下载该次数后缓存压缩结果（0 为不缓存）
+
+# 上传处理器：接收数据时同步计算 SHA-256 / CRC32；大文件直接写入 MEDIA_ROOT 下的暂存目录，
+# 保存时 os.replace 到最终位置（不经过系统临时目录再拷贝），超过大小上限时立即中止接收
+FILE_UPLOAD_HANDLERS = [
+    'file_transfer.upload_handlers.HashingMemoryFileUploadHandler',
+    'file_transfer.upload_handlers.HashingStagedFileUploadHandler',
+]
+FILE_UPLOAD_INCOMING_DIR = 'incoming'  # MEDIA_ROOT 下普通上传的暂存目录
+FILE_UPLOAD_INCOMING_MAX_AGE = timedelta(hours=1)  # 暂存文件超过该时间未写入即视为遗留，由 worker 启动时和 purge_upload_sessions 清理
+FILE_UPLOAD_COMPUTE_CRC32 = True  # 额外计算 CRC32 快速校验值
+
+# 缩略图配置
+FILE_THUMBNAIL_FORMAT = 'WEBP'  # WEBP 或 JPEG
+FILE_THUMBNAIL_QUALITY = 80
+FILE_THUMBNAIL_EAGER = True  # 后台处理上传文件时预先生成所有尺寸的缩略图
+
+# 后台处理配置
+FILE_PROCESSING_LEASE = timedelta(minutes=10)  # worker 认领记录后的租期，超时仍未完成的记录退回待处理由其他 worker 重新认领
+
+# 分块上传配置
+FILE_UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024  # 默认分块大小
+FILE_UPLOAD_STAGING_DIR = 'chunked'  # MEDIA_ROOT 下的暂存目录
+FILE_UPLOAD_MIN_CHUNK_SIZE = 256 * 1024  # 客户端可指定的最小分块（整个文件只有一块时不限）
+FILE_UPLOAD_MAX_CHUNK_SIZE = 16 * 1024 * 1024  # 客户端可指定的最大分块
+FILE_UPLOAD_MAX_CHUNKS = 10000  # 单个上传会话的分块数上限
+FILE_UPLOAD_SESSION_TTL = timedelta(hours=24)  # 最后一次写入分块后会话的有效期，过期由 purge_upload_sessions 清理
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# 缓存配置：页面数据缓存由 web 进程和独立的 process_uploads worker 共同失效，必须使用进程间共享的后端
+# （文件缓存、Redis 或数据库缓存）；使用进程内存缓存时页面数据不缓存，见 FILE_CACHE_ALLOW_PROCESS_LOCAL
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+    },
+}
+FILE_CACHE_ALIAS = 'default'  # 页面数据缓存使用的缓存
+FILE_CACHE_ALLOW_PROCESS_LOCAL = False  # 确认为单进程部署（且不运行独立 worker）时可设为 True 以使用 LocMemCache
+FILE_CACHE_TIMEOUT = 300  # 仪表板统计、历史列表和详情片段的缓存时间（秒）
+
+# 请求指标：按 URL 名称统计耗时、查询和收发字节数，管理员可在 /metrics/ 以 Prometheus 格式抓取
+METRICS_ENABLED = True
+METRICS_SLOW_REQUEST_SECONDS = None  # 超过该耗时（秒）的请求记录 WARNING 日志及最慢的查询，None 为不记录
+METRICS_SLOW_REQUEST_SAMPLE_RATE = 1.0  # 慢请求日志的采样比例
+
 # 会话配置
-SESSION_COOKIE_AGE = 300  # 5分钟 = 300秒
+SESSION_INACTIVITY_TIMEOUT = 300  # 无操作自动登出时间（秒）
+SESSION_ACTIVITY_GRANULARITY = 30  # 最后活动时间的记录粒度（秒）
+# 会话存储的有效期从最后一次写入起算，粒度内的请求不写会话，需多保留一个粒度，由中间件按实际请求时间判断超时
+SESSION_COOKIE_AGE = SESSION_INACTIVITY_TIMEOUT + SESSION_ACTIVITY_GRANULARITY
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
-SESSION_SAVE_EVERY_REQUEST = True
+# 不在每个请求都保存会话，最后活动时间由 SessionActivityMiddleware 按粒度更新
+SESSION_SAVE_EVERY_REQUEST = False
+
+# 验证码池配置：预渲染数量，低于低水位时后台补充（设为 0 则每次请求时渲染）
+CAPTCHA_POOL_SIZE = 200
+CAPTCHA_POOL_LOW_WATER = 50
 
 # 登录配置
 LOGIN_URL = '/login/'